@@ -0,0 +1,77 @@
+"""
+Benchmark repeated line scans of one big file read with each of
+Path's access hints.
+
+Each round drops the file from the page cache, scans it with the hint,
+then scans it again without one. 'once' should leave the second scan as
+cold as the first, where the others leave it warm. On Linux we also
+report how much of the file the first scan left in the page cache.
+
+    python bench/access.py [megabytes]
+
+Defaults to a 512MB file. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ffs import iosched, Path
+
+def cached(path):
+    "Return the fraction of PATH in the page cache, or None if we can't tell"
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'mincore'):
+        return None
+    size = os.path.getsize(str(path))
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vec = (ctypes.c_ubyte * pages)()
+    with open(str(path), 'rb') as fh:
+        mapped = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_COPY)
+        start = ctypes.c_char.from_buffer(mapped)
+        failed = libc.mincore(ctypes.c_void_p(ctypes.addressof(start)), ctypes.c_size_t(size), vec)
+        del start
+        mapped.close()
+    if failed:
+        return None
+    return sum(v & 1 for v in vec) / float(pages)
+
+def scan(path, access):
+    start = time.time()
+    for _ in path.lines('rb', access=access):
+        pass
+    return time.time() - start
+
+def timed(path, access):
+    with open(str(path), 'rb') as fh:
+        iosched.dontneed_pages(fh.fileno())
+    first = scan(path, access)
+    left = cached(path)
+    return first, scan(path, None), left
+
+def main(megabytes):
+    tdir = tempfile.mkdtemp()
+    try:
+        path = Path(tdir) / 'big.log'
+        line = b'x' * 99 + b'\n'
+        with open(str(path), 'wb') as fh:
+            for _ in range(megabytes):
+                fh.write(line * ((1 << 20) // len(line)))
+            fh.flush()
+            os.fsync(fh.fileno())
+        print('{0}MB file, {1} rounds'.format(megabytes, 3))
+        for access in (None, 'sequential', 'random', 'once'):
+            first, second, left = min(timed(path, access) for _ in range(3))
+            print('  {0:<12} scan {1:>6.3f}s  rescan {2:>6.3f}s  cached after scan {3}'.format(
+                str(access), first, second, '?' if left is None else '{0:.0%}'.format(left)))
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 512)
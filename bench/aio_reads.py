@@ -0,0 +1,55 @@
+"""
+Benchmark concurrent reads of many small files from asyncio: blocking
+Path.read() calls on the event loop, one executor trip per file with
+aio.run(), and Path.aread(), which batches them.
+
+    python bench/aio_reads.py [files]
+
+Defaults to 10,000 files of 1KB. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ffs import aio, Path
+
+def timed(label, fn, count):
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    print('{0:<26} {1:>8.2f}s {2:>12.0f} files/s'.format(label, elapsed, count / elapsed))
+    return elapsed, result
+
+async def blocking(paths):
+    return [p.read() for p in paths]
+
+async def unbatched(paths):
+    return await asyncio.gather(*[aio.run(p.read) for p in paths])
+
+async def batched(paths):
+    return await asyncio.gather(*[p.aread() for p in paths])
+
+def main(count):
+    tdir = tempfile.mkdtemp()
+    try:
+        paths = [Path(os.path.join(tdir, 'file{0}.txt'.format(i))) for i in range(count)]
+        for path in paths:
+            with open(str(path), 'w') as fh:
+                fh.write('x' * 1024)
+        aio.executor()
+        before, expected = timed('blocking read()', lambda: asyncio.run(blocking(paths)), count)
+        hops, one = timed('aio.run(read) per file', lambda: asyncio.run(unbatched(paths)), count)
+        after, two = timed('aread()', lambda: asyncio.run(batched(paths)), count)
+        assert expected == list(one) == list(two)
+        print('speedup: {0:.1f}x over per-file executor trips, {1:.1f}x over blocking'.format(
+            hops / after, before / after))
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,44 @@
+"""
+Benchmark small appends through Path << with and without an appender session.
+
+    python bench/appender.py [appends]
+
+Defaults to 1,000,000 appends of a short record.
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from ffs import Path
+
+def timed(label, fn, count):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print('{0:<22} {1:>8.2f}s {2:>12.0f} appends/s'.format(label, elapsed, count / elapsed))
+    return elapsed
+
+def main(count):
+    record = 'record 0123456789\n'
+    with Path.temp() as tmp:
+        plain = tmp/'plain.log'
+        session = tmp/'session.log'
+        plain.touch()
+
+        def appends():
+            for _ in range(count):
+                plain << record
+
+        def appender():
+            with session.appender():
+                for _ in range(count):
+                    session << record
+
+        before = timed('Path << (reopen)', appends, count)
+        after = timed('Path.appender()', appender, count)
+        assert plain.size == session.size == len(record) * count
+        print('speedup: {0:.1f}x'.format(before / after))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,40 @@
+"""
+Benchmark ffs.basen against the old reverse-and-filter implementation,
+and ffs.basen_many over the whole collection.
+
+    python bench/basen.py [paths]
+
+Defaults to 1,000,000 paths of eight components.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import ffs
+
+def old_basen(path, num=1):
+    return os.sep.join(list(reversed([e for i, e in enumerate(reversed(path.split(os.sep))) if i < num])))
+
+def timed(label, fn, count):
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    print('{0:<26} {1:>8.2f}s {2:>12.0f} paths/s'.format(label, elapsed, count / elapsed))
+    return elapsed, result
+
+def main(count):
+    paths = ['/srv/data/{0}/{1}/{2}/logs/app/{3}.log'.format(i % 7, i % 101, i % 997, i)
+             for i in range(count)]
+    for num in 1, 3:
+        print('num={0}'.format(num))
+        before, old = timed('  old basen()', lambda: [old_basen(p, num) for p in paths], count)
+        after, new = timed('  basen()', lambda: [ffs.basen(p, num) for p in paths], count)
+        bulk, many = timed('  basen_many()', lambda: ffs.basen_many(paths, num), count)
+        assert old == new == many
+        print('  speedup: {0:.1f}x basen(), {1:.1f}x basen_many()'.format(
+            before / after, before / bulk))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
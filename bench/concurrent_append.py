@@ -0,0 +1,65 @@
+"""
+Stress benchmark for concurrent appends from several processes.
+
+    python bench/concurrent_append.py [processes] [records-per-process]
+
+Each process appends records of mixed sizes - mostly small, with the
+occasional one of several kilobytes - to the same file through
+Path.appender(concurrent=True). We then report throughput and check
+that every record arrived whole.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import sys
+import time
+
+from ffs import Path
+
+def record(worker, seq):
+    size = 8192 if seq % 100 == 0 else seq % 200
+    return '{0}:{1}:{2}'.format(worker, seq, 'x' * size)
+
+def append(target, worker, count):
+    target = Path(target)
+    with target.appender(concurrent=True):
+        for seq in range(count):
+            target << record(worker, seq)
+
+def verify(target, processes, count):
+    torn, seen = 0, set()
+    with open(str(target)) as fh:
+        for line in fh:
+            try:
+                worker, seq, _ = line.rstrip('\n').split(':')
+                if line.rstrip('\n') != record(int(worker), int(seq)):
+                    raise ValueError(line)
+                seen.add((int(worker), int(seq)))
+            except ValueError:
+                torn += 1
+    missing = processes * count - len(seen)
+    return torn, missing
+
+def main(processes, count):
+    with Path.temp() as tmp:
+        target = tmp/'shared.log'
+        workers = [multiprocessing.Process(target=append, args=(str(target), w, count))
+                   for w in range(processes)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+        total = processes * count
+        print('{0} processes x {1} records: {2:.2f}s, {3:.0f} records/s, {4:.1f} MB/s'.format(
+                processes, count, elapsed, total / elapsed,
+                target.size / elapsed / (1 << 20)))
+        torn, missing = verify(target, processes, count)
+        print('torn records: {0}, missing records: {1}'.format(torn, missing))
+        if torn or missing:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count(),
+         int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
@@ -0,0 +1,52 @@
+"""
+Benchmark stat() and open() of the files in one deep directory through
+DiskFilesystem and DirFDFilesystem, at several depths.
+
+    python bench/dirfd.py [files]
+
+Defaults to 500 files per directory. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ffs import filesystem
+
+def timed(fs, names, rounds=20):
+    start = time.time()
+    for _ in range(rounds):
+        for name in names:
+            fs.stat(name)
+            fs.is_leaf(name)
+    stats = time.time() - start
+    start = time.time()
+    for name in names:
+        with fs.open(name, 'rb') as fh:
+            fh.read()
+    return stats, time.time() - start
+
+def main(count):
+    for depth in 4, 16, 64:
+        tdir = tempfile.mkdtemp()
+        try:
+            dirname = os.path.join(tdir, *['level{0:02d}'.format(i) for i in range(depth)])
+            os.makedirs(dirname)
+            names = [os.path.join(dirname, 'file{0}'.format(i)) for i in range(count)]
+            for name in names:
+                open(name, 'w').close()
+            print('depth={0}'.format(depth))
+            disk = timed(filesystem.DiskFilesystem(), names)
+            dirfd = timed(filesystem.DirFDFilesystem(), names)
+            for label, result in ('  DiskFilesystem', disk), ('  DirFDFilesystem', dirfd):
+                print('{0:<20} stat {1:>6.3f}s open {2:>6.3f}s'.format(label, *result))
+            print('  speedup: {0:.1f}x stat, {1:.1f}x open'.format(
+                disk[0] / dirfd[0], disk[1] / dirfd[1]))
+        finally:
+            shutil.rmtree(tdir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,60 @@
+"""
+Benchmark reading the same small files over and over through
+DiskFilesystem.open(), with and without an fdcache(), and with the
+cache's pread().
+
+    python bench/fdcache.py [files]
+
+Defaults to 500 files. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import ffs
+from ffs import filesystem
+
+def timed(fs, names, mode, rounds=20):
+    start = time.time()
+    for _ in range(rounds):
+        for name in names:
+            with fs.open(name, mode) as fh:
+                fh.read()
+    return time.time() - start
+
+def timed_pread(cache, names, rounds=20):
+    start = time.time()
+    for _ in range(rounds):
+        for name in names:
+            cache.pread(name, 4096, 0)
+    return time.time() - start
+
+def main(count):
+    tdir = tempfile.mkdtemp()
+    try:
+        names = [os.path.join(tdir, 'file{0}'.format(i)) for i in range(count)]
+        for name in names:
+            with open(name, 'w') as fh:
+                fh.write('hello world\n' * 10)
+        fs = filesystem.DiskFilesystem()
+        for mode in 'rb', 'r':
+            plain = timed(fs, names, mode)
+            with ffs.fdcache(max=count) as cache:
+                timed(fs, names, mode) # Warm the cache
+                cached = timed(fs, names, mode)
+            print('open({0!r}) {1:>6.3f}s, cached {2:>6.3f}s: {3:.1f}x'.format(
+                mode, plain, cached, plain / cached))
+        with ffs.fdcache(max=count) as cache:
+            timed_pread(cache, names)
+            pread = timed_pread(cache, names)
+        print('pread()    {0:>6.3f}s: {1:.1f}x on open(\'rb\')'.format(
+            pread, timed(fs, names, 'rb') / pread))
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,53 @@
+"""
+Benchmark ffs.lsmtime over a tree, with and without an mtime index.
+
+    python bench/lsmtime.py [files]
+
+Defaults to 200,000 files spread over 1,000 directories. The indexed
+run is timed after a first call has built the index, with one
+directory changed in between.
+"""
+from __future__ import print_function
+
+import datetime
+import os
+import sys
+import time
+
+import ffs
+from ffs import Path
+
+def timed(label, fn):
+    start = time.time()
+    result = fn()
+    elapsed = time.time() - start
+    print('{0:<26} {1:>8.2f}s'.format(label, elapsed))
+    return elapsed, result
+
+def main(count):
+    lessthan = datetime.datetime(2000, 1, 1)
+    with Path.temp() as tmp:
+        tree = tmp / 'tree'
+        for i in range(count):
+            fpath = os.path.join(str(tree), str(i % 1000), str(i))
+            if i < 1000:
+                os.makedirs(os.path.dirname(fpath))
+            open(fpath, 'w').close()
+            if i % 2:
+                os.utime(fpath, (1, 1))
+        index = str(tmp / 'index.json')
+
+        ffs.lsmtime(tree, lessthan, index=index)
+        open(os.path.join(str(tree), '0', 'added'), 'w').close()
+
+        before, full = timed('lsmtime() full scan', lambda: ffs.lsmtime(tree, lessthan))
+        after, indexed = timed('lsmtime(index=...)', lambda: ffs.lsmtime(
+            tree, lessthan, index=index))
+        trusted, _ = timed('lsmtime(verify=False)', lambda: ffs.lsmtime(
+            tree, lessthan, index=index, verify=False))
+        assert sorted(full) == sorted(indexed)
+        print('speedup: {0:.1f}x verified, {1:.1f}x trusted'.format(
+            before / after, before / trusted))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
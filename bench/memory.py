@@ -0,0 +1,42 @@
+"""
+Benchmark the scratch-work pattern of tests and ETL stages on Path
+(real disk) against MemoryPath.
+
+    python bench/memory.py [files]
+
+Defaults to 2,000 files: each is created, appended to, read back,
+listed and copied, and then the tree is removed.
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+from ffs import MemoryPath, Path
+
+def workload(klass, count):
+    with klass.temp() as tmp:
+        for i in range(count):
+            doc = tmp / 'dir{0}'.format(i % 20) / 'doc{0}.txt'.format(i)
+            doc << 'record {0}\n'.format(i)
+            doc << 'another line\n'
+            assert doc.is_file
+            doc.contents
+        for sub in tmp.ls():
+            sub.ls()
+        (tmp / 'dir0').cp(tmp / 'copy')
+
+def timed(label, klass, count):
+    start = time.time()
+    workload(klass, count)
+    elapsed = time.time() - start
+    print('{0:<12} {1:>8.2f}s {2:>10.0f} files/s'.format(label, elapsed, count / elapsed))
+    return elapsed
+
+def main(count):
+    before = timed('Path', Path, count)
+    after = timed('MemoryPath', MemoryPath, count)
+    print('speedup: {0:.1f}x'.format(before / after))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,44 @@
+"""
+Benchmark streaming a large file out through Path.open('wb') in small
+writes, with and without an expected_size= hint.
+
+    python bench/preallocate.py [megabytes]
+
+Defaults to a 256MB file. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ffs import Path
+
+def timed(path, megabytes, expected_size=None):
+    chunk = b'x' * 4096
+    start = time.time()
+    with path.open('wb', expected_size=expected_size) as fh:
+        for _ in range(megabytes * 256):
+            fh.write(chunk)
+        fh.flush()
+        os.fsync(fh.fileno())
+    took = time.time() - start
+    os.unlink(str(path))
+    return took
+
+def main(megabytes):
+    tdir = tempfile.mkdtemp()
+    try:
+        path = Path(tdir) / 'big.out'
+        size = megabytes << 20
+        plain = min(timed(path, megabytes) for _ in range(3))
+        hinted = min(timed(path, megabytes, size) for _ in range(3))
+        print('{0}MB in 4KB writes: plain {1:>6.3f}s  expected_size {2:>6.3f}s  {3:.2f}x'.format(
+            megabytes, plain, hinted, plain / hinted))
+    finally:
+        shutil.rmtree(tdir)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
@@ -0,0 +1,70 @@
+"""
+Benchmark the temporary files and directories a request handler might
+use: Path.temp() against mkdtemp() and rmtree(), and Path.scratch()
+against a named temporary file.
+
+    python bench/scratch.py [rounds]
+
+Defaults to 2000 rounds. Set TMPDIR to benchmark another mount.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from ffs import filesystem, Path
+
+def timed(func, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        func()
+    return time.time() - start
+
+def mkdtemp_rmtree_empty():
+    shutil.rmtree(tempfile.mkdtemp())
+
+def pooled_empty():
+    with Path.temp():
+        pass
+
+def mkdtemp_rmtree():
+    tdir = tempfile.mkdtemp()
+    for name in 'a', 'b', 'c':
+        with open(os.path.join(tdir, name), 'wb') as fh:
+            fh.write(b'x' * 100)
+    shutil.rmtree(tdir)
+
+def pooled():
+    with Path.temp() as tdir:
+        for name in 'a', 'b', 'c':
+            with open(os.path.join(str(tdir), name), 'wb') as fh:
+                fh.write(b'x' * 100)
+
+def named():
+    fd, name = tempfile.mkstemp()
+    with os.fdopen(fd, 'w+b') as fh:
+        fh.write(b'x' * 100)
+    os.unlink(name)
+
+def scratch():
+    with Path.scratch() as fh:
+        fh.write(b'x' * 100)
+
+def main(rounds):
+    for label, before, after in (('empty dir ', mkdtemp_rmtree_empty, pooled_empty),
+                                 ('3 files   ', mkdtemp_rmtree, pooled)):
+        before = timed(before, rounds)
+        after = timed(after, rounds)
+        filesystem._tempdirs.join()
+        print('{0} mkdtemp+rmtree {1:>6.3f}s  Path.temp() {2:>6.3f}s  {3:.1f}x'.format(
+            label, before, after, before / after))
+    before = timed(named, rounds)
+    after = timed(scratch, rounds)
+    print('temp file  mkstemp+unlink {0:>6.3f}s  Path.scratch() {1:>6.3f}s  {2:.1f}x'.format(
+        before, after, before / after))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -6,13 +6,17 @@ from __future__ import with_statement
 
 import datetime
 import errno
+import json
 import os
 import sys
 
-from ffs import exceptions, formats, nixargs
-from ffs.util import is_dir, is_file, hsize, size
-from ffs.nix import (cd, chmod, chown, cmp,
+from ffs import aio, exceptions, formats, iosched, nix, nixargs, parallel, writers
+from ffs.filesystem import fdcache
+from ffs.util import basen, basen_many, is_dir, is_file, hsize, size
+from ffs._py3k import scandir
+from ffs.nix import (cd, chmod, chown, cmp, cmp_tree,
                      cp, cp_r,
+                     du, find,
                      getwd,
                      ln, ln_s,
                      ls,
@@ -22,7 +26,7 @@ from ffs.nix import (cd, chmod, chown, cmp,
                      stat,
                      touch, unlink, which,
                      is_exe)
-from ffs.path import Path
+from ffs.path import CachedPath, DirFDPath, MemoryPath, Path
 from ffs._version import __version__
 
 ts2dt = datetime.datetime.utcfromtimestamp
@@ -33,18 +37,25 @@ else:
     OS = "LINUX!"
 
 __all__ = [
-    '__version__'
+    '__version__',
     # Modules
+    'aio',
     'exceptions',
     'formats',
+    'iosched',
     'nixargs',
+    'parallel',
+    'writers',
     # Nix helpers
     'cd',
     'chmod',
     'chown',
     'cmp',
+    'cmp_tree',
     'cp',
     'cp_r',
+    'du',
+    'find',
     'getwd',
     'ln',
     'ln_s',
@@ -64,48 +75,148 @@ __all__ = [
     'is_dir',
     'is_file',
     # Filesystem helpers
+    'fdcache',
     'size',
     'hsize',
     # Path
     'Path',
+    'CachedPath',
+    'DirFDPath',
+    'MemoryPath',
     ]
 
-def basen(path, num=1):
+MTIME_INDEX_VERSION = 1
+
+def _load_mtime_index(index, root):
     """
-    Return the last `num` components of `path`
+    Load the directory entries of the mtime index file INDEX, if it
+    exists and was built for ROOT. Otherwise start from scratch.
 
     Arguments:
-    - `path`: str
-    - `num`: int
+    - `index`: str
+    - `root`: str
 
-    Return: str
+    Return: dict
     Exceptions: None
     """
-    # Almost certainly a faster algorithm for this.
-    # See testcase in test_fs for expected results
-    return os.sep.join(list(reversed([e for i, e in enumerate(reversed(path.split(os.sep))) if i < num])))
+    try:
+        with open(index) as fh:
+            data = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != MTIME_INDEX_VERSION or data.get('root') != root:
+        return {}
+    return data['dirs']
+
+def _scan_mtimes(root, dirs):
+    """
+    Walk ROOT, returning an mtime index of every directory below it.
 
-def lsmtime(path, lessthan=None):
+    DIRS is the index from the last scan, mapping paths relative to
+    ROOT to (directory mtime, {file: mtime}, [subdirectory]). Where a
+    directory's own mtime is unchanged, no entries have been added,
+    removed or renamed in it, so we reuse the old entry rather than
+    listing and stat-ing its contents again.
+
+    Arguments:
+    - `root`: str
+    - `dirs`: dict
+
+    Return: (dict, bool) - the new index, and whether it differs
+    Exceptions: None
     """
-    Return a list of all files existing in `path`
+    scanned, changed = {}, False
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        top = os.path.join(root, rel)
+        try:
+            dmtime = nix._st_mtime_ns(os.lstat(top))
+        except OSError:
+            continue
+        old = dirs.get(rel)
+        if old is not None and old[0] == dmtime:
+            scanned[rel] = old
+        else:
+            files, subdirs = {}, []
+            try:
+                entries = list(scandir(top))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        files[entry.name] = nix._st_mtime_ns(entry.stat(follow_symlinks=False))
+                    except OSError:
+                        pass
+            scanned[rel] = [dmtime, files, sorted(subdirs)]
+            changed = True
+        stack.extend(os.path.join(rel, d) for d in reversed(scanned[rel][2]))
+    return scanned, changed or len(scanned) != len(dirs)
+
+def lsmtime(path, lessthan=None, index=None, verify=True):
+    """
+    Return a list of all files at or below `path`
     where their mtime is less than `lessthan`.
 
     The return is a list of strings which are absolute paths
     to the files.
 
+    `lessthan` is a (UTC) datetime, as ts2dt() makes, or anything else
+    nix.find() understands. Comparisons are between integer
+    nanoseconds, never datetimes.
+
+    If `index` is given, it names a file in which we keep the mtimes we
+    saw between calls. Later calls only list the directories whose own
+    mtime has changed. Editing a file in place doesn't change its
+    directory's mtime, so with `verify` we re-stat each file the index
+    claims is old before returning it. Pass verify=False to trust the
+    index outright.
+
     Arguments:
     - `path`: str
     - `lessthan`: DateTime
+    - `index`: str or Path
+    - `verify`: bool
 
     Return: [str,]
-    Exceptions: None
+    Exceptions: DoesNotExistError
     """
-    for base, dirs, files in os.walk(path):
-        ls = []
-        for fname in files:
-            fpath = os.path.join(base, fname)
-            # Don't rely on os.stat_float_times() == True
-            mtime = float(os.path.getmtime(fpath))
-            if ts2dt(mtime)< lessthan:
-                ls.append(fpath)
-        return ls
+    root = os.path.abspath(str(path))
+    if index is None:
+        return list(nix.find(root, type='f', older=lessthan))
+    if not os.path.isdir(root):
+        raise exceptions.DoesNotExistError(
+            "Can't lsmtime() in {0} - it isn't a directory Larry... ".format(root))
+
+    threshold = None if lessthan is None else nix._mtime_ns(lessthan)
+    dirs, changed = _scan_mtimes(root, _load_mtime_index(str(index), root))
+    ls = []
+    for rel in sorted(dirs):
+        files = dirs[rel][1]
+        top = os.path.join(root, rel)
+        for fname in sorted(files):
+            mtime = files[fname]
+            if threshold is not None and mtime >= threshold:
+                continue
+            fpath = os.path.join(top, fname)
+            if verify:
+                try:
+                    files[fname] = nix._st_mtime_ns(os.lstat(fpath))
+                except OSError:
+                    del files[fname]
+                    changed = True
+                    continue
+                if files[fname] != mtime:
+                    changed = True
+                    if threshold is not None and files[fname] >= threshold:
+                        continue
+            ls.append(fpath)
+
+    if changed:
+        data = json.dumps(dict(version=MTIME_INDEX_VERSION, root=root, dirs=dirs))
+        with writers.atomic_open(str(index)) as fh:
+            fh.write(data)
+    return ls
@@ -0,0 +1,136 @@
+"""
+Minimal ctypes binding to the Linux inotify API.
+
+Used by ffs.nix.tail() to sleep until a followed file changes rather
+than spinning in a polling loop. On platforms without inotify,
+Watcher() raises NotSupportedError and callers fall back to polling.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+from ffs import exceptions
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_EVENT = struct.Struct('iIII')
+_libc = None
+
+def _load_libc():
+    """
+    Find and load libc, checking that it exposes the inotify calls.
+
+    Return: ctypes.CDLL
+    Exceptions: NotSupportedError
+    """
+    global _libc
+    if _libc is not None:
+        return _libc
+    if not sys.platform.startswith('linux'):
+        raise exceptions.NotSupportedError('inotify is only available on Linux')
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+    except (OSError, AttributeError):
+        raise exceptions.NotSupportedError("Couldn't load inotify from libc")
+    _libc = libc
+    return libc
+
+class Watcher(object):
+    """
+    Watch the directory containing PATH, waking for any event that
+    concerns PATH's basename: writes, truncation, and the rename/create
+    pair that log rotation produces.
+
+    Watching the directory rather than the file means the watch
+    survives the file being replaced underneath us.
+    """
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE | IN_DELETE |
+            IN_MOVED_FROM | IN_MOVED_TO)
+
+    def __init__(self, path):
+        libc = _load_libc()
+        self.name = os.path.basename(str(path)).encode('utf-8')
+        dirname = os.path.dirname(os.path.abspath(str(path)))
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        wd = libc.inotify_add_watch(self.fd, dirname.encode('utf-8'), self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+
+    def wait(self, timeout=None):
+        """
+        Block until an event concerning our file arrives, or TIMEOUT
+        seconds pass.
+
+        Arguments:
+        - `timeout`: float or None
+
+        Return: bool - True if our file was touched
+        Exceptions: None
+        """
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error:
+            return False
+        if not ready:
+            return False
+        return self._drain()
+
+    def _drain(self):
+        """
+        Read every pending event, reporting whether any concerned our file.
+
+        Return: bool
+        Exceptions: None
+        """
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self.fd, 4096)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return relevant
+                raise
+            if not buf:
+                return relevant
+            offset = 0
+            while offset + _EVENT.size <= len(buf):
+                _, _, _, length = _EVENT.unpack_from(buf, offset)
+                offset += _EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self.name:
+                    relevant = True
+
+    def close(self):
+        """
+        Release the inotify descriptor.
+
+        Return: None
+        Exceptions: None
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
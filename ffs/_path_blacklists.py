@@ -4,7 +4,8 @@ ffs._path_blacklists
 To avoid editing two lists of methodnames when we change the Path ducktyping (test and code),
 we maintan the blacklists here.
 """
-_strblacklist = [
+# A frozenset, as Path.__getattribute__ checks every attribute lookup against it.
+_strblacklist = frozenset([
             'capitalize',
             'center',
             'count',
@@ -36,4 +37,4 @@ _strblacklist = [
             'zfill',
             'isnumeric',
             'isdecimal',
-            ]
+            ])
@@ -1,10 +1,81 @@
 """
 Py3k system compatibilities
 """
+import os
+import stat as _stat
+import threading
 
 try:
     FileKlass = file
 except NameError:
     from io import TextIOWrapper as FileKlass
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    class ContextVar(object):
+        """
+        Stand-in for contextvars.ContextVar where we don't have it, holding
+        one value per thread.
+        """
+        def __init__(self, name, default=None):
+            self.name = name
+            self._default = default
+            self._local = threading.local()
+
+        def get(self):
+            return getattr(self._local, 'value', self._default)
+
+        def set(self, value):
+            self._local.value = value
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+if scandir is None:
+    class DirEntry(object):
+        """
+        Minimal stand-in for os.DirEntry where neither os.scandir
+        nor the scandir backport are available.
+        """
+        def __init__(self, top, name):
+            self.name = name
+            self.path = os.path.join(top, name)
+            self._lstat = None
+
+        def stat(self, follow_symlinks=True):
+            if follow_symlinks:
+                return os.stat(self.path)
+            if self._lstat is None:
+                self._lstat = os.lstat(self.path)
+            return self._lstat
+
+        def inode(self):
+            return self.stat(follow_symlinks=False).st_ino
+
+        def is_symlink(self):
+            return _stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+        def is_dir(self, follow_symlinks=True):
+            try:
+                return _stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
+
+        def is_file(self, follow_symlinks=True):
+            try:
+                return _stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+            except OSError:
+                return False
 
+    def scandir(path='.'):
+        """
+        Yield a DirEntry for each name in the directory PATH.
+        """
+        for name in os.listdir(path):
+            yield DirEntry(path, name)
@@ -0,0 +1,378 @@
+"""
+ffs.aio
+
+Run filesystem work from asyncio code without blocking the event loop.
+
+Everything here hands blocking calls to a bounded pool of threads and
+returns futures, which asyncio code can await:
+
+>>> data = await aio.run(Path('big.csv').read)
+>>> async for line in aio.lines(Path('log.txt')):
+...     handle(line)
+
+Path's async methods (aread(), awrite(), alines(), acp(), als() and
+friends) are built on these.
+"""
+from __future__ import with_statement
+
+import collections
+import functools
+import multiprocessing
+import os
+import threading
+import weakref
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+from ffs import exceptions, nix
+
+# Threads in the executor we make if you don't configure() one.
+DEFAULT_WORKERS = min(32, multiprocessing.cpu_count() + 4)
+# At most this many small operations share one trip to the executor.
+BATCH_SIZE = 64
+# Reads and writes of more bytes than this are too big to batch: each
+# gets a trip of its own, rather than holding up the calls behind it.
+BATCH_MAX_BYTES = 1 << 16
+# Roughly how many bytes of a file lines() reads per trip to the executor.
+LINES_CHUNKSIZE = 1 << 16
+
+_executor = None
+_owned = False
+_lock = threading.RLock()
+# Small operations waiting to be sent to the executor, by event loop.
+_pending = weakref.WeakKeyDictionary()
+
+def configure(workers=None, executor=None):
+    """
+    Set the executor that runs our blocking calls: EXECUTOR, or a new
+    pool of WORKERS threads. An executor we made before is shut down
+    once its work is done.
+
+    Arguments:
+    - `workers`: int
+    - `executor`: concurrent.futures.Executor
+
+    Return: None
+    Exceptions: NotSupportedError
+    """
+    global _executor, _owned
+    if executor is None:
+        if ThreadPoolExecutor is None:
+            raise exceptions.NotSupportedError("No concurrent.futures Larry... ")
+        executor, owned = ThreadPoolExecutor(workers or DEFAULT_WORKERS), True
+    else:
+        owned = False
+    with _lock:
+        previous, previously_owned = _executor, _owned
+        _executor, _owned = executor, owned
+    if previous is not None and previously_owned:
+        previous.shutdown(wait=False)
+
+def executor():
+    """
+    Return the executor that runs our blocking calls, making a pool of
+    DEFAULT_WORKERS threads if none has been configured.
+
+    Return: concurrent.futures.Executor
+    Exceptions: NotSupportedError
+    """
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                configure()
+    return _executor
+
+def _loop():
+    """
+    Return the running event loop, or failing that, the current one.
+    """
+    if asyncio is None:
+        raise exceptions.NotSupportedError("No asyncio Larry... ")
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+def _future(loop):
+    create_future = getattr(loop, 'create_future', None)
+    return create_future() if create_future else asyncio.Future(loop=loop)
+
+def _bind(func, args, kw):
+    """
+    Return a callable that calls FUNC with ARGS and KW in the caller's
+    context - so that the worker thread sees, say, its logical working
+    directory.
+    """
+    call = functools.partial(func, *args, **kw)
+    if nix.contextvars is None:
+        return call
+    return functools.partial(nix.contextvars.copy_context().run, call)
+
+def run(func, *args, **kw):
+    """
+    Call FUNC with ARGS and KW in our executor.
+
+    Arguments:
+    - `func`: callable
+
+    Return: asyncio.Future
+    Exceptions: NotSupportedError
+    """
+    return _loop().run_in_executor(executor(), _bind(func, args, kw))
+
+def batch(func, *args, **kw):
+    """
+    Like run(), for calls so quick that the trip to the executor is most
+    of their cost.
+
+    The calls made in one iteration of the event loop are grouped, and
+    sent to the executor BATCH_SIZE at a time, so that - say - gathering
+    a thousand small reads costs a few dozen trips rather than a
+    thousand. Each call still gets its own future, result and errors.
+    A call with nothing to share a trip with goes on its own.
+
+    The calls in a group run one after another, so only batch calls
+    that are quick - see read() for big files.
+
+    Arguments:
+    - `func`: callable
+
+    Return: asyncio.Future
+    Exceptions: NotSupportedError
+    """
+    loop = _loop()
+    future = _future(loop)
+    pending = _pending.get(loop)
+    if pending is None:
+        pending = _pending[loop] = []
+        loop.call_soon(_flush, loop)
+    pending.append((_bind(func, args, kw), future))
+    return future
+
+def _flush(loop):
+    """
+    Send LOOP's pending calls to the executor.
+    """
+    pending = _pending.pop(loop, [])
+    if len(pending) == 1:
+        call, future = pending[0]
+        done = loop.run_in_executor(executor(), call)
+        done.add_done_callback(functools.partial(_chain, future))
+        return
+    for start in range(0, len(pending), BATCH_SIZE):
+        group = pending[start:start + BATCH_SIZE]
+        done = loop.run_in_executor(executor(), _call_all, [call for call, _ in group])
+        done.add_done_callback(functools.partial(_settle, [future for _, future in group]))
+
+def _chain(future, done):
+    """
+    Hand the outcome of the future DONE to FUTURE.
+    """
+    if future.done():
+        return
+    if done.cancelled():
+        future.cancel()
+    elif done.exception() is not None:
+        future.set_exception(done.exception())
+    else:
+        future.set_result(done.result())
+
+# What _read_small() returns for files too big to read in a batch.
+_TOO_BIG = object()
+
+def _read_small(path):
+    """
+    Worker: return the contents of the file PATH, as PATH.read(), or
+    _TOO_BIG without reading it if it is over BATCH_MAX_BYTES.
+    """
+    if path.is_dir:
+        raise TypeError("Reading a directory doesn't make any sense Larry... ")
+    with path.open('r') as fh:
+        try:
+            size = os.fstat(fh.fileno()).st_size
+        except (AttributeError, IOError, OSError, ValueError):
+            size = 0 # Not on disk - say, in memory.
+        if size > BATCH_MAX_BYTES:
+            return _TOO_BIG
+        return fh.read()
+
+def read(path):
+    """
+    Read the contents of the file PATH, as PATH.read().
+
+    Small files are read in a batch() with other quick calls. Those
+    over BATCH_MAX_BYTES are read in a trip to the executor of their
+    own, so they don't hold up the rest of their batch.
+
+    Arguments:
+    - `path`: Path
+
+    Return: asyncio.Future
+    Exceptions: NotSupportedError
+    """
+    future = _future(_loop())
+
+    def small(done):
+        if not done.cancelled() and done.exception() is None and done.result() is _TOO_BIG:
+            run(path.read).add_done_callback(functools.partial(_chain, future))
+        else:
+            _chain(future, done)
+
+    batch(_read_small, path).add_done_callback(small)
+    return future
+
+def write(func, contents, *args, **kw):
+    """
+    Call FUNC, which writes CONTENTS, with CONTENTS, ARGS and KW: in a
+    batch() if CONTENTS is small, else in a trip of its own.
+
+    Arguments:
+    - `func`: callable
+    - `contents`: stringtype or bytes
+
+    Return: asyncio.Future
+    Exceptions: NotSupportedError
+    """
+    send = run if len(contents) > BATCH_MAX_BYTES else batch
+    return send(func, contents, *args, **kw)
+
+def _call_all(calls):
+    """
+    Worker: make each of CALLS, returning (raised, value) for each.
+    """
+    results = []
+    for call in calls:
+        try:
+            results.append((False, call()))
+        except Exception as err:
+            results.append((True, err))
+    return results
+
+def _settle(futures, done):
+    """
+    Hand the results of a batch of calls to their FUTURES.
+    """
+    if done.cancelled():
+        results = [(True, asyncio.CancelledError())] * len(futures)
+    elif done.exception() is not None:
+        results = [(True, done.exception())] * len(futures)
+    else:
+        results = done.result()
+    for future, (raised, value) in zip(futures, results):
+        if future.done():
+            continue
+        if raised:
+            future.set_exception(value)
+        else:
+            future.set_result(value)
+
+
+class lines(object):
+    """
+    Asynchronously iterate over the lines of the file at PATH, opened
+    in MODE.
+
+    We read about CHUNKSIZE bytes of whole lines per trip to the
+    executor, rather than making one trip per line. The file is closed
+    once we reach its end, by aclose() - or when leaving an async with
+    block, which you want if you might stop early. Failing that we try
+    to close it when we are garbage collected, but that is best-effort:
+    an executor thread may keep us alive for a while after a read.
+
+    >>> async with aio.lines(Path('log.txt')) as lines:
+    ...     async for line in lines:
+    ...         handle(line)
+    """
+    def __init__(self, path, mode='r', chunksize=LINES_CHUNKSIZE):
+        # Reads and closes run on any of the executor's threads - so a
+        # close waits for a read in flight, rather than racing it.
+        self._lock = threading.RLock()
+        self.path = path
+        self.mode = mode
+        self.chunksize = chunksize
+        self._fh = None
+        self._closed = False
+        self._lines = collections.deque()
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    def __aenter__(self):
+        future = _future(_loop())
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, *exc_info):
+        return self.aclose()
+
+    def __del__(self):
+        self._close()
+
+    def _read(self):
+        """
+        Worker: return the next chunk of lines, closing the file at its end.
+        """
+        with self._lock:
+            if self._closed:
+                return []
+            if self._fh is None:
+                self._fh = self.path.fs.open(self.path._value, self.mode)
+            chunk = self._fh.readlines(self.chunksize)
+            if not chunk:
+                self._close()
+            return chunk
+
+    def _close(self):
+        lock = getattr(self, '_lock', None)
+        if lock is None:
+            return # __init__ never got going
+        with lock:
+            self._closed = True
+            fh, self._fh = self._fh, None
+            if fh is not None:
+                fh.close()
+
+    def __anext__(self):
+        future = _future(_loop())
+        if self._lines:
+            future.set_result(self._lines.popleft())
+            return future
+        if self._done:
+            raise StopAsyncIteration
+
+        def read(done):
+            if done.cancelled() or done.exception() is not None:
+                self._done = True
+                if not future.done():
+                    future.set_exception(done.exception() if not done.cancelled()
+                                         else asyncio.CancelledError())
+                return
+            self._lines.extend(done.result())
+            if not self._lines:
+                self._done = True
+                if not future.done():
+                    future.set_exception(StopAsyncIteration())
+            elif not future.done():
+                future.set_result(self._lines.popleft())
+
+        run(self._read).add_done_callback(read)
+        return future
+
+    def aclose(self):
+        """
+        Stop iterating, closing the file.
+
+        Return: asyncio.Future
+        Exceptions: None
+        """
+        self._done = True
+        self._lines.clear()
+        return run(self._close)
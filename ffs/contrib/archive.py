@@ -7,10 +7,86 @@ import zipfile
 
 import six
 
-from ffs import exceptions, nix, path
+from ffs import exceptions, filesystem, nix, path
 from ffs.filesystem import BaseFilesystem
 
-class TarFilesystem(BaseFilesystem):
+class MemberIndexMixin(object):
+    """
+    Answer the batched queries of an archive filesystem from an index
+    of its members, built the first time we need it.
+
+    Classes using this implement _iter_members().
+    """
+    _member_index = None
+
+    def _iter_members(self):
+        """
+        Yield (name, info, kind) for each member of our archive, where
+        KIND is BRANCH, LEAF or OTHER as for classify_many().
+        """
+        raise NotImplementedError("!")
+
+    def _index(self):
+        """
+        Return our member index: {name: (info, kind)}, including the
+        directories implied by the names of members within them.
+
+        Return: dict
+        Exceptions: None
+        """
+        if self._member_index is None:
+            index = {}
+            for name, info, kind in self._iter_members():
+                name = name.rstrip(self.sep)
+                index[name] = (info, kind)
+                parts = name.split(self.sep)
+                for i in range(1, len(parts)):
+                    index.setdefault(self.sep.join(parts[:i]), (None, filesystem.BRANCH))
+            self._member_index = index
+        return self._member_index
+
+    def stat_many(self, resources):
+        """
+        Return the member info of each of RESOURCES, or None for those
+        that don't exist (or are only implied by the names of others).
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: list
+        Exceptions: None
+        """
+        index = self._index()
+        return [index.get(str(r).rstrip(self.sep), (None, None))[0] for r in resources]
+
+    def exists_many(self, resources):
+        """
+        Return whether each of RESOURCES is in our archive.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: [bool]
+        Exceptions: None
+        """
+        index = self._index()
+        return [str(r).rstrip(self.sep) in index for r in resources]
+
+    def classify_many(self, resources):
+        """
+        Return BRANCH, LEAF, OTHER or None for each of RESOURCES.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: [str or None]
+        Exceptions: None
+        """
+        index = self._index()
+        return [index.get(str(r).rstrip(self.sep), (None, None))[1] for r in resources]
+
+
+class TarFilesystem(MemberIndexMixin, BaseFilesystem):
     """
     Tar archive based filesystem.
     """
@@ -36,6 +112,16 @@ class TarFilesystem(BaseFilesystem):
         """
         return self.tarfile.getnames()
 
+    def _iter_members(self):
+        for info in self.tarfile.getmembers():
+            if info.isdir():
+                kind = filesystem.BRANCH
+            elif info.isfile():
+                kind = filesystem.LEAF
+            else:
+                kind = filesystem.OTHER # Links, FIFOs and devices
+            yield info.name, info, kind
+
     def exists(self, resource):
         """
         Predicate function to determine whether RESOURCE exists.
@@ -46,7 +132,7 @@ class TarFilesystem(BaseFilesystem):
         Return: bool
         Exceptions: None
         """
-        return resource in self._get_membernames()
+        return self.exists_many([resource])[0]
 
     def ls(self, branch):
         """
@@ -198,12 +284,7 @@ class TarFilesystem(BaseFilesystem):
         Return: bool
         Exceptions: None
         """
-        if not self.exists(resource):
-            return False
-        item = self.stat(resource)
-        if item.isfile():
-            return True
-        return False
+        return self.classify_many([resource])[0] == filesystem.LEAF
 
     def ln(self, resource, target, symbolic=False):
         raise exceptions.InappropriateError("Can't ln() on an Archive filesystem")
@@ -230,7 +311,7 @@ class TarFilesystem(BaseFilesystem):
         raise exceptions.InappropriateError("Can't cd() on an Archive filesystem")
 
 
-class ZipFilesystem(BaseFilesystem):
+class ZipFilesystem(MemberIndexMixin, BaseFilesystem):
     """
     Zip archive based filesystem.
     """
@@ -246,6 +327,11 @@ class ZipFilesystem(BaseFilesystem):
         self.archive_path = archive_path
         self.zipfile = zipfile.ZipFile(archive_path)
 
+    def _iter_members(self):
+        for info in self.zipfile.infolist():
+            kind = filesystem.BRANCH if info.filename.endswith(self.sep) else filesystem.LEAF
+            yield info.filename, info, kind
+
 
 class ZipPath(path.LeafBranchPath):
     """
@@ -9,6 +9,7 @@ An HTTPath implementation on top of ffs.Path.
 #
 import os
 import urlparse
+from multiprocessing.pool import ThreadPool
 
 from lxml import html
 import requests
@@ -92,6 +93,37 @@ class HTTPFilesystem(ffs.filesystem.ReadOnlyFilesystem):
         resp = requests.head(urlhelp.protocolise(resource))
         return resp.status_code == 200
 
+    def exists_many(self, resources, workers=16):
+        """
+        Predicate method to determine whether each of RESOURCES exists,
+        making up to WORKERS HEAD requests at once.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+        - `workers`: int
+
+        Return: [bool]
+        Exceptions: None
+        """
+        resources = list(resources)
+        if len(resources) < 2:
+            return [self.exists(r) for r in resources]
+        pool = ThreadPool(min(workers, len(resources)))
+        try:
+            return pool.map(self.exists, resources)
+        finally:
+            pool.close()
+            pool.join()
+
+    def classify_many(self, resources):
+        """
+        As with is_branch() and is_leaf(), we can't tell, so raise
+        InappropriateError.
+
+        Exceptions: InappropriateError
+        """
+        raise ffs.exceptions.InappropriateError("Can't tell branches from leaves Larry... ")
+
     def getwd(self):
         """
         Get the current "Working directory".
@@ -6,11 +6,36 @@ filesystem-like systems with the same abstraction model.
 """
 from __future__ import with_statement
 
+import atexit
+import binascii
+import collections
+import contextlib
+import errno
+import functools
+import io
+import itertools
+import json
 import os
+import posixpath
+import shutil
+import stat
+import sys
 import tempfile
+import threading
+import time
 
-from ffs import exceptions, nix, util
+import six
+
+from ffs import exceptions, nix, util, writers
 from ffs.util import wraps
+from ffs._py3k import scandir
+
+# What classify_many() tells us about each resource.
+BRANCH, LEAF, OTHER = 'branch', 'leaf', 'other'
+
+# Below this many lookups in one directory, we look each up directly
+# rather than listing the directory.
+SCANDIR_THRESHOLD = 16
 
 class BaseFilesystem(object):
     """
@@ -114,6 +139,24 @@ class BaseFilesystem(object):
         """
         raise NotImplementedError("!")
 
+    def atomic_open(self, resource, mode='w', fsync=False):
+        """
+        Contextmanager yielding a file-like object whose contents
+        will replace RESOURCE in one step when the block exits.
+
+        If FSYNC is truthy, make sure the new contents are durable
+        before we return.
+
+        Arguments:
+        - `resource`: str or Path
+        - `mode`: str
+        - `fsync`: bool
+
+        Return: Contextmanager
+        Exceptions: None
+        """
+        raise NotImplementedError("!")
+
     def is_branch(self, resource):
         """
         Is RESOURCE a branch node on this filesystem?
@@ -265,6 +308,44 @@ class BaseFilesystem(object):
         """
         raise NotImplementedError("!")
 
+    def borrow_tempdir(self):
+        """
+        Return an empty temporary directory on this filesystem, for use
+        until we hand it back with return_tempdir().
+
+        Return: str or Path
+        Exceptions: None
+        """
+        return self.tempdir()
+
+    def return_tempdir(self, resource):
+        """
+        We're done with RESOURCE, a directory from borrow_tempdir(). It
+        and its contents are gone as far as the caller is concerned.
+
+        Arguments:
+        - `resource`: str or Path
+
+        Return: None
+        Exceptions: None
+        """
+        self.rm(resource, recursive=True)
+
+    def scratch(self, directory=None, mode='w+b'):
+        """
+        Open an anonymous scratch file in DIRECTORY, or the temporary
+        directory. It has no name, and disappears when closed, unless
+        we give it one with its materialize() method.
+
+        Arguments:
+        - `directory`: str or Path
+        - `mode`: str
+
+        Return: ScratchFile
+        Exceptions: None
+        """
+        raise NotImplementedError("!")
+
     def stat(self, resource):
         """
         Return stat info (or equivalent) about RESOUCE
@@ -277,6 +358,59 @@ class BaseFilesystem(object):
         """
         raise NotImplementedError("!")
 
+    def stat_many(self, resources):
+        """
+        Return stat info (or equivalent) for each of RESOURCES, or None
+        for those that don't exist, in the same order.
+
+        Implementations should override this where answering for many
+        resources at once is cheaper than asking about each in turn.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: list
+        Exceptions: None
+        """
+        return [self.stat(r) if self.exists(r) else None for r in resources]
+
+    def exists_many(self, resources):
+        """
+        Return whether each of RESOURCES exists, in the same order.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: [bool]
+        Exceptions: None
+        """
+        return [self.exists(r) for r in resources]
+
+    def classify_many(self, resources):
+        """
+        Return what sort of node each of RESOURCES is, in the same order:
+        one of BRANCH, LEAF, OTHER, or None if it doesn't exist.
+
+        Arguments:
+        - `resources`: iterable of str or Path
+
+        Return: [str or None]
+        Exceptions: None
+        """
+        return [self._classify(r) for r in resources]
+
+    def _classify(self, resource):
+        """
+        Classify a single RESOURCE, as for classify_many().
+        """
+        if not self.exists(resource):
+            return None
+        if self.is_branch(resource):
+            return BRANCH
+        if self.is_leaf(resource):
+            return LEAF
+        return OTHER
+
     def rm(self, resource, recursive=False):
         """
         Remove RESOURCE from the filesystem
@@ -305,6 +439,9 @@ class ReadOnlyFilesystem(BaseFilesystem):
     def mkdir(self, resource):
         raise exceptions.InappropriateError("Can't mkdir() on a Read-only filesystem")
 
+    def atomic_open(self, resource, mode='w', fsync=False):
+        raise exceptions.InappropriateError("Can't atomic_open() on a Read-only filesystem")
+
     def cp(self, resource, target):
         raise exceptions.InappropriateError("Can't cp() on a Read-only filesystem")
 
@@ -326,6 +463,509 @@ class ReadOnlyFilesystem(BaseFilesystem):
     def tempdir(self):
         raise exceptions.InappropriateError("Can't tempdir() on a Read-only filesystem")
 
+    def scratch(self, directory=None, mode='w+b'):
+        raise exceptions.InappropriateError("Can't scratch() on a Read-only filesystem")
+
+
+# Most descriptors an fdcache() holds open, by default.
+FDCACHE_MAX = 512
+
+class _CachedFD(object):
+    """
+    An open descriptor in an FDCache, and how many files are using it.
+    Once evicted or invalidated it is DOOMED, and closed with its last
+    user.
+    """
+    __slots__ = ('fd', 'users', 'doomed')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.users = 1
+        self.doomed = False
+
+
+class _CachedRaw(io.RawIOBase):
+    """
+    Unbuffered file over a descriptor from an FDCache.
+
+    Reads come from our own offset with pread(), so that any number of
+    us can share one descriptor between threads. Appends are opened
+    O_APPEND, so every write lands at the end. Closing us hands the
+    descriptor back to the cache rather than closing it.
+    """
+    def __init__(self, cache, entry, name, mode):
+        io.RawIOBase.__init__(self)
+        self._cache = cache
+        self._entry = entry
+        self._append = mode.startswith('a')
+        self._pos = 0
+        self.name = name
+        self.mode = mode
+
+    def readable(self):
+        return not self._append
+
+    def writable(self):
+        return self._append
+
+    def seekable(self):
+        return not self._append
+
+    def fileno(self):
+        return self._entry.fd
+
+    def readinto(self, buf):
+        if hasattr(os, 'preadv'):
+            count = os.preadv(self._entry.fd, [buf], self._pos)
+        else:
+            data = os.pread(self._entry.fd, len(buf), self._pos)
+            count = len(data)
+            buf[:count] = data
+        self._pos += count
+        return count
+
+    def readall(self):
+        # A short read of a regular file means we're at its end, so one
+        # pread() will usually do.
+        chunks = []
+        while True:
+            chunk = os.pread(self._entry.fd, io.DEFAULT_BUFFER_SIZE << 3, self._pos)
+            self._pos += len(chunk)
+            chunks.append(chunk)
+            if len(chunk) < io.DEFAULT_BUFFER_SIZE << 3:
+                return b''.join(chunks)
+
+    def write(self, data):
+        return os.write(self._entry.fd, data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += os.fstat(self._entry.fd).st_size
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._cache._release(self._entry)
+        io.RawIOBase.close(self)
+
+
+class FDCache(object):
+    """
+    Keep up to MAX file descriptors open, by path and mode, closing the
+    least recently used as we go over - so that reading or appending to
+    the same files over and over doesn't cost an open() and close()
+    each time.
+
+    open() gives files over cached descriptors, each with its own
+    position; pread() and pwrite() work at an offset without one. Both
+    are safe to share between threads.
+
+    Renaming or removing a file through ffs invalidates its descriptors.
+    Anything else that replaces a file under us leaves us reading the
+    old one until it is evicted or invalidate()d.
+    """
+    # The descriptor each mode of open() is served from.
+    FLAGS = {
+        'r': os.O_RDONLY,
+        'rb': os.O_RDONLY,
+        'a': os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+        'ab': os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+        }
+
+    def __init__(self, max=FDCACHE_MAX):
+        if not hasattr(os, 'pread'):
+            raise exceptions.NotSupportedError("Can't cache descriptors without os.pread() Larry... ")
+        self.max = max
+        self.hits = 0
+        self.misses = 0
+        self._fds = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0 # Bumped by every invalidate()
+
+    def __len__(self):
+        return len(self._fds)
+
+    def _acquire(self, path, flags):
+        """
+        Return the cached descriptor for PATH opened with FLAGS, opening
+        it if needs be. Pair with _release().
+        """
+        key = (path, flags)
+        with self._lock:
+            entry = self._fds.get(key)
+            if entry is not None:
+                self._fds.move_to_end(key)
+                entry.users += 1
+                self.hits += 1
+                return entry
+            invalidations = self._invalidations
+        fd = os.open(path, flags, 0o666)
+        with self._lock:
+            self.misses += 1
+            if self._invalidations != invalidations:
+                # PATH may have been replaced since we opened it, so
+                # this descriptor is good for this one use only.
+                entry = _CachedFD(fd)
+                entry.doomed = True
+                return entry
+            entry = self._fds.get(key)
+            if entry is not None: # Another thread beat us to it
+                os.close(fd)
+                entry.users += 1
+                return entry
+            entry = self._fds[key] = _CachedFD(fd)
+            while len(self._fds) > self.max:
+                self._doom(self._fds.popitem(last=False)[1])
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.doomed and not entry.users:
+                os.close(entry.fd)
+
+    def _doom(self, entry):
+        """
+        Close ENTRY once nobody is using it. Call with the lock held.
+        """
+        entry.doomed = True
+        if not entry.users:
+            os.close(entry.fd)
+
+    def open(self, path, mode='rb'):
+        """
+        Return a file for reading or appending to PATH in MODE, over a
+        cached descriptor. Closing the file hands the descriptor back.
+
+        Arguments:
+        - `path`: str
+        - `mode`: str - one of FLAGS
+
+        Return: file
+        Exceptions: InappropriateError, IOError
+        """
+        if mode not in self.FLAGS:
+            raise exceptions.InappropriateError(
+                "Can only cache descriptors for reads and appends Larry... ")
+        raw = _CachedRaw(self, self._acquire(path, self.FLAGS[mode]), path, mode)
+        fh = io.BufferedWriter(raw) if raw.writable() else io.BufferedReader(raw)
+        if 'b' not in mode:
+            fh = io.TextIOWrapper(fh)
+        return fh
+
+    def pread(self, path, size, offset):
+        """
+        Read up to SIZE bytes of PATH from OFFSET.
+
+        Arguments:
+        - `path`: str
+        - `size`: int
+        - `offset`: int
+
+        Return: bytes
+        Exceptions: IOError
+        """
+        entry = self._acquire(path, os.O_RDONLY)
+        try:
+            return os.pread(entry.fd, size, offset)
+        finally:
+            self._release(entry)
+
+    def pwrite(self, path, data, offset):
+        """
+        Write DATA to PATH at OFFSET, creating it if needs be.
+
+        Arguments:
+        - `path`: str
+        - `data`: bytes
+        - `offset`: int
+
+        Return: int - the bytes written
+        Exceptions: IOError
+        """
+        entry = self._acquire(path, os.O_RDWR | os.O_CREAT)
+        try:
+            return os.pwrite(entry.fd, data, offset)
+        finally:
+            self._release(entry)
+
+    def invalidate(self, path=None):
+        """
+        Close our descriptors for PATH and anything below it, or for
+        everything if PATH is None. Those in use close when released.
+
+        Arguments:
+        - `path`: str
+
+        Return: None
+        Exceptions: None
+        """
+        below = None if path is None else path.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._invalidations += 1
+            for key in list(self._fds):
+                if below is None or key[0] == path or key[0].startswith(below):
+                    self._doom(self._fds.pop(key))
+
+    def close(self):
+        """
+        Close all our descriptors.
+        """
+        self.invalidate()
+
+
+_fdcache = None
+
+def _cache_key(path):
+    """
+    Return the absolute, normalised PATH, which keys the fdcache -
+    without the cost of abspath() where PATH already is.
+    """
+    path = str(path)
+    if path[:1] == os.sep and os.sep + '.' not in path and os.sep * 2 not in path:
+        return path
+    return os.path.abspath(path)
+
+@contextlib.contextmanager
+def fdcache(max=FDCACHE_MAX):
+    """
+    Contextmanager in which DiskFilesystem - and so Path - reads and
+    appends reuse open descriptors from an FDCache of at most MAX,
+    rather than opening and closing files each time. The descriptors
+    are closed when the block exits.
+
+    The cache is process-wide, so that threads share it.
+
+    Arguments:
+    - `max`: int
+
+    Return: FDCache
+    Exceptions: NotSupportedError
+    """
+    global _fdcache
+    previous, cache = _fdcache, FDCache(max)
+    _fdcache = cache
+    try:
+        yield cache
+    finally:
+        _fdcache = previous
+        cache.close()
+
+
+# O_TMPFILE opens an unnamed file in a directory, where the platform has it.
+O_TMPFILE = getattr(os, 'O_TMPFILE', None)
+
+class ScratchFile(object):
+    """
+    Proxy for FH, an anonymous scratch file from scratch().
+
+    Where we couldn't open it with O_TMPFILE, it is really the temporary
+    file PATH, which we remove on close unless we've materialized it.
+    """
+    def __init__(self, fh, path=None):
+        self._fh = fh
+        self._path = path
+        self.name = None
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def __iter__(self):
+        return iter(self._fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def materialize(self, target):
+        """
+        Give the file the name TARGET, which must be on the same
+        filesystem, flushing what we have written so far. Materializing
+        again adds another link.
+
+        If TARGET exists, raise ExistsError
+
+        Arguments:
+        - `target`: str or Path
+
+        Return: None
+        Exceptions: ExistsError, OSError
+        """
+        target = str(nix.resolve(target))
+        self._fh.flush()
+        try:
+            if self.name is not None:
+                os.link(self.name, target)
+            elif self._path is None:
+                # linkat() with AT_EMPTY_PATH needs privileges; following our
+                # descriptor's link in /proc doesn't. Relative to a dir_fd,
+                # os.link() uses linkat(), and so can follow it.
+                procfd = os.open('/proc/self/fd', os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.link(str(self._fh.fileno()), target, src_dir_fd=procfd,
+                            follow_symlinks=True)
+                finally:
+                    os.close(procfd)
+            else:
+                # Link rather than rename, which would clobber TARGET.
+                os.link(self._path, target)
+                os.unlink(self._path)
+                self._path = None
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            raise exceptions.ExistsError(
+                '{0} already exists Larry... '.format(target))
+        if self.name is None:
+            self.name = target
+
+    def close(self):
+        self._fh.close()
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+
+# Emptied temporary directories we keep ready for borrow_tempdir().
+TEMPDIR_POOL = 8
+# Seconds the thread emptying them waits for more work before exiting.
+TEMPDIR_LINGER = 1.0
+
+class TempdirPool(object):
+    """
+    Temporary directories to lend out, all inside one private root.
+
+    Handing one back renames it straight away - so its old path is gone
+    - and a background thread empties it to be lent out again under the
+    new name. We keep up to SIZE empty ones ready, and remove the rest.
+    """
+    def __init__(self, size=TEMPDIR_POOL):
+        self.size = size
+        self._root = None
+        self._pid = None
+        self._names = itertools.count()
+        self._ready = []
+        self._dirty = collections.deque()
+        self._worker = None
+        self._busy = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def _fresh(self):
+        """
+        Return an unused path in our root. Call with the lock held.
+        """
+        if self._pid != os.getpid(): # Forked: start our own pool
+            self._root, self._pid = tempfile.mkdtemp(prefix='ffs-tempdirs-'), os.getpid()
+            self._ready, self._dirty = [], collections.deque()
+            self._worker, self._busy = None, False
+        return os.path.join(self._root, str(next(self._names)))
+
+    def borrow(self):
+        """
+        Return an empty directory.
+
+        Return: str
+        Exceptions: OSError
+        """
+        with self._cond:
+            path = self._fresh()
+            if self._ready:
+                return self._ready.pop()
+        os.mkdir(path, 0o700)
+        return path
+
+    def give_back(self, path):
+        """
+        Take back PATH, a directory from borrow().
+
+        Arguments:
+        - `path`: str
+
+        Return: None
+        Exceptions: None
+        """
+        with self._cond:
+            fresh = self._fresh()
+            ours = os.path.dirname(path) == self._root
+            if ours:
+                try:
+                    os.rename(path, fresh)
+                except OSError:
+                    return # Gone already
+                self._dirty.append(fresh)
+                self._cond.notify_all()
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._work, name='ffs-tempdirs')
+                    self._worker.daemon = True
+                    self._worker.start()
+        if not ours:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _work(self):
+        """
+        Worker: empty the directories handed back, until none have been
+        for TEMPDIR_LINGER seconds.
+        """
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                if not self._dirty:
+                    self._cond.wait(TEMPDIR_LINGER)
+                if not self._dirty:
+                    self._worker = None
+                    return
+                path = self._dirty.popleft()
+                keep = len(self._ready) < self.size
+                self._busy = True
+            if keep:
+                try:
+                    for entry in scandir(path):
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                    os.chmod(path, 0o700)
+                except OSError:
+                    keep = False
+            if not keep:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            with self._cond:
+                self._ready.append(path)
+
+    def join(self):
+        """
+        Wait until everything handed back has been emptied.
+        """
+        with self._cond:
+            while self._pid == os.getpid() and (self._dirty or self._busy):
+                self._cond.wait()
+
+    def close(self):
+        """
+        Remove all our directories, lent out or not.
+        """
+        self.join()
+        if self._root is not None and self._pid == os.getpid():
+            shutil.rmtree(self._root, ignore_errors=True)
+        self._root = self._pid = None
+
+
+_tempdirs = TempdirPool()
+atexit.register(_tempdirs.close)
+
 
 class DiskFilesystem(BaseFilesystem):
     """
@@ -340,7 +980,7 @@ class DiskFilesystem(BaseFilesystem):
 
     @wraps(BaseFilesystem.exists)
     def exists(self, resource):
-        return os.path.exists(resource)
+        return os.path.exists(nix.resolve(resource))
 
     @wraps(BaseFilesystem.getwd)
     def getwd(self):
@@ -348,7 +988,7 @@ class DiskFilesystem(BaseFilesystem):
 
     @wraps(BaseFilesystem.ls)
     def ls(self, resource, all=None):
-        return nix.ls(resource, all=all)
+        return nix.ls(nix.resolve(resource), all=all)
 
     @wraps(BaseFilesystem.cd)
     def cd(self, target):
@@ -360,11 +1000,11 @@ class DiskFilesystem(BaseFilesystem):
 
     @wraps(BaseFilesystem.is_branch)
     def is_branch(self, resource):
-        return util.is_dir(resource)
+        return util.is_dir(nix.resolve(resource))
 
     @wraps(BaseFilesystem.is_leaf)
     def is_leaf(self, resource):
-        return util.is_file(resource)
+        return util.is_file(nix.resolve(resource))
 
     @wraps(BaseFilesystem.parent)
     def parent(self, resource):
@@ -372,7 +1012,36 @@ class DiskFilesystem(BaseFilesystem):
 
     @wraps(BaseFilesystem.open)
     def open(self, resource, mode='r'):
-        return open(self.expanduser(resource), mode)
+        resource = nix.resolve(self.expanduser(resource))
+        cache = _fdcache
+        if cache is not None and mode in cache.FLAGS:
+            return cache.open(_cache_key(resource), mode)
+        return open(resource, mode)
+
+    @wraps(BaseFilesystem.atomic_open)
+    def atomic_open(self, resource, mode='w', fsync=False):
+        opened = writers.atomic_open(nix.resolve(self.expanduser(resource)), mode, fsync=fsync)
+        if _fdcache is None:
+            return opened
+        return self._forgetting(opened, resource)
+
+    @contextlib.contextmanager
+    def _forgetting(self, opened, resource):
+        """
+        Contextmanager: enter OPENED, then invalidate RESOURCE in the
+        fdcache once it has replaced it.
+        """
+        with opened as fh:
+            yield fh
+        self._forget(resource)
+
+    def _forget(self, resource):
+        """
+        Close any descriptors the fdcache holds for RESOURCE, or below it.
+        """
+        cache = _fdcache
+        if cache is not None:
+            cache.invalidate(_cache_key(nix.resolve(self.expanduser(str(resource)))))
 
     @wraps(BaseFilesystem.expanduser)
     def expanduser(self, resource):
@@ -386,32 +1055,39 @@ class DiskFilesystem(BaseFilesystem):
         # incorrectly evaluate to ``False`` if our resource does not exist, and
         # will then return the current working directory instead, ie. the
         # equivalent of calling ``os.path.abspath('')``.
-        return os.path.abspath(str(resource))
+        return os.path.abspath(str(nix.resolve(resource)))
 
     @wraps(BaseFilesystem.mkdir)
     def mkdir(self, resource, parents=False):
-        return nix.mkdir(resource, parents=parents)
+        return nix.mkdir(nix.resolve(resource), parents=parents)
 
     @wraps(BaseFilesystem.cp)
     def cp(self, resource, target, recursive=False):
-        return nix.cp(resource, target, recursive=recursive)
+        return nix.cp(nix.resolve(resource), nix.resolve(target), recursive=recursive)
 
     @wraps(BaseFilesystem.ln)
     def ln(self, resource, target, symbolic=False):
-        return nix.ln(resource, target, symbolic=symbolic)
+        if not symbolic:
+            # A symlink's target is relative to the link, not to us.
+            resource = nix.resolve(resource)
+        return nix.ln(resource, nix.resolve(target), symbolic=symbolic)
 
     @wraps(BaseFilesystem.mv)
     def mv(self, resource, target):
-        return nix.mv(resource, target)
+        try:
+            return nix.mv(nix.resolve(resource), nix.resolve(target))
+        finally:
+            self._forget(resource)
+            self._forget(target)
 
     @wraps(BaseFilesystem.touch)
     def touch(self, resource):
-        return nix.touch(resource)
+        return nix.touch(nix.resolve(resource))
 
     @wraps(BaseFilesystem.tempfile)
     def tempfile(self):
-        tfile = tempfile.mktemp()
-        self.touch(tfile)
+        fd, tfile = tempfile.mkstemp()
+        os.close(fd)
         return tfile
 
     @wraps(BaseFilesystem.tempdir)
@@ -419,6 +1095,1771 @@ class DiskFilesystem(BaseFilesystem):
         tdir = tempfile.mkdtemp()
         return tdir
 
+    @wraps(BaseFilesystem.borrow_tempdir)
+    def borrow_tempdir(self):
+        return _tempdirs.borrow()
+
+    @wraps(BaseFilesystem.return_tempdir)
+    def return_tempdir(self, resource):
+        return _tempdirs.give_back(str(nix.resolve(resource)))
+
+    @wraps(BaseFilesystem.scratch)
+    def scratch(self, directory=None, mode='w+b'):
+        directory = str(nix.resolve(directory)) if directory else tempfile.gettempdir()
+        if O_TMPFILE is not None:
+            try:
+                fd = os.open(directory, O_TMPFILE | os.O_RDWR, 0o600)
+            except OSError as err:
+                # Kernels and filesystems without O_TMPFILE say so variously.
+                if err.errno not in (errno.EISDIR, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+            else:
+                return ScratchFile(os.fdopen(fd, mode))
+        fd, path = tempfile.mkstemp(dir=directory)
+        return ScratchFile(os.fdopen(fd, mode), path)
+
+    @wraps(BaseFilesystem.stat)
+    def stat(self, resource):
+        return nix.stat(str(nix.resolve(resource)))
+
+    def _by_parent(self, resources):
+        """
+        Group the indices of RESOURCES by parent directory.
+
+        Arguments:
+        - `resources`: list of str or Path
+
+        Return: dict - {directory: [(index, basename)]}
+        Exceptions: None
+        """
+        groups = collections.defaultdict(list)
+        for i, resource in enumerate(resources):
+            dirname, basename = os.path.split(str(resource))
+            groups[dirname].append((i, basename))
+        return groups
+
+    @wraps(BaseFilesystem.stat_many)
+    def stat_many(self, resources):
+        resources = [nix.resolve(r) for r in resources]
+        stats = [None] * len(resources)
+        for dirname, members in self._by_parent(resources).items():
+            # One descriptor per directory, then stat relative to it,
+            # rather than resolving the whole path each time.
+            dir_fd = None
+            if os.stat in getattr(os, 'supports_dir_fd', ()) and len(members) > 1:
+                try:
+                    dir_fd = os.open(dirname or os.curdir, os.O_RDONLY)
+                except OSError:
+                    pass
+            try:
+                for i, basename in members:
+                    try:
+                        if dir_fd is None:
+                            stats[i] = os.stat(str(resources[i]))
+                        else:
+                            stats[i] = os.stat(basename or os.curdir, dir_fd=dir_fd)
+                    except OSError:
+                        pass
+            finally:
+                if dir_fd is not None:
+                    os.close(dir_fd)
+        return stats
+
+    @wraps(BaseFilesystem.exists_many)
+    def exists_many(self, resources):
+        return [kind is not None for kind in self.classify_many(resources)]
+
+    @wraps(BaseFilesystem.classify_many)
+    def classify_many(self, resources):
+        resources = [nix.resolve(r) for r in resources]
+        kinds = [None] * len(resources)
+        for dirname, members in self._by_parent(resources).items():
+            entries = {}
+            if len(members) >= SCANDIR_THRESHOLD:
+                try:
+                    entries = dict((e.name, e) for e in scandir(dirname or os.curdir))
+                except OSError:
+                    pass
+            for i, basename in members:
+                entry = entries.get(basename)
+                if entry is not None and not entry.is_symlink():
+                    # The directory listing tells us the type - no stat.
+                    if entry.is_dir():
+                        kinds[i] = BRANCH
+                    elif entry.is_file():
+                        kinds[i] = LEAF
+                    else:
+                        kinds[i] = OTHER
+                    continue
+                # Symlinks, and names a listing never holds - '.', '..',
+                # or anything made since we listed - need a stat.
+                kinds[i] = self._classify_stat(resources[i])
+        return kinds
+
+    def _classify_stat(self, resource):
+        """
+        Classify RESOURCE with a stat() call, following symlinks.
+        """
+        try:
+            mode = os.stat(str(resource)).st_mode
+        except OSError:
+            return None
+        if stat.S_ISDIR(mode):
+            return BRANCH
+        if stat.S_ISREG(mode):
+            return LEAF
+        return OTHER
+
+    @wraps(BaseFilesystem.rm)
+    def rm(self, resource, recursive=False):
+        try:
+            return nix.rm(nix.resolve(resource), recursive=recursive)
+        finally:
+            self._forget(resource)
+
+
+# Can we work relative to directory descriptors here?
+DIR_FD = (getattr(os, 'O_DIRECTORY', None) is not None and
+          set([os.open, os.stat, os.mkdir, os.unlink]) <= getattr(os, 'supports_dir_fd', set()))
+
+class _DirFDs(collections.OrderedDict):
+    """
+    One thread's open directory descriptors, by path. We close them
+    when we go away, along with the thread.
+    """
+    def close(self):
+        while self:
+            os.close(self.popitem()[1])
+
+    def __del__(self):
+        self.close()
+
+
+class DirFDFilesystem(DiskFilesystem):
+    """
+    A DiskFilesystem that resolves paths relative to open descriptors
+    for their directories, so that the kernel only walks the directory
+    part of a path once, rather than on every call. Worthwhile for many
+    operations on entries of a few deep directories.
+
+    stat() and friends, open(), touch(), ls() and the simple forms of
+    mkdir() and rm() go through a descriptor. Everything else - and
+    everything, on platforms without dir_fd support - works as for
+    DiskFilesystem.
+
+    Each thread keeps up to MAXFDS directories open, closing the least
+    recently used. Moving or recursively removing a tree through us
+    makes every thread start afresh, but if directories are moved or
+    removed behind our back, we carry on using the ones we have open
+    until invalidate().
+    """
+    def __init__(self, maxfds=64):
+        self.maxfds = maxfds
+        self._local = threading.local()
+        self._generation = 0
+
+    def _fds(self):
+        """
+        Return this thread's dict of open directory descriptors.
+        """
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            if getattr(local, 'fds', None) is not None:
+                local.fds.close()
+            local.fds = _DirFDs()
+            local.generation = self._generation
+        return local.fds
+
+    def _dir_fd(self, dirname):
+        """
+        Return an open descriptor for the directory DIRNAME.
+
+        Exceptions: OSError
+        """
+        fds = self._fds()
+        fd = fds.pop(dirname, None)
+        if fd is None:
+            fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+            while len(fds) >= self.maxfds:
+                os.close(fds.popitem(last=False)[1])
+        fds[dirname] = fd # Most recently used goes last.
+        return fd
+
+    def _at(self, resource):
+        """
+        Return (descriptor of the parent directory, name) for RESOURCE,
+        or (None, None) if we can't work relative to its parent.
+
+        This is on every call's path, so the common case - an absolute
+        path in a directory we already have open - is kept short.
+        """
+        if not DIR_FD:
+            return None, None
+        path = str(resource)
+        if path[:1] == '~':
+            path = self.expanduser(path)
+        if path[:1] != os.sep:
+            path = os.path.abspath(nix.resolve(path))
+        dirname, _, name = path.rpartition(os.sep)
+        if not name:
+            return None, None
+        dirname = dirname or os.sep
+        local = self._local
+        try:
+            if local.generation == self._generation:
+                local.fds.move_to_end(dirname)
+                return local.fds[dirname], name
+        except (AttributeError, KeyError):
+            pass
+        try:
+            return self._dir_fd(dirname), name
+        except OSError:
+            return None, None
+
+    def opendir(self, resource):
+        """
+        Open RESOURCE and keep it open for the operations beneath it.
+
+        Arguments:
+        - `resource`: str or Path
+
+        Return: None
+        Exceptions: OSError
+        """
+        if DIR_FD:
+            self._dir_fd(self.abspath(resource))
+
+    def invalidate(self):
+        """
+        Have every thread close its directories, and open them afresh
+        as they are needed.
+
+        Return: None
+        Exceptions: None
+        """
+        self._generation += 1
+
+    @wraps(BaseFilesystem.exists)
+    def exists(self, resource):
+        try:
+            self.stat(resource)
+        except OSError:
+            return False
+        return True
+
+    @wraps(BaseFilesystem.is_branch)
+    def is_branch(self, resource):
+        try:
+            return stat.S_ISDIR(self.stat(resource).st_mode)
+        except OSError:
+            return False
+
+    @wraps(BaseFilesystem.is_leaf)
+    def is_leaf(self, resource):
+        try:
+            return stat.S_ISREG(self.stat(resource).st_mode)
+        except OSError:
+            return False
+
+    @wraps(BaseFilesystem.stat)
+    def stat(self, resource):
+        dir_fd, name = self._at(resource)
+        if dir_fd is None:
+            return DiskFilesystem.stat(self, resource)
+        return os.stat(name, dir_fd=dir_fd)
+
+    @wraps(BaseFilesystem.ls)
+    def ls(self, resource, all=None):
+        if not DIR_FD:
+            return DiskFilesystem.ls(self, resource, all=all)
+        try:
+            fd = self._dir_fd(self.abspath(resource))
+        except OSError:
+            return DiskFilesystem.ls(self, resource, all=all)
+        entries = os.listdir(fd)
+        if all is None:
+            entries = [f for f in entries if f[0] != '.']
+        if all:
+            entries += ['.', '..']
+        return entries
+
+    @wraps(BaseFilesystem.open)
+    def open(self, resource, mode='r'):
+        dir_fd, name = self._at(resource)
+        if dir_fd is None:
+            return DiskFilesystem.open(self, resource, mode)
+        return open(name, mode, opener=lambda path, flags: os.open(path, flags, 0o666,
+                                                                   dir_fd=dir_fd))
+
+    @wraps(BaseFilesystem.touch)
+    def touch(self, resource):
+        dir_fd, name = self._at(resource)
+        if dir_fd is None:
+            return DiskFilesystem.touch(self, resource)
+        os.close(os.open(name, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666, dir_fd=dir_fd))
+
+    @wraps(BaseFilesystem.mkdir)
+    def mkdir(self, resource, parents=False):
+        dir_fd, name = None, None
+        if not parents:
+            dir_fd, name = self._at(resource)
+        if dir_fd is None:
+            return DiskFilesystem.mkdir(self, resource, parents=parents)
+        os.mkdir(name, dir_fd=dir_fd)
+
     @wraps(BaseFilesystem.rm)
     def rm(self, resource, recursive=False):
-        return nix.rm(resource, recursive=recursive)
+        if recursive and self.is_branch(resource):
+            try:
+                return DiskFilesystem.rm(self, resource, recursive=recursive)
+            finally:
+                self.invalidate()
+        dir_fd, name = self._at(resource)
+        try:
+            if dir_fd is not None:
+                os.unlink(name, dir_fd=dir_fd)
+                return self._forget(resource)
+        except OSError:
+            pass # Let nix.rm() tell the caller what went wrong.
+        return DiskFilesystem.rm(self, resource, recursive=recursive)
+
+    @wraps(BaseFilesystem.mv)
+    def mv(self, resource, target):
+        if not self.is_branch(resource):
+            return DiskFilesystem.mv(self, resource, target)
+        try:
+            return DiskFilesystem.mv(self, resource, target)
+        finally:
+            self.invalidate()
+
+
+class CachingFilesystem(BaseFilesystem):
+    """
+    Wrap another filesystem, remembering the answers to metadata
+    queries - exists(), is_branch(), is_leaf(), ls() and stat() - so
+    that asking again doesn't cost another round trip. Worthwhile when
+    the wrapped filesystem is slow, say a network mount.
+
+    Answers are forgotten after TTL seconds (if given), and we remember
+    at most MAXSIZE paths, dropping the least recently used. If
+    NEGATIVE is truthy we also remember False answers and errors such
+    as stat() of a missing file - usually what costs most to ask again.
+
+    Mutating calls made through us forget what we knew about the paths
+    they touch, their ancestors, and for calls that can move whole
+    trees, everything below them. Changes made behind our back are
+    only noticed when the TTL expires, or after invalidate().
+    """
+    def __init__(self, wrapped, ttl=None, maxsize=10000, negative=True):
+        self.wrapped = wrapped
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.negative = negative
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, resource):
+        """
+        Return the string we file answers about RESOURCE under - its
+        absolute path, so that relative answers survive cd().
+        """
+        resource = str(self.wrapped.abspath(resource))
+        stripped = resource.rstrip(self.sep)
+        return stripped or resource
+
+    def _cached(self, op, resource, compute):
+        """
+        Return the cached answer to OP for RESOURCE, calling COMPUTE to
+        find it if we don't have one. If COMPUTE raises, remember that
+        too when we are caching negatives.
+
+        Arguments:
+        - `op`: hashable
+        - `resource`: str or Path
+        - `compute`: callable
+
+        Return: object
+        Exceptions: Whatever COMPUTE raises
+        """
+        key = self._key(resource)
+        now = time.time()
+        with self._lock:
+            answers = self._cache.pop(key, None)
+            if answers is not None:
+                self._cache[key] = answers # Most recently used goes last.
+                if op in answers:
+                    expires, raised, value = answers[op]
+                    if expires is None or expires > now:
+                        if raised:
+                            six.reraise(type(value), value, None)
+                        return value
+        try:
+            value, raised = compute(), False
+        except (OSError, IOError, exceptions.DoesNotExistError) as err:
+            if not self.negative:
+                raise
+            value, raised = err, True
+        if self.negative or value is not False:
+            expires = None if self.ttl is None else now + self.ttl
+            with self._lock:
+                answers = self._cache.pop(key, {})
+                answers[op] = (expires, raised, value)
+                self._cache[key] = answers
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        if raised:
+            six.reraise(type(value), value, None)
+        return value
+
+    def invalidate(self, resource=None, tree=False):
+        """
+        Forget what we know about RESOURCE and its ancestors, or if
+        TREE is truthy, also everything below it. With no RESOURCE,
+        forget everything.
+
+        Arguments:
+        - `resource`: str or Path
+        - `tree`: bool
+
+        Return: None
+        Exceptions: None
+        """
+        with self._lock:
+            if resource is None:
+                self._cache.clear()
+                return
+            key = self._key(resource)
+            if tree:
+                prefix = key.rstrip(self.sep) + self.sep
+                for below in [k for k in self._cache if k.startswith(prefix)]:
+                    del self._cache[below]
+            while True:
+                self._cache.pop(key, None)
+                parent = self._key(os.path.dirname(key))
+                if not parent or parent == key:
+                    break
+                key = parent
+
+    @property
+    @wraps(BaseFilesystem.sep)
+    def sep(self):
+        return self.wrapped.sep
+
+    @wraps(BaseFilesystem.exists)
+    def exists(self, resource):
+        return self._cached('exists', resource, lambda: self.wrapped.exists(resource))
+
+    @wraps(BaseFilesystem.is_branch)
+    def is_branch(self, resource):
+        return self._cached('is_branch', resource, lambda: self.wrapped.is_branch(resource))
+
+    @wraps(BaseFilesystem.is_leaf)
+    def is_leaf(self, resource):
+        return self._cached('is_leaf', resource, lambda: self.wrapped.is_leaf(resource))
+
+    @wraps(BaseFilesystem.ls)
+    def ls(self, resource, **kw):
+        op = ('ls',) + tuple(sorted(kw.items()))
+        return list(self._cached(op, resource, lambda: self.wrapped.ls(resource, **kw)))
+
+    @wraps(BaseFilesystem.stat)
+    def stat(self, resource):
+        return self._cached('stat', resource, lambda: self.wrapped.stat(resource))
+
+    @wraps(BaseFilesystem.getwd)
+    def getwd(self):
+        return self.wrapped.getwd()
+
+    @wraps(BaseFilesystem.cd)
+    def cd(self, target):
+        return self.wrapped.cd(target)
+
+    @wraps(BaseFilesystem.is_abspath)
+    def is_abspath(self, resource):
+        return self.wrapped.is_abspath(resource)
+
+    @wraps(BaseFilesystem.expanduser)
+    def expanduser(self, resource):
+        return self.wrapped.expanduser(resource)
+
+    @wraps(BaseFilesystem.abspath)
+    def abspath(self, resource):
+        return self.wrapped.abspath(resource)
+
+    @wraps(BaseFilesystem.parent)
+    def parent(self, resource):
+        return self.wrapped.parent(resource)
+
+    @wraps(BaseFilesystem.open)
+    def open(self, resource, mode='r'):
+        if set(mode) & set('wax+'):
+            self.invalidate(resource)
+        return self.wrapped.open(resource, mode)
+
+    @wraps(BaseFilesystem.atomic_open)
+    @contextlib.contextmanager
+    def atomic_open(self, resource, mode='w', fsync=False):
+        try:
+            with self.wrapped.atomic_open(resource, mode, fsync=fsync) as fh:
+                yield fh
+        finally:
+            self.invalidate(resource)
+
+    @wraps(BaseFilesystem.mkdir)
+    def mkdir(self, resource, parents=False):
+        try:
+            return self.wrapped.mkdir(resource, parents=parents)
+        finally:
+            self.invalidate(resource)
+
+    @wraps(BaseFilesystem.cp)
+    def cp(self, resource, target, recursive=False):
+        try:
+            return self.wrapped.cp(resource, target, recursive=recursive)
+        finally:
+            self.invalidate(target, tree=True)
+
+    @wraps(BaseFilesystem.ln)
+    def ln(self, resource, target, symbolic=False):
+        try:
+            return self.wrapped.ln(resource, target, symbolic=symbolic)
+        finally:
+            self.invalidate(target, tree=True)
+
+    @wraps(BaseFilesystem.mv)
+    def mv(self, resource, target):
+        try:
+            return self.wrapped.mv(resource, target)
+        finally:
+            self.invalidate(resource, tree=True)
+            self.invalidate(target, tree=True)
+
+    @wraps(BaseFilesystem.touch)
+    def touch(self, resource):
+        try:
+            return self.wrapped.touch(resource)
+        finally:
+            self.invalidate(resource)
+
+    @wraps(BaseFilesystem.tempfile)
+    def tempfile(self):
+        return self.wrapped.tempfile()
+
+    @wraps(BaseFilesystem.tempdir)
+    def tempdir(self):
+        return self.wrapped.tempdir()
+
+    @wraps(BaseFilesystem.rm)
+    def rm(self, resource, recursive=False):
+        try:
+            return self.wrapped.rm(resource, recursive=recursive)
+        finally:
+            self.invalidate(resource, tree=True)
+
+
+_inodes = itertools.count(1)
+
+class _MemoryFile(object):
+    """
+    A leaf node in a MemoryFilesystem. Hard links share one of these.
+    """
+    __slots__ = ('data', 'mtime', 'ino')
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.mtime = time.time()
+        self.ino = next(_inodes)
+
+
+class _MemoryDir(dict):
+    """
+    A branch node in a MemoryFilesystem: a dict of names to nodes.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.mtime = time.time()
+        self.ino = next(_inodes)
+
+
+class _MemoryBuffer(io.BytesIO):
+    """
+    An open file on a MemoryFilesystem. Our contents are handed back
+    to COMMIT (if given) whenever we are flushed or closed.
+
+    If APPEND, we hand COMMIT only what we wrote since last time, for
+    it to add to the file's current contents and return them - so that
+    several appenders all land, as with O_APPEND on disk.
+    """
+    def __init__(self, data=b'', commit=None, readable=True, writable=True, append=False):
+        io.BytesIO.__init__(self, data)
+        self._commit = commit
+        self._readable = readable
+        self._writable = writable
+        self._append = append
+        self._pending = []
+        if append:
+            self.seek(0, io.SEEK_END)
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def read(self, *args):
+        if not self._readable:
+            raise io.UnsupportedOperation('not readable')
+        return io.BytesIO.read(self, *args)
+
+    def write(self, data):
+        if not self._writable:
+            raise io.UnsupportedOperation('not writable')
+        if self._append:
+            self.seek(0, io.SEEK_END)
+            self._pending.append(bytes(data))
+        return io.BytesIO.write(self, data)
+
+    def flush(self):
+        io.BytesIO.flush(self)
+        if not self._writable or self._commit is None or self.closed:
+            return
+        if not self._append:
+            self._commit(self.getvalue())
+        elif self._pending:
+            data = self._commit(b''.join(self._pending))
+            self._pending = []
+            pos = self.tell()
+            self.seek(0)
+            self.truncate()
+            io.BytesIO.write(self, data)
+            self.seek(min(pos, len(data)))
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+        io.BytesIO.close(self)
+
+
+class _MemoryCd(object):
+    """
+    Change a MemoryFilesystem's working directory on construction, and
+    if used as a contextmanager, change back on exit. See nix.cd.
+    """
+    def __init__(self, fs, target):
+        self.fs = fs
+        self.startdir = fs.getwd()
+        self.path = fs._dir(target)[0]
+        fs._state['cwd'] = self.path
+
+    def __enter__(self):
+        return self.path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fs._state['cwd'] = self.startdir
+        return
+
+
+class MemoryFilesystem(BaseFilesystem):
+    """
+    A filesystem held entirely in memory, as a tree of dicts. Quick to
+    create, quick to throw away, and it never leaves debris behind.
+
+    Every MemoryFilesystem shares one tree and one working directory -
+    so that all the Paths that make their own instance see the same
+    files - unless SHARED is falsy, in which case it gets its own.
+    """
+    _shared_state = {}
+
+    def __init__(self, shared=True):
+        self._state = self._shared_state if shared else {}
+        if not self._state:
+            self.reset()
+
+    def reset(self):
+        """
+        Empty our tree and return to the root.
+
+        Return: None
+        Exceptions: None
+        """
+        self._state.update(root=_MemoryDir(), cwd='/', lock=threading.RLock())
+
+    def _error(self, code, resource):
+        return OSError(code, os.strerror(code), str(resource))
+
+    def _walk(self, path):
+        """
+        Return the node at the normalised absolute PATH, or None.
+        """
+        node = self._state['root']
+        for name in path.split('/'):
+            if not name:
+                continue
+            if not isinstance(node, _MemoryDir):
+                return None
+            node = node.get(name)
+            if node is None:
+                return None
+        return node
+
+    def _node(self, resource):
+        """
+        Return (absolute path, node) for RESOURCE, or raise OSError.
+        """
+        path = self.abspath(resource)
+        node = self._walk(path)
+        if node is None:
+            raise self._error(errno.ENOENT, resource)
+        return path, node
+
+    def _dir(self, resource):
+        """
+        Return (absolute path, node) for the branch RESOURCE, or raise OSError.
+        """
+        path, node = self._node(resource)
+        if not isinstance(node, _MemoryDir):
+            raise self._error(errno.ENOTDIR, resource)
+        return path, node
+
+    def _entry(self, resource):
+        """
+        Return (parent node, name) for RESOURCE, or raise OSError if
+        the parent isn't there.
+        """
+        path = self.abspath(resource)
+        dirname, name = posixpath.split(path)
+        parent = self._walk(dirname)
+        if not isinstance(parent, _MemoryDir):
+            raise self._error(errno.ENOENT, resource)
+        return parent, name
+
+    @property
+    @wraps(BaseFilesystem.sep)
+    def sep(self):
+        return '/'
+
+    @wraps(BaseFilesystem.exists)
+    def exists(self, resource):
+        return self._walk(self.abspath(resource)) is not None
+
+    @wraps(BaseFilesystem.getwd)
+    def getwd(self):
+        return self._state['cwd']
+
+    @wraps(BaseFilesystem.ls)
+    def ls(self, resource, all=None):
+        entries = list(self._dir(resource)[1])
+        if not all:
+            entries = [e for e in entries if e[0] != '.']
+        else:
+            entries += ['.', '..']
+        return entries
+
+    @wraps(BaseFilesystem.cd)
+    def cd(self, target):
+        return _MemoryCd(self, target)
+
+    @wraps(BaseFilesystem.is_abspath)
+    def is_abspath(self, resource):
+        return str(resource).startswith('/')
+
+    @wraps(BaseFilesystem.is_branch)
+    def is_branch(self, resource):
+        return isinstance(self._walk(self.abspath(resource)), _MemoryDir)
+
+    @wraps(BaseFilesystem.is_leaf)
+    def is_leaf(self, resource):
+        return isinstance(self._walk(self.abspath(resource)), _MemoryFile)
+
+    @wraps(BaseFilesystem.expanduser)
+    def expanduser(self, resource):
+        return resource
+
+    @wraps(BaseFilesystem.abspath)
+    def abspath(self, resource):
+        return posixpath.normpath(posixpath.join(self._state['cwd'], str(resource)))
+
+    @wraps(BaseFilesystem.parent)
+    def parent(self, resource):
+        return posixpath.dirname(str(resource))
+
+    @wraps(BaseFilesystem.open)
+    def open(self, resource, mode='r'):
+        with self._state['lock']:
+            parent, name = self._entry(resource)
+            node = parent.get(name)
+            if isinstance(node, _MemoryDir):
+                raise self._error(errno.EISDIR, resource)
+            if node is None:
+                if 'r' in mode:
+                    raise self._error(errno.ENOENT, resource)
+                node = parent[name] = _MemoryFile()
+                parent.mtime = time.time()
+            elif 'x' in mode:
+                raise self._error(errno.EEXIST, resource)
+            if 'w' in mode:
+                node.data = b''
+
+        def commit(data):
+            node.data = data
+            node.mtime = time.time()
+
+        def append(data):
+            with self._state['lock']:
+                node.data += data
+                node.mtime = time.time()
+                return node.data
+
+        writable = '+' in mode or 'r' not in mode
+        buf = _MemoryBuffer(node.data, append if 'a' in mode else commit,
+                            readable='+' in mode or 'r' in mode,
+                            writable=writable, append='a' in mode)
+        if 'b' in mode or six.PY2:
+            return buf
+        return io.TextIOWrapper(buf, encoding='utf-8')
+
+    @wraps(BaseFilesystem.atomic_open)
+    @contextlib.contextmanager
+    def atomic_open(self, resource, mode='w', fsync=False):
+        if mode not in ('w', 'wb'):
+            raise ValueError("Atomic writes replace the whole file - mode must be w or wb Larry... ")
+        parent, name = self._entry(resource)
+        if isinstance(parent.get(name), _MemoryDir):
+            raise self._error(errno.EISDIR, resource)
+        buf = _MemoryBuffer()
+        fh = buf if mode == 'wb' or six.PY2 else io.TextIOWrapper(buf, encoding='utf-8')
+        try:
+            yield fh
+            fh.flush()
+            with self._state['lock']:
+                parent[name] = _MemoryFile(buf.getvalue())
+                parent.mtime = time.time()
+        finally:
+            fh.close()
+
+    @wraps(BaseFilesystem.mkdir)
+    def mkdir(self, resource, parents=False):
+        with self._state['lock']:
+            node = self._state['root']
+            names = [n for n in self.abspath(resource).split('/') if n]
+            for i, name in enumerate(names):
+                child = node.get(name)
+                last = i == len(names) - 1
+                if child is None:
+                    if not (parents or last):
+                        raise exceptions.BadParentingError(
+                            'Target {0} lacked some parents'.format(resource))
+                    child = node[name] = _MemoryDir()
+                    node.mtime = time.time()
+                elif not isinstance(child, _MemoryDir):
+                    raise self._error(errno.ENOTDIR if not last else errno.EEXIST, resource)
+                elif last and not parents:
+                    raise self._error(errno.EEXIST, resource)
+                node = child
+
+    def _copy(self, node):
+        """
+        Return a deep copy of NODE.
+        """
+        if isinstance(node, _MemoryFile):
+            return _MemoryFile(node.data)
+        copied = _MemoryDir()
+        for name, child in node.items():
+            copied[name] = self._copy(child)
+        return copied
+
+    @wraps(BaseFilesystem.cp)
+    def cp(self, resource, target, recursive=False):
+        with self._state['lock']:
+            if not self.exists(resource):
+                raise exceptions.DoesNotExistError("Can't copy something that doesn't exist Larry... ")
+            if self.exists(target):
+                raise exceptions.ExistsError("Won't overwrite an existing target Larry... ")
+            node = self._node(resource)[1]
+            if isinstance(node, _MemoryDir) and not recursive:
+                return
+            parent, name = self._entry(target)
+            parent[name] = self._copy(node)
+            parent.mtime = time.time()
+
+    @wraps(BaseFilesystem.ln)
+    def ln(self, resource, target, symbolic=False):
+        if symbolic:
+            raise exceptions.NotSupportedError("No symlinks in memory Larry... ")
+        with self._state['lock']:
+            if self.exists(target):
+                raise exceptions.ExistsError(
+                    '{0} already exists Larry... did you mean to force?'.format(target))
+            node = self._node(resource)[1]
+            if isinstance(node, _MemoryDir):
+                raise self._error(errno.EPERM, resource)
+            parent, name = self._entry(target)
+            parent[name] = node
+            parent.mtime = time.time()
+
+    @wraps(BaseFilesystem.mv)
+    def mv(self, resource, target):
+        with self._state['lock']:
+            if self.is_branch(target):
+                target = posixpath.join(self.abspath(target), posixpath.basename(
+                    self.abspath(resource)))
+            src, srcname = self._entry(resource)
+            if srcname not in src:
+                raise self._error(errno.ENOENT, resource)
+            if self.abspath(target).startswith(self.abspath(resource).rstrip('/') + '/'):
+                raise self._error(errno.EINVAL, target) # Into its own subtree
+            dest, destname = self._entry(target)
+            dest[destname] = src.pop(srcname)
+            src.mtime = dest.mtime = time.time()
+
+    @wraps(BaseFilesystem.touch)
+    def touch(self, resource):
+        with self._state['lock']:
+            parent, name = self._entry(resource)
+            node = parent.get(name)
+            if node is None:
+                parent[name] = _MemoryFile()
+                parent.mtime = time.time()
+            else:
+                node.mtime = time.time()
+
+    def _tempname(self, prefix='tmp'):
+        """
+        Return an unused path in our /tmp, creating /tmp if needed.
+        """
+        self.mkdir('/tmp', parents=True)
+        while True:
+            name = '/tmp/{0}{1}'.format(prefix, binascii.hexlify(os.urandom(4)).decode('ascii'))
+            if not self.exists(name):
+                return name
+
+    @wraps(BaseFilesystem.tempfile)
+    def tempfile(self):
+        with self._state['lock']:
+            name = self._tempname()
+            self.touch(name)
+        return name
+
+    @wraps(BaseFilesystem.tempdir)
+    def tempdir(self):
+        with self._state['lock']:
+            name = self._tempname()
+            self.mkdir(name)
+        return name
+
+    @wraps(BaseFilesystem.stat)
+    def stat(self, resource):
+        node = self._node(resource)[1]
+        if isinstance(node, _MemoryDir):
+            mode, size, nlink = stat.S_IFDIR | 0o755, len(node), 2
+        else:
+            mode, size, nlink = stat.S_IFREG | 0o644, len(node.data), 1
+        return os.stat_result((mode, node.ino, 0, nlink, 0, 0, size,
+                               node.mtime, node.mtime, node.mtime))
+
+    @wraps(BaseFilesystem.rm)
+    def rm(self, resource, recursive=False):
+        with self._state['lock']:
+            parent, name = self._entry(resource)
+            node = parent.get(name)
+            if node is None:
+                raise exceptions.DoesNotExistError("No such file {0} Larry... ".format(resource))
+            if isinstance(node, _MemoryDir) and not recursive:
+                raise self._error(errno.EISDIR, resource)
+            del parent[name]
+            parent.mtime = time.time()
+
+    def dump_to(self, disk_path, resource='/'):
+        """
+        Write out the tree at RESOURCE to DISK_PATH on real disk, in one
+        pass: each directory is made once, and each file written with a
+        single write.
+
+        If DISK_PATH exists it must be a directory, and what we write is
+        merged into it.
+
+        Arguments:
+        - `disk_path`: str or Path
+        - `resource`: str or Path
+
+        Return: None
+        Exceptions: OSError
+        """
+        disk_path = str(disk_path)
+        node = self._node(resource)[1]
+        if isinstance(node, _MemoryFile):
+            with open(disk_path, 'wb') as fh:
+                fh.write(node.data)
+            return
+        stack = [(disk_path, node)]
+        while stack:
+            target, node = stack.pop()
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name, child in list(node.items()):
+                path = os.path.join(target, name)
+                if isinstance(child, _MemoryDir):
+                    stack.append((path, child))
+                else:
+                    with open(path, 'wb') as fh:
+                        fh.write(child.data)
+
+
+OverlayChanges = collections.namedtuple('OverlayChanges', 'written removed')
+
+class OverlayFilesystem(BaseFilesystem):
+    """
+    A writable, copy-on-write view of the filesystem LOWER, keeping
+    every change in the filesystem UPPER until we commit() or discard()
+    them - so that staging edits to a large tree costs in proportion to
+    the edits rather than to the tree.
+
+    Reads fall through to LOWER until a path is written, when it is
+    first copied up into UPPER. Deletions of paths in LOWER are
+    recorded as whiteouts, which hide them (and anything below them)
+    without touching LOWER at all.
+
+    Our paths are LOWER's paths. Their copies live at the same paths
+    in UPPER, or below UPPER_ROOT if given - which you want whenever
+    UPPER is the same disk as LOWER:
+
+    >>> overlay = OverlayFilesystem(DiskFilesystem(), MemoryFilesystem(shared=False))
+    >>> overlay = OverlayFilesystem(DiskFilesystem(), DiskFilesystem(),
+    ...                             upper_root='/var/tmp/staging')
+
+    Whiteouts are held in memory, by this instance.
+
+    Without an UPPER_ROOT, UPPER must be a MemoryFilesystem - else our
+    copies would be LOWER's files themselves, and discard() would
+    delete them - so we raise ValueError.
+    """
+    def __init__(self, lower, upper, upper_root=None, blocksize=1 << 20):
+        if upper_root is None and not isinstance(upper, MemoryFilesystem):
+            raise ValueError("UPPER must be separate from LOWER - use a MemoryFilesystem or pass UPPER_ROOT Larry... ")
+        self.lower = lower
+        self.upper = upper
+        self.upper_root = None if upper_root is None else str(upper_root)
+        self.blocksize = blocksize
+        self._whiteouts = set() # Removed from LOWER.
+        self._replaced = set()  # Removed from LOWER, then made again in UPPER.
+        self._written = set()   # Made or copied up in UPPER.
+        self._lock = threading.RLock()
+
+    def _error(self, code, resource):
+        return OSError(code, os.strerror(code), str(resource))
+
+    def _up(self, path):
+        """
+        Return the path in UPPER that holds our copy of PATH.
+        """
+        if self.upper_root is None:
+            return path
+        return self.upper.sep.join([self.upper_root.rstrip(self.upper.sep),
+                                    path.lstrip(self.sep)])
+
+    def _join(self, path, name):
+        return path.rstrip(self.sep) + self.sep + name
+
+    def _below(self, paths, path):
+        """
+        Return those of PATHS that are PATH or somewhere below it.
+        """
+        prefix = path.rstrip(self.sep) + self.sep
+        return [p for p in paths if p == path or p.startswith(prefix)]
+
+    def _hidden(self, path):
+        """
+        Predicate to determine whether LOWER's copy of PATH has been
+        removed - by a whiteout of PATH or any of its parents, or
+        because a parent was removed and made again.
+        """
+        if not (self._whiteouts or self._replaced):
+            return False
+        if path in self._whiteouts:
+            return True
+        while True:
+            parent = self.lower.parent(path)
+            if parent == path:
+                return False
+            if parent in self._whiteouts or parent in self._replaced:
+                return True
+            path = parent
+
+    def _lower(self, path):
+        """
+        Predicate to determine whether we can see PATH in LOWER.
+        """
+        return not self._hidden(path) and self.lower.exists(path)
+
+    def _claim(self, path):
+        """
+        Record that we have just made PATH in UPPER.
+        """
+        if path in self._whiteouts:
+            self._whiteouts.discard(path)
+            self._replaced.add(path)
+        self._written.add(path)
+
+    def _copy(self, srcfs, src, destfs, dest, atomic=False):
+        """
+        Copy the contents of the leaf SRC on SRCFS to DEST on DESTFS.
+        """
+        opener = destfs.atomic_open if atomic else destfs.open
+        with srcfs.open(src, 'rb') as infile:
+            with opener(dest, 'wb') as outfile:
+                while True:
+                    block = infile.read(self.blocksize)
+                    if not block:
+                        break
+                    outfile.write(block)
+
+    def _make_parents(self, path):
+        """
+        Make sure that the parents of PATH exist in UPPER, copying up
+        the branches that so far only exist in LOWER.
+
+        Exceptions: OSError
+        """
+        parent = self.lower.parent(path)
+        if not self.is_branch(parent):
+            raise self._error(errno.ENOENT, path)
+        missing = []
+        while parent != path and not self.upper.exists(self._up(parent)):
+            missing.append(parent)
+            path, parent = parent, self.lower.parent(parent)
+        for branch in reversed(missing):
+            self.upper.mkdir(self._up(branch))
+            self._written.add(branch)
+
+    def _copy_up(self, path):
+        """
+        Make sure that UPPER holds a copy of the leaf PATH, if we have one.
+        """
+        if self.upper.exists(self._up(path)) or not self._lower(path):
+            return
+        self._make_parents(path)
+        self._copy(self.lower, path, self.upper, self._up(path))
+        self._written.add(path)
+
+    def _readlink(self, fs, path):
+        """
+        Return the target of PATH on FS if it is a symlink, else None.
+
+        Only disk can hold symlinks - MemoryFilesystem won't make them.
+        """
+        if isinstance(fs, MemoryFilesystem) or not os.path.islink(path):
+            return None
+        return os.readlink(path)
+
+    def _remove(self, fs, path):
+        """
+        Remove PATH from FS, be it a leaf, a symlink or a whole branch.
+        """
+        if self._readlink(fs, path) is not None:
+            fs.rm(path)
+            return
+        fs.rm(path, recursive=fs.is_branch(path))
+
+    def changes(self):
+        """
+        Return the paths we have written and removed so far.
+
+        Return: OverlayChanges
+        Exceptions: None
+        """
+        with self._lock:
+            return OverlayChanges(sorted(self._written),
+                                  sorted(self._whiteouts | self._replaced))
+
+    def commit(self):
+        """
+        Apply our changes to LOWER, then discard them from UPPER.
+
+        Only the deltas are applied: removed paths are removed, and the
+        paths we have written are made or replaced - leaves atomically,
+        and symlinks as symlinks to the same target, dangling or not.
+        Everything else in LOWER is left alone.
+
+        Return: None
+        Exceptions: OSError
+        """
+        with self._lock:
+            for path in sorted(self._whiteouts | self._replaced):
+                if self.lower.exists(path):
+                    self._remove(self.lower, path)
+            for path in sorted(self._written):
+                upper = self._up(path)
+                link = self._readlink(self.upper, upper)
+                if link is not None:
+                    if self.lower.exists(path) or self._readlink(self.lower, path) is not None:
+                        self._remove(self.lower, path)
+                    self.lower.ln(link, path, symbolic=True)
+                elif self.upper.is_branch(upper):
+                    if not self.lower.is_branch(path):
+                        self.lower.mkdir(path)
+                elif self.upper.is_leaf(upper):
+                    self._copy(self.upper, upper, self.lower, path, atomic=True)
+            self.discard()
+
+    def discard(self):
+        """
+        Throw away our changes, leaving LOWER as it was.
+
+        Return: None
+        Exceptions: None
+        """
+        with self._lock:
+            for path in sorted(self._written, reverse=True):
+                upper = self._up(path)
+                if self.upper.exists(upper) or self._readlink(self.upper, upper) is not None:
+                    self._remove(self.upper, upper)
+            self._whiteouts.clear()
+            self._replaced.clear()
+            self._written.clear()
+
+    @property
+    @wraps(BaseFilesystem.sep)
+    def sep(self):
+        return self.lower.sep
+
+    @wraps(BaseFilesystem.exists)
+    def exists(self, resource):
+        path = self.abspath(resource)
+        return self.upper.exists(self._up(path)) or self._lower(path)
+
+    @wraps(BaseFilesystem.is_branch)
+    def is_branch(self, resource):
+        path = self.abspath(resource)
+        upper = self._up(path)
+        if self.upper.exists(upper):
+            return self.upper.is_branch(upper)
+        return not self._hidden(path) and self.lower.is_branch(path)
+
+    @wraps(BaseFilesystem.is_leaf)
+    def is_leaf(self, resource):
+        path = self.abspath(resource)
+        upper = self._up(path)
+        if self.upper.exists(upper):
+            return self.upper.is_leaf(upper)
+        return not self._hidden(path) and self.lower.is_leaf(path)
+
+    @wraps(BaseFilesystem.ls)
+    def ls(self, resource, all=None):
+        path = self.abspath(resource)
+        upper = self._up(path)
+        if not self.is_branch(path):
+            raise self._error(errno.ENOTDIR if self.exists(path) else errno.ENOENT, resource)
+        entries = []
+        if self.upper.is_branch(upper):
+            entries = self.upper.ls(upper, all=all)
+        if path not in self._replaced and self._lower(path) and self.lower.is_branch(path):
+            seen = set(entries)
+            entries += [e for e in self.lower.ls(path, all=all)
+                        if e not in seen and self._join(path, e) not in self._whiteouts]
+        return entries
+
+    @wraps(BaseFilesystem.stat)
+    def stat(self, resource):
+        path = self.abspath(resource)
+        upper = self._up(path)
+        if self.upper.exists(upper):
+            return self.upper.stat(upper)
+        if self._hidden(path):
+            raise self._error(errno.ENOENT, resource)
+        return self.lower.stat(path)
+
+    @wraps(BaseFilesystem.getwd)
+    def getwd(self):
+        return self.lower.getwd()
+
+    @wraps(BaseFilesystem.cd)
+    def cd(self, target):
+        return self.lower.cd(target)
+
+    @wraps(BaseFilesystem.is_abspath)
+    def is_abspath(self, resource):
+        return self.lower.is_abspath(resource)
+
+    @wraps(BaseFilesystem.expanduser)
+    def expanduser(self, resource):
+        return self.lower.expanduser(resource)
+
+    @wraps(BaseFilesystem.abspath)
+    def abspath(self, resource):
+        return self.lower.abspath(resource)
+
+    @wraps(BaseFilesystem.parent)
+    def parent(self, resource):
+        return self.lower.parent(resource)
+
+    @wraps(BaseFilesystem.open)
+    def open(self, resource, mode='r'):
+        path = self.abspath(resource)
+        if not set(mode) & set('wax+'):
+            if self.upper.exists(self._up(path)):
+                return self.upper.open(self._up(path), mode)
+            if self._hidden(path):
+                raise self._error(errno.ENOENT, resource)
+            return self.lower.open(path, mode)
+        with self._lock:
+            if 'x' in mode and self.exists(path):
+                raise self._error(errno.EEXIST, resource)
+            if 'w' not in mode:
+                self._copy_up(path)
+            if not self.upper.exists(self._up(path)):
+                if 'r' in mode:
+                    raise self._error(errno.ENOENT, resource)
+                self._make_parents(path)
+            fh = self.upper.open(self._up(path), mode)
+            self._claim(path)
+            return fh
+
+    @wraps(BaseFilesystem.atomic_open)
+    @contextlib.contextmanager
+    def atomic_open(self, resource, mode='w', fsync=False):
+        path = self.abspath(resource)
+        with self._lock:
+            self._make_parents(path)
+        with self.upper.atomic_open(self._up(path), mode, fsync=fsync) as fh:
+            yield fh
+        with self._lock:
+            self._claim(path)
+
+    @wraps(BaseFilesystem.mkdir)
+    def mkdir(self, resource, parents=False):
+        path = self.abspath(resource)
+        with self._lock:
+            if self.exists(path):
+                if parents and self.is_branch(path):
+                    return
+                raise self._error(errno.EEXIST, resource)
+            parent = self.lower.parent(path)
+            if not self.is_branch(parent):
+                if not parents:
+                    raise exceptions.BadParentingError(
+                        'Target {0} lacked some parents'.format(resource))
+                self.mkdir(parent, parents=True)
+            self._make_parents(path)
+            self.upper.mkdir(self._up(path))
+            self._claim(path)
+
+    @wraps(BaseFilesystem.cp)
+    def cp(self, resource, target, recursive=False):
+        if not self.exists(resource):
+            raise exceptions.DoesNotExistError("Can't copy something that doesn't exist Larry... ")
+        if self.exists(target):
+            raise exceptions.ExistsError("Won't overwrite an existing target Larry... ")
+        if not self.is_branch(resource):
+            return self._copy(self, self.abspath(resource), self, self.abspath(target))
+        if not recursive:
+            return
+        stack = [(self.abspath(resource), self.abspath(target))]
+        while stack:
+            src, dest = stack.pop()
+            if self.is_branch(src):
+                self.mkdir(dest)
+                stack.extend((self._join(src, name), self._join(dest, name))
+                             for name in self.ls(src, all=True) if name not in ('.', '..'))
+            else:
+                self._copy(self, src, self, dest)
+
+    @wraps(BaseFilesystem.ln)
+    def ln(self, resource, target, symbolic=False):
+        path = self.abspath(target)
+        with self._lock:
+            if self.exists(path):
+                raise exceptions.ExistsError(
+                    '{0} already exists Larry... did you mean to force?'.format(target))
+            self._make_parents(path)
+            if symbolic:
+                self.upper.ln(resource, self._up(path), symbolic=True)
+            else:
+                source = self.abspath(resource)
+                self._copy_up(source)
+                self.upper.ln(self._up(source), self._up(path))
+            self._claim(path)
+
+    @wraps(BaseFilesystem.mv)
+    def mv(self, resource, target):
+        path, target = self.abspath(resource), self.abspath(target)
+        with self._lock:
+            if not self.exists(path):
+                raise self._error(errno.ENOENT, resource)
+            if self.is_branch(target):
+                target = self._join(target, str.rsplit(path, self.sep, 1)[-1])
+            if self.is_leaf(target):
+                self.rm(target)
+            if self._lower(path):
+                self.cp(path, target, recursive=True)
+                self.rm(path, recursive=True)
+                return
+            # Only in UPPER, so we can move it there directly.
+            self._make_parents(target)
+            self.upper.mv(self._up(path), self._up(target))
+            for moved in self._below(self._written, path):
+                self._written.discard(moved)
+                self._claim(target + moved[len(path):])
+
+    @wraps(BaseFilesystem.touch)
+    def touch(self, resource):
+        path = self.abspath(resource)
+        with self._lock:
+            if self.is_branch(path):
+                if not self.upper.exists(self._up(path)):
+                    self._make_parents(path)
+                    self.upper.mkdir(self._up(path))
+            else:
+                self._copy_up(path)
+                if not self.upper.exists(self._up(path)):
+                    self._make_parents(path)
+            self.upper.touch(self._up(path))
+            self._claim(path)
+
+    @wraps(BaseFilesystem.tempfile)
+    def tempfile(self):
+        return self.upper.tempfile()
+
+    @wraps(BaseFilesystem.tempdir)
+    def tempdir(self):
+        return self.upper.tempdir()
+
+    @wraps(BaseFilesystem.rm)
+    def rm(self, resource, recursive=False):
+        path = self.abspath(resource)
+        with self._lock:
+            if not self.exists(path):
+                raise exceptions.DoesNotExistError("No such file {0} Larry... ".format(resource))
+            if self.is_branch(path) and not recursive:
+                raise self._error(errno.EISDIR, resource)
+            upper = self._up(path)
+            if self.upper.exists(upper):
+                self._remove(self.upper, upper)
+            inlower = self._lower(path)
+            for tracked in (self._written, self._replaced, self._whiteouts):
+                tracked.difference_update(self._below(tracked, path))
+            if inlower:
+                self._whiteouts.add(path)
+
+
+# Latency histograms keep 2**HISTOGRAM_PRECISION buckets per power of two,
+# so each bucket is within 1/2**HISTOGRAM_PRECISION of the values in it.
+HISTOGRAM_PRECISION = 2
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+def _bucket(value, precision=HISTOGRAM_PRECISION):
+    """
+    Return the lower bound of the log-linear histogram bucket for VALUE.
+
+    Arguments:
+    - `value`: int
+    - `precision`: int
+
+    Return: int
+    Exceptions: None
+    """
+    shift = max(value.bit_length() - 1 - precision, 0)
+    return (value >> shift) << shift
+
+
+class FilesystemStats(object):
+    """
+    Counters for the calls made through one or more
+    InstrumentedFilesystems: per flavour and method, the number of
+    calls and errors, total time, bytes read and written through the
+    files they opened, and a histogram of latencies in nanoseconds.
+
+    While ENABLED is falsy nothing is recorded, and instrumented calls
+    go straight through.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._ops = {}
+        self._lock = threading.Lock()
+        self._dumper = None
+        self._stop = threading.Event()
+
+    def _op(self, flavour, method):
+        """
+        Return the counters for METHOD of FLAVOUR. Call with the lock held.
+        """
+        key = (flavour, method)
+        op = self._ops.get(key)
+        if op is None:
+            op = self._ops[key] = dict(count=0, errors=0, total_ns=0, bytes_read=0,
+                                       bytes_written=0, histogram={})
+        return op
+
+    def record(self, flavour, method, ns, error=False):
+        """
+        Count one call to METHOD of FLAVOUR that took NS nanoseconds.
+
+        Arguments:
+        - `flavour`: str
+        - `method`: str
+        - `ns`: int
+        - `error`: bool
+
+        Return: None
+        Exceptions: None
+        """
+        bucket = _bucket(ns)
+        with self._lock:
+            op = self._op(flavour, method)
+            op['count'] += 1
+            op['errors'] += bool(error)
+            op['total_ns'] += ns
+            histogram = op['histogram']
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def record_bytes(self, flavour, method, read=0, written=0):
+        """
+        Count data moved through a file opened by METHOD of FLAVOUR.
+
+        Arguments:
+        - `flavour`: str
+        - `method`: str
+        - `read`: int
+        - `written`: int
+
+        Return: None
+        Exceptions: None
+        """
+        with self._lock:
+            op = self._op(flavour, method)
+            op['bytes_read'] += read
+            op['bytes_written'] += written
+
+    def snapshot(self):
+        """
+        Return a copy of our counters, as a dict of flavours to dicts
+        of methods to counters.
+
+        Return: dict
+        Exceptions: None
+        """
+        snapshot = {}
+        with self._lock:
+            for (flavour, method), op in self._ops.items():
+                op = dict(op, histogram=dict(op['histogram']))
+                snapshot.setdefault(flavour, {})[method] = op
+        return snapshot
+
+    def reset(self):
+        """
+        Forget everything we have counted.
+
+        Return: None
+        Exceptions: None
+        """
+        with self._lock:
+            self._ops.clear()
+
+    def dump(self, path):
+        """
+        Append a snapshot to the JSON Lines file at PATH, as one line
+        of {"time": ..., "stats": ...}.
+
+        Arguments:
+        - `path`: str or Path
+
+        Return: None
+        Exceptions: None
+        """
+        line = json.dumps(dict(time=time.time(), stats=self.snapshot()), sort_keys=True)
+        with open(str(path), 'a') as fh:
+            fh.write(line + '\n')
+
+    def start_dumping(self, path, interval=60):
+        """
+        Start a daemon thread that dump()s to PATH every INTERVAL
+        seconds, until stop_dumping().
+
+        Arguments:
+        - `path`: str or Path
+        - `interval`: int
+
+        Return: None
+        Exceptions: None
+        """
+        self.stop_dumping()
+        self._stop = threading.Event()
+
+        def dump_periodically(stop):
+            while not stop.wait(interval):
+                self.dump(path)
+
+        self._dumper = threading.Thread(target=dump_periodically, args=(self._stop,))
+        self._dumper.daemon = True
+        self._dumper.start()
+
+    def stop_dumping(self):
+        """
+        Stop dumping, if we are.
+
+        Return: None
+        Exceptions: None
+        """
+        self._stop.set()
+        if self._dumper is not None:
+            self._dumper.join()
+            self._dumper = None
+
+# What InstrumentedFilesystems record to unless given their own.
+fsstats = FilesystemStats()
+
+
+class _CountingFile(object):
+    """
+    A file opened through an InstrumentedFilesystem. We pass everything
+    through to FH, counting what is read and written. In text mode we
+    count characters.
+    """
+    def __init__(self, fh, stats, flavour, method):
+        self._fh = fh
+        self._count = functools.partial(stats.record_bytes, flavour, method)
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def __enter__(self):
+        self._fh.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._fh.__exit__(exc_type, exc_value, traceback)
+
+    def __iter__(self):
+        for line in self._fh:
+            self._count(read=len(line))
+            yield line
+
+    def read(self, *args):
+        data = self._fh.read(*args)
+        self._count(read=len(data))
+        return data
+
+    def readline(self, *args):
+        line = self._fh.readline(*args)
+        self._count(read=len(line))
+        return line
+
+    def readlines(self, *args):
+        lines = self._fh.readlines(*args)
+        self._count(read=sum(len(line) for line in lines))
+        return lines
+
+    def write(self, data):
+        written = self._fh.write(data)
+        self._count(written=len(data))
+        return written
+
+    def writelines(self, lines):
+        lines = list(lines)
+        self._fh.writelines(lines)
+        self._count(written=sum(len(line) for line in lines))
+
+
+def _instrumented(method):
+    """
+    Return an InstrumentedFilesystem method that times calls to
+    METHOD of the filesystem it wraps.
+    """
+    @wraps(getattr(BaseFilesystem, method))
+    def instrumented(self, *args, **kw):
+        return self._call(method, *args, **kw)
+    return instrumented
+
+
+class InstrumentedFilesystem(BaseFilesystem):
+    """
+    Wrap another filesystem, recording the calls made through us to
+    STATS (by default, the module-level fsstats), under the class name
+    of the wrapped filesystem - its flavour.
+
+    >>> fs = InstrumentedFilesystem(DiskFilesystem())
+    >>> fs.exists('/tmp')
+    >>> fsstats.snapshot()['DiskFilesystem']['exists']['count']
+    1
+    """
+    def __init__(self, wrapped, stats=None):
+        self.wrapped = wrapped
+        self.stats = fsstats if stats is None else stats
+        self.flavour = type(wrapped).__name__
+
+    def _call(self, method, *args, **kw):
+        """
+        Call METHOD of the wrapped filesystem, recording how it went.
+        """
+        if not self.stats.enabled:
+            return getattr(self.wrapped, method)(*args, **kw)
+        start = _clock()
+        try:
+            result = getattr(self.wrapped, method)(*args, **kw)
+        except:
+            self.stats.record(self.flavour, method, int((_clock() - start) * 1e9), error=True)
+            raise
+        self.stats.record(self.flavour, method, int((_clock() - start) * 1e9))
+        if method == 'open':
+            result = _CountingFile(result, self.stats, self.flavour, method)
+        return result
+
+    @property
+    @wraps(BaseFilesystem.sep)
+    def sep(self):
+        return self.wrapped.sep
+
+    exists = _instrumented('exists')
+    getwd = _instrumented('getwd')
+    ls = _instrumented('ls')
+    cd = _instrumented('cd')
+    is_abspath = _instrumented('is_abspath')
+    open = _instrumented('open')
+    is_branch = _instrumented('is_branch')
+    is_leaf = _instrumented('is_leaf')
+    expanduser = _instrumented('expanduser')
+    abspath = _instrumented('abspath')
+    parent = _instrumented('parent')
+    mkdir = _instrumented('mkdir')
+    cp = _instrumented('cp')
+    ln = _instrumented('ln')
+    mv = _instrumented('mv')
+    touch = _instrumented('touch')
+    tempfile = _instrumented('tempfile')
+    tempdir = _instrumented('tempdir')
+    borrow_tempdir = _instrumented('borrow_tempdir')
+    return_tempdir = _instrumented('return_tempdir')
+    scratch = _instrumented('scratch')
+    stat = _instrumented('stat')
+    stat_many = _instrumented('stat_many')
+    exists_many = _instrumented('exists_many')
+    classify_many = _instrumented('classify_many')
+    rm = _instrumented('rm')
+
+    @wraps(BaseFilesystem.atomic_open)
+    @contextlib.contextmanager
+    def atomic_open(self, resource, mode='w', fsync=False):
+        # We time opening and committing, but not the caller's block.
+        if not self.stats.enabled:
+            with self.wrapped.atomic_open(resource, mode, fsync=fsync) as fh:
+                yield fh
+            return
+        method, elapsed, error = 'atomic_open', 0, True
+        start = _clock()
+        context = self.wrapped.atomic_open(resource, mode, fsync=fsync)
+        try:
+            fh = context.__enter__()
+            elapsed = _clock() - start
+            try:
+                yield _CountingFile(fh, self.stats, self.flavour, method)
+            except:
+                start = _clock()
+                if not context.__exit__(*sys.exc_info()):
+                    raise
+            else:
+                start = _clock()
+                context.__exit__(None, None, None)
+            error = False
+        finally:
+            self.stats.record(self.flavour, method,
+                              int((elapsed + _clock() - start) * 1e9), error=error)
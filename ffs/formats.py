@@ -3,6 +3,12 @@ ffs.formats
 """
 import collections
 import csv
+import itertools
+import types
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 import six
 from six.moves import StringIO
@@ -214,3 +220,286 @@ class CSV(object):
             raise AttributeError('Object CSV has no attribute writerows')
         self._resolve_writer()
         self.resolved.writerows(row)
+
+
+def iter_jsonl(fh, batch_size=1000):
+    """
+    Lazily parse the JSON Lines file-like object FH, yielding one
+    record per non-blank line.
+
+    Rather than calling the decoder once per line we decode BATCH_SIZE
+    lines at a time as a single JSON array, with each line wrapped in an
+    array of its own. Unless that gives one single-item array per line -
+    which a value that spans lines, or two values on one line, can't -
+    we decode the batch again line by line, so that errors point at the
+    offending line of FH.
+
+    Arguments:
+    - `fh`: file-like object
+    - `batch_size`: int
+
+    Return: generator(object)
+    Exceptions: ValueError
+    """
+    lineno = 0
+    while True:
+        lines = list(itertools.islice(fh, batch_size))
+        if not lines:
+            return
+        numbered = [(lineno + i + 1, l) for i, l in enumerate(lines) if l.strip()]
+        lineno += len(lines)
+        if not numbered:
+            continue
+        try:
+            batch = json.loads('[[' + '],['.join(l for _, l in numbered) + ']]')
+        except ValueError:
+            batch = None
+        if (batch is None or len(batch) != len(numbered)
+                or not all(type(r) is list and len(r) == 1 for r in batch)):
+            batch = [_jsonl_line(n, l) for n, l in numbered]
+        else:
+            batch = [r[0] for r in batch]
+        for record in batch:
+            yield record
+
+def _jsonl_line(lineno, line):
+    """
+    Decode LINE, number LINENO of a JSON Lines file, saying which line
+    it was if that fails.
+    """
+    try:
+        return json.loads(line)
+    except ValueError as err:
+        raise ValueError('Line {0}: {1}'.format(lineno, err))
+
+
+class _JSONStream(object):
+    """
+    A window onto a file-like object containing JSON, which lets us
+    walk the document token by token, decoding one value at a time.
+    """
+    WHITESPACE = ' \t\n\r'
+    NUMBER = '0123456789+-.eE'
+
+    def __init__(self, fh, chunksize):
+        self.fh = fh
+        self.chunksize = chunksize
+        self.buf = ''
+        self.pos = 0
+        self.offset = 0 # Of the start of buf in the file.
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """
+        Read more data into our buffer, discarding what we have consumed.
+        We read at least as much as we already hold, so that a very large
+        value costs a logarithmic number of decode attempts.
+
+        Return: bool - False at EOF
+        Exceptions: None
+        """
+        if self.eof:
+            return False
+        held = len(self.buf) - self.pos
+        data = self.fh.read(max(self.chunksize, held))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.offset += self.pos
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or '' at EOF.
+
+        Return: str
+        Exceptions: None
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """
+        Consume the next character, which must be one of CHARS.
+
+        Arguments:
+        - `chars`: str
+
+        Return: str
+        Exceptions: ValueError
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expecting one of {0!r} at offset {1}, got {2!r}'.format(
+                    chars, self.offset + self.pos, char))
+        self.pos += 1
+        return char
+
+    def _truncated(self, err):
+        """
+        Predicate to determine whether the decoding error ERR might go
+        away with more data - rather than being a syntax error, which
+        shouldn't make us read the rest of the file before raising.
+
+        Arguments:
+        - `err`: ValueError
+
+        Return: bool
+        Exceptions: None
+        """
+        pos = getattr(err, 'pos', None)
+        if pos is None:
+            return True # No position to go on, so we can't tell.
+        if str(err).startswith('Unterminated string'):
+            return True
+        # Allow for a partial literal or escape, e.g. 'fals' or '\u12'.
+        return pos >= len(self.buf) - len('\\uXXXX')
+
+    def value(self):
+        """
+        Decode and consume the next complete JSON value.
+
+        Return: object
+        Exceptions: ValueError
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError as err:
+                if self._truncated(err) and self._fill():
+                    continue
+                if getattr(err, 'pos', None) is None:
+                    raise
+                raise ValueError('{0} at offset {1}'.format(err.msg, self.offset + err.pos))
+            # A number at the end of the buffer may only be partially read,
+            # e.g. '1.' of '1.5e10' decodes to 1, leaving '.' behind.
+            if not self.buf[end:].lstrip(self.NUMBER) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def json_items(fh, prefix='item', chunksize=65536):
+    """
+    Incrementally parse the file-like object FH, yielding the elements
+    of a JSON array one at a time without materializing the document.
+
+    PREFIX names the array to stream, in the dotted style of ijson:
+    'item' is the elements of a top-level array, 'results.item' the
+    elements of the array under the top level key 'results', and so on.
+    Sibling values along the way are decoded and discarded one at a time.
+
+    Arguments:
+    - `fh`: file-like object
+    - `prefix`: str
+    - `chunksize`: int
+
+    Return: generator(object)
+    Exceptions: ValueError
+    """
+    components = prefix.split('.') if prefix else []
+    if (components and components[-1] != 'item') or 'item' in components[:-1]:
+        raise ValueError("Can only stream the items of an array, not {0}".format(prefix))
+    stream = _JSONStream(fh, chunksize)
+    if not components:
+        yield stream.value()
+        return
+
+    for key in components[:-1]:
+        stream.expect('{')
+        while True:
+            if stream.peek() == '}':
+                return
+            found = stream.value()
+            stream.expect(':')
+            if found == key:
+                break
+            stream.value()
+            if stream.expect(',}') == '}':
+                return
+
+    stream.expect('[')
+    if stream.peek() == ']':
+        return
+    while True:
+        yield stream.value()
+        if stream.expect(',]') == ']':
+            return
+
+
+def json_dump(obj, fh, buffer_size=1 << 16, **kw):
+    """
+    Serialize OBJ as JSON to the file-like object FH.
+
+    The encoder's output is gathered into BUFFER_SIZE writes, rather than
+    writing each of the many small fragments it produces.
+
+    If OBJ is a list, tuple or generator, we stream it as a JSON array,
+    encoding one element at a time. This allows writing generators of
+    records without holding them all in memory. Anything else is
+    encoded as json.dump() would.
+
+    Other keyword arguments are passed to json.JSONEncoder.
+
+    Arguments:
+    - `obj`: object
+    - `fh`: file-like object
+    - `buffer_size`: int
+
+    Return: None
+    Exceptions: TypeError
+    """
+    encoder = json.JSONEncoder(**kw)
+    if isinstance(obj, (list, tuple, types.GeneratorType)):
+        chunks = _iterencode_array(encoder, obj)
+    else:
+        chunks = encoder.iterencode(obj)
+
+    buf, size = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            fh.write(''.join(buf))
+            buf, size = [], 0
+    if buf:
+        fh.write(''.join(buf))
+
+
+def _iterencode_array(encoder, items):
+    """
+    Encode the iterable ITEMS as a JSON array one element at a time.
+
+    Arguments:
+    - `encoder`: json.JSONEncoder
+    - `items`: iterable
+
+    Return: generator(str)
+    Exceptions: TypeError
+    """
+    indent = encoder.indent
+    if indent is not None and not isinstance(indent, six.string_types):
+        indent = ' ' * indent
+    yield '['
+    frist = True
+    for item in items:
+        if not frist:
+            yield encoder.item_separator
+        frist = False
+        if indent is None:
+            yield encoder.encode(item)
+        else:
+            # Encoded JSON only has newlines between tokens, never in strings.
+            yield '\n' + indent + encoder.encode(item).replace('\n', '\n' + indent)
+    if indent is not None and not frist:
+        yield '\n'
+    yield ']'
@@ -0,0 +1,538 @@
+"""
+ffs.iosched
+
+Keep bulk filesystem work from starving everything else on a shared disk.
+
+A Scheduler meters I/O through two token buckets - bytes per second and
+operations per second - and bounds how many streams of work may run at
+once, handing each free slot to the most urgent waiter:
+
+>>> iosched.enable(bytes_per_sec=50 << 20, ops_per_sec=500, max_concurrent=4)
+>>> with iosched.priority(iosched.BACKGROUND):
+...     Path('/data/archive').cp('/backup/archive')
+
+While a scheduler is enabled, nix.cp(), nix.rm(), nix.cmp_tree()'s
+digests and Path.checksum route through it. FOREGROUND work still waits
+for a slot, but is never throttled. BACKGROUND streams also tell the
+kernel to drop the pages they have read from the page cache, so that
+they don't evict everyone else's.
+
+Separately, advise() and madvise() pass on how a reader means to use a
+file - 'sequential', 'random' or 'once' - as Path.open(access=...)
+and friends do.
+"""
+from __future__ import with_statement
+
+import contextlib
+import heapq
+import itertools
+import mmap
+import os
+import shutil
+import threading
+import time
+
+from ffs._py3k import ContextVar, scandir
+
+# Priority classes, most urgent first.
+FOREGROUND, NORMAL, BACKGROUND = 0, 1, 2
+# Bytes a scheduled copy or checksum reads at a time.
+BLOCKSIZE = 1 << 20
+# Seconds' worth of tokens a bucket holds when full, to absorb bursts.
+BURST = 1.0
+# The access hints advise() understands.
+ACCESS_HINTS = ('sequential', 'random', 'once')
+# The access hint for reads that don't give one. None leaves the kernel
+# to its own devices.
+DEFAULT_ACCESS = None
+# How far a reader with access='once' gets ahead of the pages it drops.
+DROP_BEHIND = 1 << 22
+
+_clock = getattr(time, 'monotonic', time.time)
+_sleep = time.sleep
+
+_scheduler = None
+_priority = ContextVar('ffs_io_priority', default=NORMAL)
+
+
+class TokenBucket(object):
+    """
+    Hand out RATE tokens a second, holding at most CAPACITY at once.
+
+    take() never refuses: a caller that takes more than we have puts us
+    in debt, and sleeps until it is repaid. Concurrent callers queue up
+    behind each other's debts, so that together they never exceed RATE.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("A rate of {0} tokens a second won't get far Larry... ".format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate * BURST)
+        self.tokens = self.capacity
+        self.stamp = _clock()
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        """
+        Take N tokens, sleeping until we have them.
+
+        Arguments:
+        - `n`: number
+
+        Return: float - the seconds we slept
+        Exceptions: None
+        """
+        with self._lock:
+            now = _clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            _sleep(wait)
+        return wait
+
+
+class _Slots(object):
+    """
+    A semaphore of N slots which, when all are taken, hands the next one
+    freed to the most urgent waiter - and between equals, the first.
+    """
+    def __init__(self, n):
+        self.free = n
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            while self.free < 1 or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.free -= 1
+            if self.free and self._waiting:
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.free += 1
+            self._cond.notify_all()
+
+
+def get_priority(priority=None):
+    """
+    Return PRIORITY, or failing that the priority class of the current
+    thread or asyncio task.
+
+    Arguments:
+    - `priority`: int
+
+    Return: int
+    Exceptions: None
+    """
+    return _priority.get() if priority is None else priority
+
+@contextlib.contextmanager
+def priority(level):
+    """
+    Run the scheduled I/O in this block - in this thread or asyncio task
+    - at the priority class LEVEL.
+
+    Arguments:
+    - `level`: int
+
+    Return: None
+    Exceptions: ValueError
+    """
+    if level not in (FOREGROUND, NORMAL, BACKGROUND):
+        raise ValueError("No such priority class as {0!r} Larry... ".format(level))
+    previous = _priority.get()
+    _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.set(previous)
+
+
+class Scheduler(object):
+    """
+    Meter filesystem work to BYTES_PER_SEC and OPS_PER_SEC, running at
+    most MAX_CONCURRENT streams of it at once. Any of these may be None,
+    meaning no limit.
+
+    A copy costs its size twice: once to read it and once to write it.
+    With FADVISE, BACKGROUND streams drop what they read from the page
+    cache.
+    """
+    def __init__(self, bytes_per_sec=None, ops_per_sec=None, max_concurrent=None,
+                 fadvise=True):
+        self.bytes = TokenBucket(bytes_per_sec) if bytes_per_sec else None
+        self.ops = TokenBucket(ops_per_sec) if ops_per_sec else None
+        self.slots = _Slots(max_concurrent) if max_concurrent else None
+        self.fadvise = fadvise and hasattr(os, 'posix_fadvise')
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stream(self, priority=None):
+        """
+        Hold one of our slots for the duration of the block, waiting for
+        it if needs be. Streams nested in one thread share their slot.
+
+        Arguments:
+        - `priority`: int
+
+        Return: None
+        Exceptions: None
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if not depth and self.slots is not None:
+            self.slots.acquire(get_priority(priority))
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if not depth and self.slots is not None:
+                self.slots.release()
+
+    def op(self, n=1, priority=None):
+        """
+        Wait until we may make N filesystem operations.
+        """
+        if self.ops is not None and get_priority(priority) != FOREGROUND:
+            self.ops.take(n)
+
+    def transfer(self, nbytes, priority=None):
+        """
+        Wait until we may have moved NBYTES.
+        """
+        if self.bytes is not None and get_priority(priority) != FOREGROUND:
+            self.bytes.take(nbytes)
+
+    def blocks(self, fh, blocksize=BLOCKSIZE, priority=None):
+        """
+        Generate the rest of the binary file FH in blocks of BLOCKSIZE,
+        metering each as it is read.
+
+        Arguments:
+        - `fh`: file
+        - `blocksize`: int
+        - `priority`: int
+
+        Return: generator of bytes
+        Exceptions: None
+        """
+        priority = get_priority(priority)
+        dontneed = self.fadvise and priority == BACKGROUND
+        if dontneed:
+            try:
+                fd, offset = fh.fileno(), fh.tell()
+            except (AttributeError, IOError, ValueError):
+                dontneed = False # Not a file on disk
+        with self.stream(priority):
+            for block in iter(lambda: fh.read(blocksize), b''):
+                self.transfer(len(block), priority)
+                if dontneed:
+                    dontneed_pages(fd, offset, len(block))
+                    offset += len(block)
+                yield block
+
+    def copyfile(self, src, dst, priority=None):
+        """
+        Copy the file SRC to DST, with its permissions and times, as
+        shutil.copy2() would.
+
+        Arguments:
+        - `src`: str
+        - `dst`: str
+        - `priority`: int
+
+        Return: None
+        Exceptions: IOError, OSError
+        """
+        priority = get_priority(priority)
+        with self.stream(priority):
+            self.op(priority=priority)
+            with open(src, 'rb') as fsrc:
+                with open(dst, 'wb') as fdst:
+                    for block in self.blocks(fsrc, priority=priority):
+                        self.transfer(len(block), priority)
+                        fdst.write(block)
+            shutil.copystat(src, dst)
+
+    def copytree(self, src, dst, priority=None):
+        """
+        Copy the tree at SRC to DST, following symlinks, as
+        shutil.copytree() would.
+
+        Arguments:
+        - `src`: str
+        - `dst`: str
+        - `priority`: int
+
+        Return: None
+        Exceptions: IOError, OSError
+        """
+        priority = get_priority(priority)
+        with self.stream(priority):
+            self.op(priority=priority)
+            os.mkdir(dst)
+            for entry in scandir(src):
+                target = os.path.join(dst, entry.name)
+                if entry.is_dir():
+                    self.copytree(entry.path, target, priority)
+                else:
+                    self.copyfile(entry.path, target, priority)
+            shutil.copystat(src, dst)
+
+    def remove(self, path, priority=None):
+        """
+        Remove the file at PATH.
+        """
+        priority = get_priority(priority)
+        with self.stream(priority):
+            self.op(priority=priority)
+            os.remove(path)
+
+    def rmtree(self, path, priority=None):
+        """
+        Remove the tree at PATH, one metered operation per entry.
+
+        Arguments:
+        - `path`: str
+        - `priority`: int
+
+        Return: None
+        Exceptions: OSError - including if PATH is a symlink, as shutil.rmtree()
+        """
+        if os.path.islink(path):
+            raise OSError("Cannot call rmtree on a symbolic link Larry... ")
+        priority = get_priority(priority)
+        with self.stream(priority):
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    self.rmtree(entry.path, priority)
+                else:
+                    self.remove(entry.path, priority)
+            self.op(priority=priority)
+            os.rmdir(path)
+
+
+def enable(bytes_per_sec=None, ops_per_sec=None, max_concurrent=None, fadvise=True):
+    """
+    Route ffs's bulk I/O through a new Scheduler with these limits,
+    replacing any we had.
+
+    Arguments:
+    - `bytes_per_sec`: int
+    - `ops_per_sec`: int
+    - `max_concurrent`: int
+    - `fadvise`: bool
+
+    Return: Scheduler
+    Exceptions: ValueError
+    """
+    global _scheduler
+    _scheduler = Scheduler(bytes_per_sec=bytes_per_sec, ops_per_sec=ops_per_sec,
+                           max_concurrent=max_concurrent, fadvise=fadvise)
+    return _scheduler
+
+def disable():
+    """
+    Stop scheduling ffs's bulk I/O.
+
+    Return: None
+    Exceptions: None
+    """
+    global _scheduler
+    _scheduler = None
+
+def current():
+    """
+    Return the enabled Scheduler, or None.
+
+    Return: Scheduler
+    Exceptions: None
+    """
+    return _scheduler
+
+def blocks(fh, blocksize=BLOCKSIZE):
+    """
+    Generate the rest of the binary file FH in blocks of BLOCKSIZE -
+    through the scheduler, if one is enabled.
+
+    Arguments:
+    - `fh`: file
+    - `blocksize`: int
+
+    Return: generator of bytes
+    Exceptions: None
+    """
+    scheduler = _scheduler
+    if scheduler is None:
+        return iter(lambda: fh.read(blocksize), b'')
+    return scheduler.blocks(fh, blocksize)
+
+def dontneed_pages(fd, offset=0, length=0):
+    """
+    Drop LENGTH bytes of the file FD from OFFSET out of the page cache,
+    or up to its end if LENGTH is 0. Dirty pages stay until written.
+
+    Arguments:
+    - `fd`: int
+    - `offset`: int
+    - `length`: int
+
+    Return: None
+    Exceptions: OSError
+    """
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+def get_access(access=None):
+    """
+    Return the access hint ACCESS, or failing that DEFAULT_ACCESS.
+
+    Arguments:
+    - `access`: str
+
+    Return: str
+    Exceptions: ValueError
+    """
+    access = DEFAULT_ACCESS if access is None else access
+    if access is not None and access not in ACCESS_HINTS:
+        raise ValueError("Access should be one of {0} Larry... ".format(', '.join(ACCESS_HINTS)))
+    return access
+
+def advise(fh, access=None):
+    """
+    Tell the kernel how we mean to read the open file FH.
+
+    'sequential' doubles its readahead, 'random' turns readahead off,
+    and 'once' reads ahead as for 'sequential' while dropping pages from
+    the cache behind us as we go - so that scanning a huge file once
+    doesn't evict everything else.
+
+    Return FH, or for 'once' a proxy for it that does the dropping. Use
+    either as a contextmanager to close it. Files not on disk, and
+    platforms without posix_fadvise(), get FH back untouched.
+
+    Arguments:
+    - `fh`: file
+    - `access`: str
+
+    Return: file
+    Exceptions: ValueError
+    """
+    access = get_access(access)
+    if access is None or not hasattr(os, 'posix_fadvise'):
+        return fh
+    try:
+        fd = fh.fileno()
+    except (AttributeError, IOError, ValueError):
+        return fh # Not a file on disk
+    if access == 'random':
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+        return fh
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    if access == 'once':
+        return _DropBehind(fh, fd)
+    return fh
+
+def madvise(mapped, access=None):
+    """
+    Tell the kernel how we mean to read the mmap MAPPED, as advise() does
+    for files.
+
+    'once' maps to MADV_SEQUENTIAL, which already frees the pages behind
+    the reader. Drop the file's pages with dontneed_pages() once done.
+
+    Arguments:
+    - `mapped`: mmap.mmap
+    - `access`: str
+
+    Return: None
+    Exceptions: ValueError
+    """
+    access = get_access(access)
+    if access is None or not hasattr(mapped, 'madvise'):
+        return
+    mapped.madvise(mmap.MADV_RANDOM if access == 'random' else mmap.MADV_SEQUENTIAL)
+
+
+class _DropBehind(object):
+    """
+    Proxy for the open file FH that drops what has been read of it from
+    the page cache every DROP_BEHIND bytes, and everything from where we
+    started when closed.
+
+    Pages read a few bytes at a time can still be busy when we first ask
+    the kernel to drop them, so each drop covers the window before it
+    again.
+    """
+    def __init__(self, fh, fd):
+        self._fh = fh
+        self._fd = fd
+        # Text files' tell() is an opaque cookie - ask their buffer.
+        self._tell = getattr(fh, 'buffer', fh).tell
+        self._start = self._dropped = self._tell()
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _drop(self):
+        """
+        Drop what we have read since we last did, if that's DROP_BEHIND.
+
+        We go by FH's position rather than the descriptor's, which a
+        file over an FDCache descriptor never moves.
+        """
+        pos = self._tell()
+        if pos < self._dropped:
+            self._dropped = pos # Seeked backwards
+        elif pos - self._dropped >= DROP_BEHIND:
+            behind = max(self._start, self._dropped - DROP_BEHIND)
+            dontneed_pages(self._fd, behind, pos - behind)
+            self._dropped = pos
+
+    def read(self, *args):
+        data = self._fh.read(*args)
+        self._drop()
+        return data
+
+    def readline(self, *args):
+        line = self._fh.readline(*args)
+        self._drop()
+        return line
+
+    def readlines(self, *args):
+        lines = self._fh.readlines(*args)
+        self._drop()
+        return lines
+
+    def __iter__(self):
+        # Lines come a batch at a time, so we check what to drop per
+        # batch rather than per line.
+        for lines in iter(lambda: self.readlines(1 << 16), []):
+            for line in lines:
+                yield line
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    next = __next__
+
+    def close(self):
+        if not self._fh.closed:
+            dontneed_pages(self._fd, self._start)
+        self._fh.close()
@@ -3,23 +3,63 @@
 """
 from __future__ import with_statement
 
+import calendar
+import collections
 import contextlib
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+import datetime
 import errno
-import filecmp
+import fnmatch
 try:
     import grp
 except ImportError:
     grp = None
+import hashlib
+import multiprocessing.pool
+import numbers
 import os
 import platform
+import re
 try:
     import pwd as pwdb
 except ImportError:
     pwdb = None
 import shutil
+import stat as stat_module
 import sys
+import threading
+import time
+
+from ffs import exceptions, iosched, _inotify
+from ffs._py3k import ContextVar, scandir
 
-from ffs import exceptions
+# If truthy, cd() changes the logical working directory of the current
+# thread or asyncio task, rather than the process's. See cd().
+LOGICAL_CD = False
+
+_cwd = ContextVar('ffs_cwd', default=None)
+
+def resolve(path):
+    """
+    If we have a logical working directory and PATH is relative, return
+    PATH joined to it. Otherwise return PATH untouched.
+
+    Arguments:
+    - `path`: str or Path
+
+    Return: str or Path
+    Exceptions: None
+    """
+    cwd = _cwd.get()
+    if cwd is None:
+        return path
+    path = str(path)
+    if os.path.isabs(path) or path.startswith('~'):
+        return path
+    return os.path.join(cwd, path)
 
 class cd(object):
     """
@@ -30,21 +70,39 @@ class cd(object):
     location on exit. Yields a Path object representing the
     new current directory.
 
+    If LOGICAL is truthy (by default, if LOGICAL_CD is) we leave the
+    process's working directory alone, and change the logical one of
+    the current thread - or asyncio task - instead. getwd() returns it,
+    and the DiskFilesystem (so every Path) resolves relative paths
+    against it, so threads and tasks can each have their own without
+    a lock. Only code that goes through ffs sees it.
+
     Arguments:
     - `path`: str
+    - `logical`: bool
 
     Return: None or Path when contextmanager
     Exceptions: None
     """
-    def __init__(self, path):
+    def __init__(self, path, logical=None):
         """
         Change directories on initialization.
         This is a "Bad idea" but it allows us to be both
         function-like and contextmanager-like
         """
-        self.startdir = getwd()
+        self.logical = LOGICAL_CD if logical is None else logical
+        if self.logical:
+            self.startdir = _cwd.get()
+            self.path = os.path.abspath(resolve(os.path.expanduser(str(path))))
+            if not stat_module.S_ISDIR(os.stat(self.path).st_mode):
+                raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), self.path)
+            _cwd.set(self.path)
+            return
+        self.startdir = os.getcwd()
+        self.startlogical = _cwd.get()
         self.path = path
-        os.chdir(str(path)) # Coerce Path objects
+        os.chdir(str(resolve(path))) # Coerce Path objects
+        _cwd.set(None) # The real working directory is the one now
 
     def __enter__(self):
         """
@@ -59,7 +117,11 @@ class cd(object):
         """
         Contextmanager handling.return to the original directory
         """
-        os.chdir(self.startdir)
+        if self.logical:
+            _cwd.set(self.startdir)
+        else:
+            os.chdir(self.startdir)
+            _cwd.set(self.startlogical)
         return
 
 # !!! Allow symbolic permissions
@@ -132,7 +194,173 @@ def chown(path, user=None, group=None, uid=None, gid=None):
 
 # ::chown_R (FileUtils)
 
-cmp = filecmp.cmp
+CMP_BLOCKSIZE = 1 << 20
+_DIGEST_CACHE_SIZE = 4096
+_digests = {}
+
+CmpReport = collections.namedtuple('CmpReport', 'added removed changed')
+
+def _digest(path, st, algorithm, blocksize=CMP_BLOCKSIZE):
+    """
+    Return the ALGORITHM hexdigest of the file at PATH, whose stat
+    result is ST.
+
+    Digests are cached against the file's identity, size and mtime, so
+    comparing the same unchanged file again doesn't read it again.
+
+    Arguments:
+    - `path`: str
+    - `st`: stat_result
+    - `algorithm`: str
+    - `blocksize`: int
+
+    Return: str
+    Exceptions: None
+    """
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    key = (path, st.st_dev, st.st_ino, st.st_size, mtime, algorithm)
+    try:
+        return _digests[key]
+    except KeyError:
+        pass
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as fh:
+        for block in iosched.blocks(fh, blocksize):
+            hasher.update(block)
+    if len(_digests) >= _DIGEST_CACHE_SIZE:
+        _digests.clear()
+    digest = _digests[key] = hasher.hexdigest()
+    return digest
+
+def cmp(f1, f2, shallow=False, digest=None, blocksize=CMP_BLOCKSIZE):
+    """
+    Python translation of *nix cmp.
+
+    Return True if the files F1 and F2 have the same contents.
+
+    Files of different sizes differ without being read. Otherwise we
+    read both BLOCKSIZE bytes at a time, stopping at the first block
+    that differs.
+
+    If SHALLOW is truthy, files of the same size and mtime are assumed
+    to be the same, as filecmp.cmp() does by default.
+
+    If DIGEST names a hashlib algorithm, compare cached digests of the
+    files instead - worthwhile when the same files are compared over
+    and over.
+
+    Arguments:
+    - `f1`: str or Path
+    - `f2`: str or Path
+    - `shallow`: bool
+    - `digest`: str
+    - `blocksize`: int
+
+    Return: bool
+    Exceptions: DoesNotExistError
+    """
+    f1, f2 = str(f1), str(f2)
+    try:
+        st1, st2 = os.stat(f1), os.stat(f2)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        raise exceptions.DoesNotExistError(
+            "Can't compare {0} - it doesn't exist Larry... ".format(err.filename))
+    if (st1.st_dev, st1.st_ino) == (st2.st_dev, st2.st_ino):
+        return True
+    if st1.st_size != st2.st_size:
+        return False
+    if shallow and st1.st_mtime == st2.st_mtime:
+        return True
+    if digest:
+        return _digest(f1, st1, digest, blocksize) == _digest(f2, st2, digest, blocksize)
+    with open(f1, 'rb') as fh1:
+        with open(f2, 'rb') as fh2:
+            while True:
+                block = fh1.read(blocksize)
+                if block != fh2.read(blocksize):
+                    return False
+                if not block:
+                    return True
+
+def _cmp_dirs(args):
+    """
+    Worker: compare one pair of directories in a tree comparison.
+
+    Arguments:
+    - `args`: (left, right, relative path, cmp keyword args)
+
+    Return: (added, removed, changed, subdirectories to compare)
+    Exceptions: None
+    """
+    left, right, rel, kw = args
+    lnames = set(os.listdir(os.path.join(left, rel)))
+    rnames = set(os.listdir(os.path.join(right, rel)))
+    added = [os.path.join(rel, n) for n in rnames - lnames]
+    removed = [os.path.join(rel, n) for n in lnames - rnames]
+    changed, subdirs = [], []
+    for name in lnames & rnames:
+        path = os.path.join(rel, name)
+        lpath, rpath = os.path.join(left, path), os.path.join(right, path)
+        ldir, rdir = os.path.isdir(lpath), os.path.isdir(rpath)
+        if ldir and rdir:
+            subdirs.append(path)
+        elif ldir or rdir or not cmp(lpath, rpath, **kw):
+            changed.append(path)
+    return added, removed, changed, subdirs
+
+def cmp_tree(left, right, workers=8, shallow=False, digest=None, blocksize=CMP_BLOCKSIZE):
+    """
+    Compare the directory trees LEFT and RIGHT.
+
+    Return a CmpReport of sorted paths relative to the roots:
+    - `added`: only in RIGHT
+    - `removed`: only in LEFT
+    - `changed`: in both, but with different contents, or a file on
+      one side and a directory on the other.
+
+    A directory that exists on only one side is reported once, without
+    its contents.
+
+    Pairs of directories are compared concurrently on WORKERS threads.
+    Files are compared with cmp(), to which SHALLOW, DIGEST and
+    BLOCKSIZE are passed.
+
+    Arguments:
+    - `left`: str or Path
+    - `right`: str or Path
+    - `workers`: int
+    - `shallow`: bool
+    - `digest`: str
+    - `blocksize`: int
+
+    Return: CmpReport
+    Exceptions: DoesNotExistError
+    """
+    left, right = str(left), str(right)
+    for root in left, right:
+        if not os.path.isdir(root):
+            raise exceptions.DoesNotExistError(
+                "Can't compare {0} - it isn't a directory Larry... ".format(root))
+    kw = dict(shallow=shallow, digest=digest, blocksize=blocksize)
+    added, removed, changed = [], [], []
+    pool = multiprocessing.pool.ThreadPool(workers)
+    try:
+        level = ['']
+        while level:
+            subdirs = []
+            jobs = [(left, right, rel, kw) for rel in level]
+            for a, r, c, s in pool.imap_unordered(_cmp_dirs, jobs):
+                added.extend(a)
+                removed.extend(r)
+                changed.extend(c)
+                subdirs.extend(s)
+            level = subdirs
+    finally:
+        pool.close()
+        pool.join()
+    return CmpReport(sorted(added), sorted(removed), sorted(changed))
 
 def cp(resource, target, recursive=False):
     """
@@ -160,13 +388,330 @@ def cp(resource, target, recursive=False):
         if recursive:
             return cp_r(resource, target)
         return
+    scheduler = iosched.current()
+    if scheduler is not None:
+        return scheduler.copyfile(str(resource), str(target))
     shutil.copy2(str(resource), str(target))
     return
 
 def cp_r(src, dst, *args, **kwargs):
+    scheduler = iosched.current()
+    if scheduler is not None and not (args or kwargs):
+        return scheduler.copytree(str(src), str(dst))
     return shutil.copytree(str(src), str(dst), *args, **kwargs)
 
-getwd = os.getcwd
+DiskUsage = collections.namedtuple('DiskUsage', 'size disk files')
+
+def _du_tree(top, seen, lock):
+    """
+    Worker: total up the tree below the directory TOP, not counting
+    TOP itself.
+
+    SEEN is a set of (device, inode) pairs of the multiply linked files
+    counted so far, guarded by LOCK, and shared between workers.
+
+    Arguments:
+    - `top`: str
+    - `seen`: set
+    - `lock`: threading.Lock
+
+    Return: DiskUsage
+    Exceptions: None
+    """
+    size, disk, files = 0, 0, 0
+    stack = [top]
+    while stack:
+        try:
+            entries = list(scandir(stack.pop()))
+        except OSError:
+            continue # Unreadable, or vanished while we scanned.
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                if st.st_nlink > 1:
+                    with lock:
+                        if (st.st_dev, st.st_ino) in seen:
+                            continue
+                        seen.add((st.st_dev, st.st_ino))
+                files += 1
+            size += st.st_size
+            disk += getattr(st, 'st_blocks', 0) * 512
+    return DiskUsage(size, disk, files)
+
+def du(path, breakdown=False, workers=None):
+    """
+    Python translation of *nix du.
+
+    Return a DiskUsage for the tree at PATH: the sum of the apparent
+    sizes of everything in it (`size`), the bytes actually allocated
+    on disk for it (`disk`), and the number of non-directories
+    (`files`).
+
+    Each entry costs one stat, taken from scandir(). Files with several
+    hard links in the tree are counted once. Symlinks are not followed.
+
+    If BREAKDOWN is truthy, return a (DiskUsage, dict) pair, where the
+    dict maps each immediate subdirectory of PATH to its own DiskUsage.
+
+    If WORKERS is given, the immediate subdirectories of PATH are
+    scanned concurrently on that many threads.
+
+    Arguments:
+    - `path`: str or Path
+    - `breakdown`: bool
+    - `workers`: int
+
+    Return: DiskUsage or (DiskUsage, dict)
+    Exceptions: DoesNotExistError
+    """
+    path = str(path)
+    try:
+        st = os.lstat(path)
+    except OSError:
+        raise exceptions.DoesNotExistError(
+            "Can't du {0} - it doesn't exist Larry... ".format(path))
+    blocks = getattr(st, 'st_blocks', 0) * 512
+    if not stat_module.S_ISDIR(st.st_mode):
+        total = DiskUsage(st.st_size, blocks, 1)
+        return (total, {}) if breakdown else total
+
+    size, disk, files = st.st_size, blocks, 0
+    seen, lock = set(), threading.Lock()
+    subdirs = []
+    for entry in scandir(path):
+        try:
+            est = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append((entry.path, est))
+            continue
+        if est.st_nlink > 1:
+            if (est.st_dev, est.st_ino) in seen:
+                continue
+            seen.add((est.st_dev, est.st_ino))
+        size += est.st_size
+        disk += getattr(est, 'st_blocks', 0) * 512
+        files += 1
+
+    scan = lambda subdir: _du_tree(subdir[0], seen, lock)
+    if workers and len(subdirs) > 1:
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            usages = pool.map(scan, subdirs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        usages = [scan(subdir) for subdir in subdirs]
+
+    byname = {}
+    for (subdir, est), usage in zip(subdirs, usages):
+        usage = DiskUsage(usage.size + est.st_size,
+                          usage.disk + getattr(est, 'st_blocks', 0) * 512,
+                          usage.files)
+        byname[subdir] = usage
+        size, disk, files = size + usage.size, disk + usage.disk, files + usage.files
+    total = DiskUsage(size, disk, files)
+    if breakdown:
+        return total, byname
+    return total
+
+def _mtime_ns(when):
+    """
+    Convert WHEN to an mtime in integer nanoseconds since the epoch.
+
+    WHEN may be a timestamp, a datetime (naive ones are taken to be
+    UTC, as ffs.ts2dt() produces) or the path of a file whose mtime we
+    should use.
+
+    Arguments:
+    - `when`: int, float, datetime, str or Path
+
+    Return: int
+    Exceptions: DoesNotExistError
+    """
+    if isinstance(when, datetime.datetime):
+        seconds = calendar.timegm(when.utctimetuple())
+        return seconds * 10**9 + when.microsecond * 1000
+    if isinstance(when, numbers.Real):
+        return int(round(when * 10**9))
+    try:
+        return _st_mtime_ns(os.stat(str(when)))
+    except OSError:
+        raise exceptions.DoesNotExistError(
+            "Can't compare mtimes with {0} - it doesn't exist Larry... ".format(when))
+
+def _st_mtime_ns(st):
+    """
+    Return the mtime of the stat result ST in integer nanoseconds.
+
+    Arguments:
+    - `st`: stat_result
+
+    Return: int
+    Exceptions: None
+    """
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        return int(round(st.st_mtime * 10**9))
+
+_TYPES = {
+    'f': lambda entry: entry.is_file(follow_symlinks=False),
+    'd': lambda entry: entry.is_dir(follow_symlinks=False),
+    'l': lambda entry: entry.is_symlink(),
+    }
+
+def _find_predicate(name=None, type=None, newer=None, older=None,
+                    size_gt=None, size_lt=None, user=None, group=None):
+    """
+    Compile the find() criteria into a single predicate on DirEntry
+    objects.
+
+    Checks that only need the entry's name or type come first, so we
+    only stat entries that get past them, and at most once.
+
+    Return: callable or None if there are no criteria
+    Exceptions: ValueError
+    """
+    cheap, costly = [], []
+    if name is not None:
+        cheap.append(lambda entry, match=re.compile(fnmatch.translate(name)).match: match(entry.name))
+    if type is not None:
+        if type not in _TYPES:
+            raise ValueError("Type must be one of f, d or l, not {0} Larry... ".format(type))
+        cheap.append(_TYPES[type])
+    if newer is not None:
+        newer = _mtime_ns(newer)
+        costly.append(lambda st: _st_mtime_ns(st) > newer)
+    if older is not None:
+        older = _mtime_ns(older)
+        costly.append(lambda st: _st_mtime_ns(st) < older)
+    if size_gt is not None:
+        costly.append(lambda st: st.st_size > size_gt)
+    if size_lt is not None:
+        costly.append(lambda st: st.st_size < size_lt)
+    if user is not None:
+        uid = user if isinstance(user, numbers.Integral) else pwdb.getpwnam(user)[2]
+        costly.append(lambda st: st.st_uid == uid)
+    if group is not None:
+        gid = group if isinstance(group, numbers.Integral) else grp.getgrnam(group)[2]
+        costly.append(lambda st: st.st_gid == gid)
+
+    if not cheap and not costly:
+        return None
+
+    def predicate(entry):
+        for check in cheap:
+            if not check(entry):
+                return False
+        if costly:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                return False
+            for check in costly:
+                if not check(st):
+                    return False
+        return True
+    return predicate
+
+def find(root, name=None, type=None, newer=None, older=None, size_gt=None,
+         size_lt=None, user=None, group=None, maxdepth=None):
+    """
+    Python translation of *nix find.
+
+    Lazily yield the paths below ROOT that meet all of the criteria
+    given:
+
+    - `name`: the basename matches this shell glob
+    - `type`: 'f' for files, 'd' for directories, 'l' for symlinks
+    - `newer`: modified after this (see below)
+    - `older`: modified before this (see below)
+    - `size_gt`: larger than this many bytes
+    - `size_lt`: smaller than this many bytes
+    - `user`: owned by this username or uid
+    - `group`: owned by this group name or gid
+
+    NEWER and OLDER may be timestamps, datetimes (naive ones are UTC)
+    or the path of a file to compare mtimes with, like find -newer.
+
+    Don't descend more than MAXDEPTH levels - the entries directly in
+    ROOT are level 1. Symlinks to directories are not followed.
+
+    >>> list(find('/var/log', name='*.gz', older=datetime.datetime(2014, 1, 1)))
+
+    Types come from the directory listing, so criteria on names and
+    types alone don't stat anything.
+
+    Arguments:
+    - `root`: str or Path
+    - `name`: str
+    - `type`: str
+    - `newer`: int, float, datetime, str or Path
+    - `older`: int, float, datetime, str or Path
+    - `size_gt`: int
+    - `size_lt`: int
+    - `user`: str or int
+    - `group`: str or int
+    - `maxdepth`: int
+
+    Return: generator(str)
+    Exceptions: DoesNotExistError, ValueError
+    """
+    root = str(root)
+    if not os.path.isdir(root):
+        raise exceptions.DoesNotExistError(
+            "Can't find() in {0} - it isn't a directory Larry... ".format(root))
+    predicate = _find_predicate(name=name, type=type, newer=newer, older=older,
+                                size_gt=size_gt, size_lt=size_lt,
+                                user=user, group=group)
+    return _find(root, predicate, maxdepth)
+
+def _find(root, predicate, maxdepth):
+    """
+    Generator body of find(), so that find() can raise as soon as it
+    is called.
+    """
+    stack = [(_sorted_entries(root), 1)]
+    while stack:
+        entries, depth = stack[-1]
+        for entry in entries:
+            if predicate is None or predicate(entry):
+                yield entry.path
+            if (maxdepth is None or depth < maxdepth) and entry.is_dir(follow_symlinks=False):
+                stack.append((_sorted_entries(entry.path), depth + 1))
+                break
+        else:
+            stack.pop()
+
+def _sorted_entries(top):
+    """
+    Return an iterator over the DirEntry objects in TOP, by name.
+    Unreadable directories are empty.
+    """
+    try:
+        return iter(sorted(scandir(top), key=lambda entry: entry.name))
+    except OSError:
+        return iter([])
+
+def getwd():
+    """
+    Return the current working directory - the logical one of the
+    current thread or asyncio task if cd() has set one, otherwise the
+    process's.
+
+    Return: str
+    Exceptions: None
+    """
+    cwd = _cwd.get()
+    return os.getcwd() if cwd is None else cwd
 
 def head(filename, lines=10):
     """
@@ -367,7 +912,8 @@ def rm(*targets, **kw):
     Return: None
     Exceptions: DoesNotExistError
     """
-    fn = os.remove
+    scheduler = iosched.current()
+    fn = os.remove if scheduler is None else scheduler.remove
     if 'recursive'in kw and kw['recursive']:
         fn = rm_r
     if 'force' in kw and kw['force']:
@@ -390,6 +936,9 @@ def rm(*targets, **kw):
 
 # !!! Wrap to accept Path
 def rm_r(path, *args, **kwargs):
+    scheduler = iosched.current()
+    if scheduler is not None and not (args or kwargs):
+        return scheduler.rmtree(str(path))
     return shutil.rmtree(str(path), *args, **kwargs)
 
 # ::rm_rf (FileUtils)
@@ -400,6 +949,153 @@ rmdir = os.rmdir
 # !!! Wrap to accept Path
 stat = os.stat
 
+def _decode(data):
+    """
+    Return DATA as a native str, decoding bytes as UTF-8 on Py3k.
+
+    Arguments:
+    - `data`: bytes
+
+    Return: str
+    Exceptions: None
+    """
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8', 'replace')
+
+def _lastlines(fh, lines, blocksize=8192):
+    """
+    Return the bytes making up the last LINES lines of the binary file
+    handle FH, reading backwards from the end in BLOCKSIZE steps rather
+    than scanning the whole file.
+
+    FH is left positioned at the end of the file.
+
+    Arguments:
+    - `fh`: file opened in binary mode
+    - `lines`: int
+    - `blocksize`: int
+
+    Return: bytes
+    Exceptions: None
+    """
+    fh.seek(0, os.SEEK_END)
+    end = pos = fh.tell()
+    if lines <= 0:
+        return b''
+    data = b''
+    while pos > 0 and data.count(b'\n') <= lines:
+        step = min(blocksize, pos)
+        pos -= step
+        fh.seek(pos)
+        data = fh.read(step) + data
+    fh.seek(end)
+    complete = data.split(b'\n')
+    partial = complete.pop()
+    found = [line + b'\n' for line in complete]
+    if partial:
+        found.append(partial)
+    return b''.join(found[-lines:])
+
+def tail(filename, lines=10, follow=False, interval=0.01, max_interval=1.0,
+         chunksize=1 << 20):
+    """
+    Python port of the *nix tail command.
+
+    Return the last LINES lines of the file at FILENAME
+    Defaults to 10 lines.
+
+    If FOLLOW is truthy, behave like tail -F instead: return a generator
+    that yields lists of new lines as they are written, starting with
+    the last LINES lines. Lines are batched so that a burst of writes
+    costs one yield rather than one per line.
+
+    While following we sleep on inotify where the platform has it,
+    otherwise we poll, backing off from INTERVAL to MAX_INTERVAL seconds
+    while the file is idle. If the file is truncated we start again from
+    the top, and if it is replaced (e.g. by log rotation) we finish
+    reading the old file, then transparently reopen the new one.
+
+    Arguments:
+    - `filename`: str or Path
+    - `lines`: int
+    - `follow`: bool
+    - `interval`: float
+    - `max_interval`: float
+    - `chunksize`: int
+
+    Return: str or generator(list[str])
+    Exceptions: DoesNotExistError
+    """
+    if not os.path.isfile(str(filename)):
+        raise exceptions.DoesNotExistError(
+            "Can't tail {0} - it doesn't exist Larry... ".format(filename))
+    if follow:
+        return _follow(str(filename), lines, interval, max_interval, chunksize)
+    with open(str(filename), 'rb') as fh:
+        return _decode(_lastlines(fh, lines))
+
+def _follow(filename, lines, interval, max_interval, chunksize):
+    """
+    Generator implementation of tail(FILENAME, follow=True)
+
+    Arguments:
+    - `filename`: str
+    - `lines`: int
+    - `interval`: float
+    - `max_interval`: float
+    - `chunksize`: int
+
+    Return: generator(list[str])
+    Exceptions: None
+    """
+    try:
+        watcher = _inotify.Watcher(filename)
+    except (exceptions.NotSupportedError, OSError):
+        watcher = None
+    fh = open(filename, 'rb')
+    try:
+        data = _lastlines(fh, lines)
+        partial = b''
+        delay = interval
+        while True:
+            if data:
+                delay = interval
+                batch = (partial + data).split(b'\n')
+                partial = batch.pop()
+                if batch:
+                    yield [_decode(line + b'\n') for line in batch]
+                data = fh.read(chunksize)
+                continue
+
+            ours = os.fstat(fh.fileno())
+            try:
+                current = os.stat(filename)
+            except OSError:
+                current = None
+            if current is not None and (current.st_ino, current.st_dev) != (
+                    ours.st_ino, ours.st_dev):
+                # Rotated. We've already drained the old file, so move on.
+                if partial:
+                    yield [_decode(partial)]
+                    partial = b''
+                fh.close()
+                fh = open(filename, 'rb')
+            elif ours.st_size < fh.tell():
+                # Truncated in place.
+                partial = b''
+                fh.seek(0)
+            elif watcher is not None:
+                watcher.wait(max_interval)
+            else:
+                time.sleep(delay)
+                delay = min(delay * 2, max_interval)
+            data = fh.read(chunksize)
+    finally:
+        fh.close()
+        if watcher is not None:
+            watcher.close()
+
 def touch(fname):
     """
     Python port of the Unix touch command
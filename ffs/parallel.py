@@ -0,0 +1,408 @@
+"""
+ffs.parallel
+
+Helpers for spreading work over large files across several cores.
+"""
+from __future__ import with_statement
+
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import os
+import re
+
+import six
+
+from ffs import exceptions
+
+# How much shards() reads at a time looking for the end of a line.
+SCAN_CHUNK = 1 << 16
+
+class Shard(collections.namedtuple('Shard', 'path start end')):
+    """
+    A newline-aligned byte range [START, END) of the file at PATH.
+
+    Shards are plain tuples of a path and two offsets, so they are cheap
+    to send to other processes, which then open the file themselves.
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        """
+        The length of this shard in bytes
+        """
+        return self.end - self.start
+
+    def read(self):
+        """
+        Return the bytes of this shard.
+
+        Return: bytes
+        Exceptions: None
+        """
+        with open(self.path, 'rb') as fh:
+            fh.seek(self.start)
+            return fh.read(self.end - self.start)
+
+    def lines(self, encoding='utf-8'):
+        """
+        Iterate through the lines of this shard.
+
+        Lines are decoded with ENCODING, or returned as bytes if ENCODING
+        is None.
+
+        Arguments:
+        - `encoding`: str or None
+
+        Return: generator(str)
+        Exceptions: None
+        """
+        with open(self.path, 'rb') as fh:
+            fh.seek(self.start)
+            remaining = self.end - self.start
+            for line in fh:
+                if remaining <= 0:
+                    return
+                remaining -= len(line)
+                if encoding is not None:
+                    line = line.decode(encoding)
+                yield line
+
+
+def _line_end(fh, offset, total):
+    """
+    Return the offset just past the first newline at or after OFFSET in
+    FH, or TOTAL if there isn't one - reading SCAN_CHUNK bytes at a time,
+    so that a huge line doesn't have to fit in memory.
+
+    Arguments:
+    - `fh`: file
+    - `offset`: int
+    - `total`: int
+
+    Return: int
+    Exceptions: None
+    """
+    fh.seek(offset)
+    while True:
+        chunk = fh.read(SCAN_CHUNK)
+        if not chunk:
+            return total
+        found = chunk.find(b'\n')
+        if found != -1:
+            return offset + found + 1
+        offset += len(chunk)
+
+def shards(path, n=None, size=None):
+    """
+    Split the file at PATH into byte ranges that start and end on line
+    boundaries.
+
+    Pass either N, the number of shards wanted, or SIZE, the
+    approximate size of each shard in bytes. With neither we make one
+    shard per CPU. Shards may be fewer than N, if lines are long
+    relative to the file.
+
+    Each boundary costs one seek and a scan to the next newline, rather
+    than a pass over the file.
+
+    Arguments:
+    - `path`: str or Path
+    - `n`: int
+    - `size`: int
+
+    Return: list[Shard]
+    Exceptions: ValueError, DoesNotExistError
+    """
+    path = str(path)
+    if n is not None and size is not None:
+        raise ValueError("Pass either n or size, not both Larry... ")
+    if not os.path.isfile(path):
+        raise exceptions.DoesNotExistError(
+            "Can't shard {0} - it isn't a file Larry... ".format(path))
+    total = os.path.getsize(path)
+    if size is None:
+        n = n or multiprocessing.cpu_count()
+        size = -(-total // n) or 1
+    if size < 1:
+        raise ValueError("Shards have to be at least one byte Larry... ")
+
+    boundaries = [0]
+    with open(path, 'rb') as fh:
+        guess = size
+        while guess < total:
+            if guess > boundaries[-1]:
+                boundary = _line_end(fh, guess - 1, total)
+                if boundary >= total:
+                    break
+                boundaries.append(boundary)
+            guess = max(guess + size, boundaries[-1] + 1)
+    boundaries.append(total)
+    return [Shard(path, start, end) for start, end in zip(boundaries, boundaries[1:])]
+
+
+def _pool(workers, mode):
+    """
+    Return a worker pool of WORKERS threads or processes.
+
+    Arguments:
+    - `workers`: int
+    - `mode`: str
+
+    Return: multiprocessing.pool.Pool
+    Exceptions: ValueError
+    """
+    if mode == 'process':
+        return multiprocessing.Pool(workers)
+    if mode == 'thread':
+        return multiprocessing.pool.ThreadPool(workers)
+    raise ValueError("Mode must be 'process' or 'thread', not {0} Larry... ".format(mode))
+
+
+def _apply_to_lines(args):
+    "Worker: call FUNC on the lines of SHARD, decoded with ENCODING"
+    func, shard, encoding = args
+    return func(shard.lines(encoding=encoding))
+
+
+def pmap(path, func, workers=None, mode='process', n=None, size=None, encoding='utf-8'):
+    """
+    Call FUNC on an iterator over the lines of each shard of the file at
+    PATH, spread over WORKERS processes or threads. Return the results
+    in file order.
+
+    Shards are as for shards(), defaulting to one per worker. Lines are
+    decoded with ENCODING, or passed as bytes if ENCODING is None. In
+    'process' mode FUNC must be picklable, i.e. defined at module level.
+
+    >>> def count(lines):
+    ...     return sum(1 for line in lines)
+    >>> sum(pmap('huge.csv', count))
+
+    Arguments:
+    - `path`: str or Path
+    - `func`: callable
+    - `workers`: int
+    - `mode`: str
+    - `n`: int
+    - `size`: int
+    - `encoding`: str or None
+
+    Return: list
+    Exceptions: ValueError, DoesNotExistError
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if n is None and size is None:
+        n = workers
+    pieces = shards(path, n=n, size=size)
+    pool = _pool(workers, mode)
+    try:
+        return pool.map(_apply_to_lines, [(func, shard, encoding) for shard in pieces])
+    finally:
+        pool.close()
+        pool.join()
+
+
+# One-byte strings, so that membership tests of pattern[i:i + 1] work
+# alike on py2 and py3.
+_METACHARS = frozenset([b'.', b'^', b'$', b'*', b'+', b'?', b'{', b'}',
+                        b'[', b']', b'\\', b'|', b'(', b')'])
+_QUANTIFIERS = frozenset([b'*', b'?', b'{'])
+
+def _literal_prefix(pattern, flags=0):
+    """
+    Return the run of literal bytes that every match of PATTERN must
+    start with, or b'' if we can't be sure of one.
+
+    This is deliberately conservative - it only looks at the plain
+    characters at the start of the pattern.
+
+    Arguments:
+    - `pattern`: bytes
+    - `flags`: int
+
+    Return: bytes
+    Exceptions: None
+    """
+    if flags & (re.IGNORECASE | re.VERBOSE) or b'|' in pattern or pattern.startswith(b'(?'):
+        return b''
+    literal = bytearray()
+    i = 0
+    while i < len(pattern):
+        char = pattern[i:i + 1]
+        if char == b'\\':
+            escaped = pattern[i + 1:i + 2]
+            if not escaped or escaped.isalnum():
+                break
+            char, step = escaped, 2
+        elif char in _METACHARS:
+            break
+        else:
+            step = 1
+        following = pattern[i + step:i + step + 1]
+        if following in _QUANTIFIERS:
+            break
+        if following == b'+':
+            literal += char
+            break
+        literal += char
+        i += step
+    return bytes(literal)
+
+
+def _grep_file(args):
+    """
+    Worker: find the lines of one file that match a pattern.
+
+    Rather than calling the regex once per line, we run it over large
+    chunks of the file, and only pull out the lines where it matched.
+    If the pattern starts with a literal, we skip straight to the
+    occurrences of that literal with bytes.find() before involving
+    the regex at all.
+
+    Arguments:
+    - `args`: (path, pattern, flags, literal, chunksize)
+
+    Return: list[(str, int, bytes)]
+    Exceptions: None
+    """
+    path, pattern, flags, literal, chunksize = args
+    # MULTILINE so that ^ and $ mean the same over a chunk as over a line.
+    regex = re.compile(pattern, flags | re.MULTILINE)
+    found = []
+    lineno = 0
+    # The pieces of an incomplete line, joined only once it ends - a
+    # long stretch without newlines shouldn't be copied on every read.
+    pending = []
+    try:
+        fh = open(path, 'rb')
+    except (IOError, OSError):
+        return found
+    with fh:
+        while True:
+            data = fh.read(chunksize)
+            if data:
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    pending.append(data)
+                    continue
+                pending.append(data[:cut])
+                chunk = b''.join(pending)
+                pending = [data[cut:]]
+            else:
+                chunk = b''.join(pending)
+                pending = []
+                if not chunk:
+                    break
+
+            counted, pos = 0, 0
+            while True:
+                if literal:
+                    start = chunk.find(literal, pos)
+                else:
+                    match = regex.search(chunk, pos)
+                    start = match.start() if match else -1
+                if start < 0:
+                    break
+                linestart = chunk.rfind(b'\n', 0, start) + 1
+                lineend = chunk.find(b'\n', start)
+                if lineend < 0:
+                    lineend = len(chunk)
+                line = chunk[linestart:lineend]
+                if regex.search(line):
+                    lineno += chunk.count(b'\n', counted, linestart)
+                    counted = linestart
+                    found.append((path, lineno + 1, line))
+                pos = lineend + 1
+            lineno += chunk.count(b'\n', counted)
+            if not data:
+                break
+    return found
+
+
+def _files(root, recursive):
+    """
+    Yield the files at or below ROOT.
+
+    Arguments:
+    - `root`: str
+    - `recursive`: bool
+
+    Return: generator(str)
+    Exceptions: None
+    """
+    if not os.path.isdir(root):
+        yield root
+        return
+    if not recursive:
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                yield path
+        return
+    for base, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(base, name)
+
+
+def grep(root, pattern, recursive=True, workers=None, mode='process', flags=0,
+         chunksize=1 << 22):
+    """
+    Search the file ROOT, or the files below the directory ROOT, for
+    lines matching the regular expression PATTERN. Yield a
+    (path, line number, line) tuple for each, file by file, as they
+    are found. Line numbers start at 1, lines lose their newline.
+
+    Files are searched CHUNKSIZE bytes at a time by WORKERS processes
+    (or threads if MODE is 'thread'). If RECURSIVE is falsy, only the
+    files directly inside ROOT are searched. With only one file to
+    search, we search it here rather than starting any workers.
+
+    If PATTERN is bytes, lines are yielded as bytes, otherwise they are
+    decoded as UTF-8.
+
+    Arguments:
+    - `root`: str or Path
+    - `pattern`: str or bytes
+    - `recursive`: bool
+    - `workers`: int
+    - `mode`: str
+    - `flags`: int
+    - `chunksize`: int
+
+    Return: generator((str, int, str))
+    Exceptions: ValueError, DoesNotExistError
+    """
+    root = str(root)
+    if not os.path.exists(root):
+        raise exceptions.DoesNotExistError(
+            "Can't grep {0} - it doesn't exist Larry... ".format(root))
+    decode = not isinstance(pattern, bytes)
+    if decode:
+        pattern = pattern.encode('utf-8')
+    literal = _literal_prefix(pattern, flags)
+    jobs = ((path, pattern, flags, literal, chunksize)
+            for path in _files(root, recursive))
+    # Work is split by file, so one file - say ROOT itself - only ever
+    # keeps one worker busy, and isn't worth starting a pool for.
+    first = list(itertools.islice(jobs, 2))
+    jobs = itertools.chain(first, jobs)
+
+    if workers == 1 or len(first) < 2:
+        results, pool = six.moves.map(_grep_file, jobs), None
+    else:
+        pool = _pool(workers or multiprocessing.cpu_count(), mode)
+        results = pool.imap(_grep_file, jobs)
+    try:
+        for found in results:
+            for path, lineno, line in found:
+                if decode:
+                    line = line.decode('utf-8', 'replace')
+                yield path, lineno, line
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -13,6 +13,7 @@ try:
 except ImportError:
     import json
 import mimetypes
+import mmap
 import os
 import re
 import tempfile
@@ -20,9 +21,18 @@ import traceback
 import types
 
 import six
+from six.moves import cPickle as pickle
 
-from ffs import (exceptions, filesystem, formats, nix, is_dir, is_file, size,
-                 _path_blacklists)
+from ffs import (exceptions, filesystem, formats, iosched, nix, is_dir, is_file,
+                 basen_many,
+                 parallel, writers, _path_blacklists)
+from ffs._py3k import ContextVar
+
+# Path.appender() sessions open in this thread or context, keyed by
+# filesystem flavour and absolute path (under any logical working
+# directory), so that << can find them. We never mutate the dict in
+# place - each session sets a copy - so contexts never share one.
+_appenders = ContextVar('ffs_appenders', default={})
 
 def _stringcoll(coll):
     """
@@ -54,6 +64,29 @@ class Pset(set):
         """
         return Pset(p[-1] for p in self)
 
+    def basen(self, num=1):
+        """
+        Return the last NUM components of each path in our collection
+
+        Arguments:
+        - `num`: int
+
+        Return: Pset
+        Exceptions: None
+        """
+        return Pset(six.moves.map(Path, set(basen_many(self, num))))
+
+    @property
+    def parents(self):
+        """
+        Return the distinct parent directories of our path collection
+
+        Return: Pset
+        Exceptions: None
+        """
+        dirname = os.path.dirname
+        return Pset(six.moves.map(Path, set(dirname(str(p)) for p in self)))
+
 
 # !!! Normalization to clean up ../, . && //
 
@@ -418,10 +451,6 @@ class BasePath(str):
         msg = "Cannot access {0}: No such file or directory".format(self)
         raise exceptions.DoesNotExistError(msg)
 
-    # !!! json_dump()
-    # !!! pickle_load()
-    # !!! pickle_dump()
-
 class LeafBranchPath(BasePath):
 
     @property
@@ -445,10 +474,17 @@ class LeafBranchPath(BasePath):
         return self.fs.is_leaf(self._value)
 
     @contextlib.contextmanager
-    def open(self, mode):
+    def open(self, mode, access=None, expected_size=None):
         """
         Contextmanager to open SELF in the mode specified.
 
+        ACCESS hints at how we'll read the file: 'sequential', 'random'
+        or 'once'. See ffs.iosched.advise().
+
+        When writing a file from scratch, EXPECTED_SIZE hints at how big
+        it will be: we preallocate that much disk for it, and truncate
+        it to what we actually wrote when the block exits.
+
         If SELF is a directory, raise TypeError
 
         Note::
@@ -459,18 +495,89 @@ class LeafBranchPath(BasePath):
 
         Arguments:
         - `mode`: str
+        - `access`: str
+        - `expected_size`: int
 
         Return: file
-        Exceptions: TypeError
+        Exceptions: TypeError, ValueError
         """
         if self.is_dir:
             raise TypeError("Opening a directory doesn't really mean anything Larry... ")
+        if expected_size is not None and mode not in ('w', 'wb'):
+            raise ValueError("Can only expect a size when writing from scratch - mode w or wb Larry... ")
         if not self.fs.is_branch(self.parent): # we only have to check one level
             self.fs.mkdir((self[:-1]), parents=True)
         with self.fs.open(self._value, mode) as fh:
-            yield fh
+            with iosched.advise(fh, access) as fh:
+                with writers.sized(fh, expected_size) as fh:
+                    yield fh
+
+    @contextlib.contextmanager
+    def atomic_open(self, mode='w', fsync=False, expected_size=None):
+        """
+        Contextmanager to replace the contents of SELF in one step.
+
+        Writes go to a temporary file which is renamed over SELF when the
+        block exits cleanly, so readers never see a partially written
+        file. If the block raises, SELF is left untouched.
+
+        If FSYNC is truthy, the new contents are flushed to disk before
+        we return. See ffs.writers.fsync_batch() to amortize that cost
+        across many files.
+
+        EXPECTED_SIZE hints at how big the new contents will be, as for
+        open().
+
+        If SELF is a directory, raise TypeError
+
+        Note::
+
+            If components of the path leading to SELF do not exist,
+            they will be created. It is assumed that the user knows their
+            own mind.
+
+        Arguments:
+        - `mode`: str
+        - `fsync`: bool
+        - `expected_size`: int
+
+        Return: file
+        Exceptions: TypeError
+        """
+        if self.is_dir:
+            raise TypeError("Writing to a directory doesn't really mean anything Larry... ")
+        if not self.fs.is_branch(self.parent): # we only have to check one level
+            self.fs.mkdir((self[:-1]), parents=True)
+        with self.fs.atomic_open(self._value, mode, fsync=fsync) as fh:
+            with writers.sized(fh, expected_size) as fh:
+                yield fh
+
+    def write(self, contents, fsync=False):
+        """
+        Atomically replace the contents of SELF with CONTENTS.
+
+        Allows us to duck-type as a file.
+
+        If CONTENTS is not a stringtype or bytes, raise TypeError.
+        If SELF is a directory, raise TypeError.
+
+        Arguments:
+        - `contents`: stringtype or bytes
+        - `fsync`: bool
 
-    def read(self):
+        Return: None
+        Exceptions: TypeError
+        """
+        if isinstance(contents, six.string_types):
+            mode = 'w'
+        elif isinstance(contents, six.binary_type):
+            mode = 'wb'
+        else:
+            raise TypeError("you have to write with a stringtype Larry... ")
+        with self.atomic_open(mode, fsync=fsync) as fh:
+            fh.write(contents)
+
+    def read(self, access=None):
         """
         Read the contents of the file SELF.
 
@@ -478,14 +585,67 @@ class LeafBranchPath(BasePath):
 
         If SELF is a directory, raise TypeError.
 
+        Arguments:
+        - `access`: str - see open()
+
         Return: str
         Exceptions: TypeError
         """
         if self.is_dir:
             raise TypeError("Reading a directory doesn't make any sense Larry... ")
-        with self.open('r') as fh:
+        with self.open('r', access=access) as fh:
             return fh.read()
 
+    def lines(self, mode='r', access=None):
+        """
+        Generate the lines of the file SELF, as iterating over it does.
+
+        Arguments:
+        - `mode`: str
+        - `access`: str - see open()
+
+        Return: generator(str)
+        Exceptions: TypeError, ValueError
+        """
+        with self.open(mode, access=access) as fh:
+            for line in fh:
+                yield line
+
+    @contextlib.contextmanager
+    def mmap(self, access=None):
+        """
+        Contextmanager to map the file SELF into memory, read-only.
+
+        ACCESS hints at how we'll read the map, as for open(). With
+        'once', the file's pages are dropped from the page cache when
+        we're done.
+
+        Empty files can't be mapped, so for those we yield b'' instead.
+
+        If SELF is not a file, raise TypeError
+
+        Arguments:
+        - `access`: str
+
+        Return: mmap.mmap or bytes
+        Exceptions: TypeError, ValueError
+        """
+        if not self.is_file:
+            raise TypeError("Can only map a file Larry... ")
+        access = iosched.get_access(access)
+        with self.fs.open(self._value, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                yield b''
+                return
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                iosched.madvise(mapped, access)
+                yield mapped
+            finally:
+                mapped.close()
+                if access == 'once':
+                    iosched.dontneed_pages(fh.fileno())
+
     def readline(self):
         """
         Duck-typing like a file.
@@ -508,14 +668,18 @@ class LeafBranchPath(BasePath):
         except StopIteration:
             return ""
 
-    def truncate(self):
+    def truncate(self, size=0):
         """
         Duck-typing like a file
 
-        Truncate the file's size.
+        Truncate the file to SIZE bytes - or on disk, extend it with
+        zeros to SIZE bytes.
 
         If SELF is a directory or does not exist, raise TypeError
 
+        Arguments:
+        - `size`: int
+
         Return: None
         Exceptions: TypeError
         """
@@ -523,10 +687,30 @@ class LeafBranchPath(BasePath):
             raise TypeError("Can't truncate something that doesn't exist Larry... ")
         if self.is_dir:
             raise TypeError("Can't truncate a directory Larry... ")
-        with self.open('w') as fh:
-            fh.truncate()
+        with self.open('r+b') as fh:
+            fh.truncate(size)
         return
 
+    def preallocate(self, size):
+        """
+        Reserve SIZE bytes of disk for the file SELF, creating it if
+        needs be, so that writing it later doesn't fragment it. SELF
+        grows to at least SIZE bytes of zeros - truncate() it to what
+        you write, or see the EXPECTED_SIZE argument to open().
+
+        If SELF is a directory, raise TypeError
+
+        Arguments:
+        - `size`: int
+
+        Return: bool - whether the filesystem could
+        Exceptions: TypeError, OSError
+        """
+        if self.is_dir:
+            raise TypeError("Can't preallocate a directory Larry... ")
+        with self.open('ab') as fh:
+            return writers.preallocate(fh, size)
+
     @property
     def contents(self):
         """
@@ -570,7 +754,122 @@ class LeafBranchPath(BasePath):
         if self.is_dir:
             raise TypeError("Can't treat a directory as JSON Larry... ")
         return json.loads(self.contents)
-    
+
+    def iter_jsonl(self, batch_size=1000):
+        """
+        Treat SELF as a JSON Lines file, lazily yielding one deserialized
+        record per line.
+
+        Records are decoded BATCH_SIZE lines at a time, so only one batch
+        is ever held in memory.
+
+        If SELF is a directory or does not exist, raise TypeError
+
+        Arguments:
+        - `batch_size`: int
+
+        Return: generator(object)
+        Exceptions: TypeError
+        """
+        if not self:
+            raise TypeError("Can't load something that doesn't exist Larry... ")
+        if self.is_dir:
+            raise TypeError("Can't treat a directory as JSON Lines Larry... ")
+
+        def jsonlgen():
+            "JSON Lines generator"
+            with self.fs.open(self._value) as fh:
+                for record in formats.iter_jsonl(fh, batch_size=batch_size):
+                    yield record
+        return jsonlgen()
+
+    def json_items(self, prefix='item'):
+        """
+        Treat SELF as a file containing a JSON array, and yield its elements
+        one at a time without loading the whole document.
+
+        PREFIX names the array, as for formats.json_items() - the default
+        'item' streams a top-level array, 'results.item' the array at
+        the top level key 'results'.
+
+        If SELF is a directory or does not exist, raise TypeError
+
+        Arguments:
+        - `prefix`: str
+
+        Return: generator(object)
+        Exceptions: TypeError
+        """
+        if not self:
+            raise TypeError("Can't load something that doesn't exist Larry... ")
+        if self.is_dir:
+            raise TypeError("Can't treat a directory as JSON Larry... ")
+
+        def itemgen():
+            "JSON array generator"
+            with self.fs.open(self._value) as fh:
+                for item in formats.json_items(fh, prefix=prefix):
+                    yield item
+        return itemgen()
+
+    def json_dump(self, obj, fsync=False, **kw):
+        """
+        Serialize OBJ as JSON, atomically replacing the contents of SELF.
+
+        Output is buffered into large writes, and lists or generators are
+        streamed an element at a time, so OBJ need never exist as one
+        giant string. Keyword arguments are passed to json.JSONEncoder.
+
+        If SELF is a directory, raise TypeError
+
+        Arguments:
+        - `obj`: object
+        - `fsync`: bool
+
+        Return: None
+        Exceptions: TypeError
+        """
+        if self.is_dir:
+            raise TypeError("Can't write JSON to a directory Larry... ")
+        with self.atomic_open('w', fsync=fsync) as fh:
+            formats.json_dump(obj, fh, **kw)
+
+    def pickle_load(self):
+        """
+        Treat SELF as a file containing pickled data.
+        Load that data and return it.
+
+        If SELF is a directory or does not exist, raise TypeError
+
+        Return: object
+        Exceptions: TypeError
+        """
+        if not self:
+            raise TypeError("Can't load something that doesn't exist Larry... ")
+        if self.is_dir:
+            raise TypeError("Can't unpickle a directory Larry... ")
+        with self.fs.open(self._value, 'rb') as fh:
+            return pickle.load(fh)
+
+    def pickle_dump(self, obj, protocol=pickle.HIGHEST_PROTOCOL, fsync=False):
+        """
+        Pickle OBJ, atomically replacing the contents of SELF.
+
+        If SELF is a directory, raise TypeError
+
+        Arguments:
+        - `obj`: object
+        - `protocol`: int
+        - `fsync`: bool
+
+        Return: None
+        Exceptions: TypeError
+        """
+        if self.is_dir:
+            raise TypeError("Can't pickle to a directory Larry... ")
+        with self.atomic_open('wb', fsync=fsync) as fh:
+            pickle.dump(obj, fh, protocol)
+
 
 class Path(LeafBranchPath):
     """
@@ -616,8 +915,9 @@ class Path(LeafBranchPath):
             def filegen():
                 "file generator"
                 with self as fh:
-                    for line in fh:
-                        yield line
+                    with iosched.advise(fh) as fh:
+                        for line in fh:
+                            yield line
 
             return filegen()
 
@@ -640,16 +940,24 @@ class Path(LeafBranchPath):
             they will be created. it is assumed that the user knows their
             own mind.
 
+        if we are inside a `with self.appender()` block, hand contents to
+        that session rather than opening the file ourselves.
+
         arguments:
         - `contents`: stringtype
 
         return: None
         exceptions: TypeError
         """
-        if self.is_dir:
-            raise TypeError("you can't write to a directory Larry... ")
         if not isinstance(contents, six.string_types):
             raise TypeError("you have to write with a stringtype Larry... ")
+        sessions = _appenders.get()
+        appender = sessions.get(self._appender_key()) if sessions else None
+        if appender is not None and not appender.closed:
+            appender.write(contents)
+            return
+        if self.is_dir:
+            raise TypeError("you can't write to a directory Larry... ")
         with self.open('a') as fh:
             fh.write(contents)
         return
@@ -684,15 +992,110 @@ class Path(LeafBranchPath):
             self._startdir = None
         return
 
+    @contextlib.contextmanager
+    def appender(self, buffer_size=writers.DEFAULT_BUFFER_SIZE, flush_interval=None,
+                 concurrent=False):
+        """
+        Contextmanager to append to SELF through one long-lived handle.
+
+        Yields an ffs.writers.Appender, which batches writes into
+        BUFFER_SIZE chunks, and if FLUSH_INTERVAL is given, flushes them
+        from a background thread every FLUSH_INTERVAL seconds. Within the
+        block, `self << contents` (or << on any Path with the same value)
+        is routed through the session instead of reopening the file.
+
+        If CONCURRENT is truthy, yield an ffs.writers.ConcurrentAppender
+        instead, which treats each write as a newline-framed record and
+        guarantees records from several processes appending to SELF at
+        once are never interleaved.
+
+        >>> with logfile.appender() as log:
+        ...     for record in records:
+        ...         logfile << record
+
+        If SELF is a directory, raise TypeError
+
+        Note::
+
+            If components of the path leading to SELF do not exist,
+            they will be created. It is assumed that the user knows their
+            own mind.
+
+        Arguments:
+        - `buffer_size`: int
+        - `flush_interval`: float
+        - `concurrent`: bool
+
+        Return: Appender
+        Exceptions: TypeError
+        """
+        if self.is_dir:
+            raise TypeError("you can't write to a directory Larry... ")
+        if not self.fs.is_branch(self.parent): # we only have to check one level
+            self.fs.mkdir((self[:-1]), parents=True)
+        if concurrent:
+            # Create it through our filesystem, so a caching one hears of it.
+            self.fs.open(self._value, 'a').close()
+            appender = writers.ConcurrentAppender(nix.resolve(self.fs.expanduser(self._value)),
+                                                  buffer_size=buffer_size,
+                                                  flush_interval=flush_interval)
+        else:
+            appender = writers.Appender(self.fs.open(self._value, 'a'),
+                                        buffer_size=buffer_size,
+                                        flush_interval=flush_interval)
+        previous = _appenders.get()
+        sessions = dict(previous)
+        sessions[self._appender_key()] = appender
+        _appenders.set(sessions)
+        try:
+            with appender:
+                yield appender
+        finally:
+            _appenders.set(previous)
+
+    def _appender_key(self):
+        """
+        Return the key for SELF's open appender() session in _appenders.
+        """
+        return self.fsflavour, self.fs.abspath(self._value)
+
     @property
     def size(self):
         """
-        Return the size of SELF in bytes
+        Return the size of SELF in bytes, or None if it doesn't exist.
 
         Return: int
+        Exceptions: None
+        """
+        try:
+            return self.fs.stat(self._value).st_size
+        except OSError:
+            return None
+
+    def du(self, breakdown=False, workers=None):
+        """
+        Return the disk usage of the tree at SELF, as nix.du().
+
+        If BREAKDOWN is truthy, also return a dict mapping each immediate
+        subdirectory of SELF to its own usage. If WORKERS is given, scan
+        those subdirectories on that many threads.
+
+        If SELF is nonexistant, raise DoesNotExistError
+
+        Arguments:
+        - `breakdown`: bool
+        - `workers`: int
+
+        Return: DiskUsage or (DiskUsage, dict)
         Exceptions: DoesNotExistError
         """
-        return size(self)
+        if not self:
+            raise exceptions.DoesNotExistError()
+        usage = nix.du(nix.resolve(self._value), breakdown=breakdown, workers=workers)
+        if breakdown:
+            total, byname = usage
+            return total, dict((Path(k), v) for k, v in byname.items())
+        return usage
 
     @classmethod
     @contextlib.contextmanager
@@ -701,15 +1104,18 @@ class Path(LeafBranchPath):
         Create a temporary path within a contextmanager block
         which will be automatically deleted when we exit the block
 
+        On disk, the directory comes from a pool, and is emptied for
+        reuse in the background rather than removed on the spot.
+
         Return: Path
         Exceptions: None
         """
         fs = klass.fsflavour()
-        tmpath = fs.tempdir()
+        tmpath = fs.borrow_tempdir()
         try:
             yield klass(tmpath)
         finally:
-            fs.rm(tmpath, recursive=True)
+            fs.return_tempdir(tmpath)
 
     @classmethod
     @contextlib.contextmanager
@@ -734,6 +1140,27 @@ class Path(LeafBranchPath):
             fs.rm(tmpath)
         return
 
+    @classmethod
+    def scratch(klass, directory=None, mode='w+b'):
+        """
+        Open an anonymous scratch file in DIRECTORY, or the system's
+        temp dir. It has no directory entry, so there's nothing to clean
+        up: it goes away when closed. To keep it, give it a name with
+        its materialize() method:
+
+        >>> with Path.scratch() as fh:
+        ...     fh.write(report)
+        ...     fh.materialize('/srv/reports/today.csv')
+
+        Arguments:
+        - `directory`: str or Path
+        - `mode`: str
+
+        Return: ScratchFile
+        Exceptions: None
+        """
+        return klass.fsflavour().scratch(directory, mode)
+
     @classmethod
     def newdir(klass):
         """
@@ -954,9 +1381,370 @@ class Path(LeafBranchPath):
             raise exceptions.DoesNotExistError()
         if self.is_dir:
             raise exceptions.InappropriateError()
-        checksum = hashlib.md5(self.open('rb').read()).hexdigest()
-        return checksum
-        
-    # !!! json_dump()
-    # !!! pickle_load()
-    # !!! pickle_dump()
+        checksum = hashlib.md5()
+        with self.open('rb') as fh:
+            for block in iosched.blocks(fh):
+                checksum.update(block)
+        return checksum.hexdigest()
+
+    def shards(self, n=None, size=None):
+        """
+        Split SELF into N newline-aligned byte ranges, or ranges of about
+        SIZE bytes, for processing in parallel. Defaults to one per CPU.
+
+        Each ffs.parallel.Shard has .lines() and .read() methods that
+        read just that range.
+
+        If SELF is a directory, raise InappropriateError
+        If SELF is nonexistant, raise DoesNotExistError
+
+        Arguments:
+        - `n`: int
+        - `size`: int
+
+        Return: list[Shard]
+        Exceptions: InappropriateError, DoesNotExistError
+        """
+        if not self:
+            raise exceptions.DoesNotExistError()
+        if self.is_dir:
+            raise exceptions.InappropriateError()
+        return parallel.shards(nix.resolve(self._value), n=n, size=size)
+
+    def pmap(self, func, workers=None, mode='process', n=None, size=None,
+             encoding='utf-8'):
+        """
+        Call FUNC with an iterator over the lines of each shard of SELF,
+        using WORKERS processes (or threads if MODE is 'thread').
+        Return the list of results, in file order.
+
+        Lines are decoded with ENCODING, or passed as bytes if ENCODING
+        is None.
+
+        In 'process' mode FUNC must be picklable, i.e. defined at module level.
+
+        If SELF is a directory, raise InappropriateError
+        If SELF is nonexistant, raise DoesNotExistError
+
+        Arguments:
+        - `func`: callable
+        - `workers`: int
+        - `mode`: str
+        - `n`: int
+        - `size`: int
+        - `encoding`: str or None
+
+        Return: list
+        Exceptions: InappropriateError, DoesNotExistError, ValueError
+        """
+        if not self:
+            raise exceptions.DoesNotExistError()
+        if self.is_dir:
+            raise exceptions.InappropriateError()
+        return parallel.pmap(nix.resolve(self._value), func, workers=workers, mode=mode,
+                             n=n, size=size, encoding=encoding)
+
+    def grep(self, pattern, recursive=True, workers=None, mode='process', flags=0):
+        """
+        Search SELF, or the files below SELF if it is a directory, for
+        lines matching the regular expression PATTERN.
+
+        Yield (Path, line number, line) tuples as matches are found,
+        searching files in parallel on WORKERS processes (or threads if
+        MODE is 'thread'). If RECURSIVE is falsy, only search the files
+        directly inside SELF.
+
+        >>> for path, lineno, line in Path('src').grep(r'TODO'):
+        ...     print(path, lineno, line)
+
+        If SELF is nonexistant, raise DoesNotExistError
+
+        Arguments:
+        - `pattern`: str or bytes
+        - `recursive`: bool
+        - `workers`: int
+        - `mode`: str
+        - `flags`: int
+
+        Return: generator((Path, int, str))
+        Exceptions: DoesNotExistError, ValueError
+        """
+        if not self:
+            raise exceptions.DoesNotExistError()
+        matches = parallel.grep(nix.resolve(self._value), pattern, recursive=recursive,
+                                workers=workers, mode=mode, flags=flags)
+        return ((Path(path), lineno, line) for path, lineno, line in matches)
+
+    def opendir(self):
+        """
+        Return a DirFDPath for the directory SELF, which we hold open, so
+        that operations on the entries beneath it resolve their names
+        relative to it instead of walking the whole path every time.
+
+        >>> release = Path('/srv/builds/2015/03/17/release').opendir()
+        >>> for name in manifest:
+        ...     (release / name).touch()
+
+        If SELF is nonexistant, raise DoesNotExistError
+        If SELF is a file, raise InappropriateError
+
+        Return: DirFDPath
+        Exceptions: DoesNotExistError, InappropriateError
+        """
+        if not self:
+            raise exceptions.DoesNotExistError()
+        if not self.is_dir:
+            raise exceptions.InappropriateError()
+        path = DirFDPath(self._value)
+        path.fs.opendir(path._value)
+        return path
+
+    def aread(self):
+        """
+        Asynchronously read the contents of the file SELF, as read().
+
+        Small reads made together share trips to the executor - see
+        ffs.aio.read().
+
+        >>> contents = await Path('data.txt').aread()
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.read(self)
+
+    def awrite(self, contents, fsync=False):
+        """
+        Asynchronously and atomically replace the contents of SELF with
+        CONTENTS, as write().
+
+        Arguments:
+        - `contents`: stringtype or bytes
+        - `fsync`: bool
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.write(self.write, contents, fsync=fsync)
+
+    def aappend(self, contents):
+        """
+        Asynchronously append CONTENTS to SELF, as SELF << CONTENTS.
+
+        Arguments:
+        - `contents`: stringtype
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.write(self.__lshift__, contents)
+
+    def alines(self, mode='r'):
+        """
+        Asynchronously iterate over the lines of SELF.
+
+        >>> async for line in Path('log.txt').alines():
+        ...     handle(line)
+
+        Arguments:
+        - `mode`: str
+
+        Return: ffs.aio.lines
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.lines(self, mode=mode)
+
+    def als(self, *args, **kwargs):
+        """
+        Asynchronously list SELF, as ls().
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.batch(self.ls, *args, **kwargs)
+
+    def acp(self, target):
+        """
+        Asynchronously copy SELF to TARGET, as cp().
+
+        Arguments:
+        - `target`: str or Path
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.run(self.cp, target)
+
+    def achecksum(self):
+        """
+        Asynchronously checksum SELF, as the checksum property.
+
+        Return: asyncio.Future
+        Exceptions: NotSupportedError
+        """
+        from ffs import aio
+        return aio.run(lambda: self.checksum)
+
+
+class CachedPath(Path):
+    """
+    A Path whose metadata queries are answered from a CachingFilesystem
+    shared by every CachedPath, so that repeated checks of the same
+    paths on a slow mount cost one round trip.
+
+    To tune the cache, or keep a separate one, subclass and set `cache`:
+
+    >>> class NFSPath(CachedPath):
+    ...     cache = filesystem.CachingFilesystem(filesystem.DiskFilesystem(), ttl=5)
+    """
+    cache = filesystem.CachingFilesystem(filesystem.DiskFilesystem())
+
+    @classmethod
+    def fsflavour(klass):
+        """
+        Every instance shares our class's cache, rather than getting a
+        fresh filesystem of its own.
+        """
+        return klass.cache
+
+
+class DirFDPath(Path):
+    """
+    A Path on the DirFDFilesystem shared by every DirFDPath, which
+    keeps descriptors for recently used directories open. See
+    Path.opendir().
+    """
+    dirfds = filesystem.DirFDFilesystem()
+
+    @classmethod
+    def fsflavour(klass):
+        """
+        Every instance shares our class's open directories, rather than
+        getting a fresh filesystem of its own.
+        """
+        return klass.dirfds
+
+
+class MemoryPath(Path):
+    """
+    A Path on the MemoryFilesystem shared by every MemoryPath - handy
+    for scratch work and tests that don't need to touch the disk.
+
+    >>> with MemoryPath.temp() as tmp:
+    ...     (tmp / 'data.json').json_dump({'a': 1})
+    ...     tmp.dump_to('/srv/output')
+
+    Helpers that go straight to the disk - du(), grep(), pmap(),
+    shards(), opendir(), mmap(), scratch() and concurrent appenders -
+    raise InappropriateError.
+    """
+    fsflavour = filesystem.MemoryFilesystem
+
+    def _on_disk(self, *args, **kwargs):
+        """
+        Stand-in for the Path helpers that only work on real disk.
+
+        Exceptions: InappropriateError
+        """
+        raise exceptions.InappropriateError("That only works on disk Larry... ")
+
+    du = grep = pmap = shards = opendir = mmap = _on_disk
+    scratch = classmethod(_on_disk)
+
+    def preallocate(self, size):
+        """
+        There's no disk to reserve, but as Path.preallocate(), grow SELF
+        to at least SIZE bytes of zeros, creating it if needs be.
+
+        If SELF is a directory, raise TypeError
+
+        Arguments:
+        - `size`: int
+
+        Return: bool - always False
+        Exceptions: TypeError
+        """
+        if self.is_dir:
+            raise TypeError("Can't preallocate a directory Larry... ")
+        with self.open('ab') as fh:
+            missing = size - fh.tell()
+            if missing > 0:
+                fh.write(b'\0' * missing)
+        return False
+
+    def appender(self, buffer_size=writers.DEFAULT_BUFFER_SIZE, flush_interval=None,
+                 concurrent=False):
+        """
+        Contextmanager to append to SELF through one long-lived handle,
+        as Path.appender().
+
+        If CONCURRENT is truthy, raise InappropriateError - other
+        processes can't see our files.
+
+        Arguments:
+        - `buffer_size`: int
+        - `flush_interval`: float
+        - `concurrent`: bool
+
+        Return: Appender
+        Exceptions: TypeError, InappropriateError
+        """
+        if concurrent:
+            self._on_disk()
+        return Path.appender(self, buffer_size=buffer_size, flush_interval=flush_interval)
+
+    @property
+    def abspath(self):
+        """
+        Return the absolute path represented by SELF.
+
+        Return: MemoryPath
+        Exceptions: None
+        """
+        return MemoryPath(self.fs.abspath(self._value))
+
+    @property
+    def parent(self):
+        """
+        Return a MemoryPath representing the parent of SELF
+
+        Return: MemoryPath
+        Exceptions: None
+        """
+        return MemoryPath(self.fs.parent(self._value))
+
+    def mv(self, target):
+        """
+        Move SELF to TARGET.
+        Return a MemoryPath representing the new location at TARGET.
+
+        If SELF does not exist, raise DoesNotExistError
+
+        Arguments:
+        - `target`: str or Path
+
+        Return: MemoryPath
+        Exceptions: DoesNotExistError
+        """
+        Path.mv(self, target)
+        return MemoryPath(target)
+
+    def dump_to(self, disk_path):
+        """
+        Write out the tree (or file) at SELF to DISK_PATH on real disk.
+
+        Arguments:
+        - `disk_path`: str or Path
+
+        Return: None
+        Exceptions: DoesNotExistError
+        """
+        if not self:
+            raise exceptions.DoesNotExistError()
+        self.fs.dump_to(disk_path, self._value)
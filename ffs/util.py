@@ -96,10 +96,49 @@ def size(filepath):
     Return: int
     Exceptions: None
     """
-    filename = os.path.abspath(filepath)
-    if not _defensive_access(filepath):
+    try:
+        return int(os.stat(str(filepath)).st_size)
+    except OSError:
         return None
-    return int(os.stat(filename).st_size)
+
+def basen(path, num=1):
+    """
+    Return the last `num` components of `path`
+
+    Arguments:
+    - `path`: str
+    - `num`: int
+
+    Return: str
+    Exceptions: None
+    """
+    if num <= 0:
+        return ''
+    # str.rsplit rather than path.rsplit - Path blacklists it.
+    return os.sep.join(str.rsplit(path, os.sep, num)[-num:])
+
+def basen_many(paths, num=1):
+    """
+    Return the last `num` components of each of `paths`, in order.
+
+    Equivalent to [basen(p, num) for p in paths], but with the
+    per-call overhead paid once for the whole collection.
+
+    Arguments:
+    - `paths`: iterable of str
+    - `num`: int
+
+    Return: [str,]
+    Exceptions: None
+    """
+    sep = os.sep
+    if num <= 0:
+        return ['' for _ in paths]
+    if num == 1:
+        rpartition = str.rpartition
+        return [rpartition(p, sep)[2] for p in paths]
+    rsplit, join, start = str.rsplit, sep.join, -num
+    return [join(rsplit(p, sep, num)[start:]) for p in paths]
 
 class Flike(StringIO):
     "String IO that understands the Contextmanager protocol"
@@ -0,0 +1,481 @@
+"""
+ffs.writers
+
+Helpers for getting data onto disk safely and cheaply.
+"""
+from __future__ import with_statement
+
+import binascii
+import contextlib
+import errno
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import os
+import stat
+import threading
+
+import six
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+_replace = getattr(os, 'replace', os.rename)
+_batches = threading.local()
+
+def _mktemp(filename):
+    """
+    Create and open a hidden temporary file alongside FILENAME.
+
+    Unlike tempfile.mkstemp() we honour the umask, and if FILENAME
+    already exists we take on its permissions, so that replacing a file
+    doesn't silently change its mode.
+
+    Arguments:
+    - `filename`: str
+
+    Return: (int, str) - descriptor and path of the temporary file
+    Exceptions: OSError
+    """
+    dirname, basename = os.path.split(filename)
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except OSError:
+        mode = None
+    while True:
+        suffix = binascii.hexlify(os.urandom(6)).decode('ascii')
+        tmpname = os.path.join(dirname, '.{0}.{1}.tmp'.format(basename, suffix))
+        try:
+            fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except OSError as err:
+            if err.errno == errno.EEXIST:
+                continue
+            raise
+        if mode is not None:
+            try:
+                os.chmod(tmpname, mode)
+            except OSError:
+                os.close(fd)
+                _unlink(tmpname)
+                raise
+        return fd, tmpname
+
+def _unlink(*tmpnames):
+    """
+    Remove the temporary files TMPNAMES, ignoring those already gone.
+
+    Arguments:
+    - `*tmpnames`: str
+
+    Return: None
+    Exceptions: None
+    """
+    for tmpname in tmpnames:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+def _fsync_dir(dirname):
+    """
+    Flush the directory entries of DIRNAME to disk, making a rename
+    within it durable.
+
+    Arguments:
+    - `dirname`: str
+
+    Return: None
+    Exceptions: None
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return # Not every platform lets us open directories.
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def preallocate(fh, size, offset=0):
+    """
+    Reserve SIZE bytes of disk from OFFSET for the open file FH (or
+    descriptor), so that writing them later neither fragments the file
+    nor extends its metadata a write at a time. The file grows to at
+    least OFFSET + SIZE bytes, reading as zeros.
+
+    Files not on disk, and filesystems that can't, are left alone.
+
+    Arguments:
+    - `fh`: file or int
+    - `size`: int
+    - `offset`: int
+
+    Return: bool - whether we preallocated
+    Exceptions: OSError - say, ENOSPC
+    """
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        fd = fh if isinstance(fh, six.integer_types) else fh.fileno()
+    except (AttributeError, IOError, ValueError):
+        return False # Not a file on disk
+    try:
+        os.posix_fallocate(fd, offset, size)
+    except OSError as err:
+        if err.errno in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENODEV):
+            return False
+        raise
+    return True
+
+class _Sized(object):
+    """
+    Proxy for FH, a file we are writing, that remembers the furthest
+    position written before each seek - so that we can truncate the
+    file to its real end when done, even if the writer went back to
+    fill in a header.
+    """
+    def __init__(self, fh):
+        self._fh = fh
+        self.end = 0
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+    def __iter__(self):
+        return iter(self._fh)
+
+    def position(self):
+        """
+        Return the byte offset of FH's descriptor, once flushed - which,
+        unlike tell() in text mode, is a number we can truncate to.
+        """
+        self._fh.flush()
+        return os.lseek(self._fh.fileno(), 0, os.SEEK_CUR)
+
+    def seek(self, *args):
+        self.end = max(self.end, self.position())
+        return self._fh.seek(*args)
+
+    def truncate(self, *args):
+        size = self._fh.truncate(*args)
+        self.end = size
+        return size
+
+@contextlib.contextmanager
+def sized(fh, expected_size=None):
+    """
+    Contextmanager around FH, a file we are writing from its start,
+    which we expect to reach EXPECTED_SIZE bytes.
+
+    We preallocate that much up front, and when the block exits
+    truncate the file to the furthest byte written - so guessing too
+    high costs nothing, and too low no more than not guessing. Without
+    an EXPECTED_SIZE, we just yield FH.
+
+    Arguments:
+    - `fh`: file
+    - `expected_size`: int
+
+    Return: file
+    Exceptions: OSError
+    """
+    if not expected_size or not preallocate(fh, expected_size):
+        yield fh
+        return
+    proxy = _Sized(fh)
+    try:
+        yield proxy
+    finally:
+        if not fh.closed:
+            os.ftruncate(fh.fileno(), max(proxy.end, proxy.position()))
+
+@contextlib.contextmanager
+def atomic_open(filename, mode='w', buffer_size=DEFAULT_BUFFER_SIZE, fsync=False):
+    """
+    Contextmanager to replace the contents of FILENAME atomically.
+
+    We yield a file opened in MODE with a BUFFER_SIZE buffer, which
+    actually points at a temporary sibling of FILENAME. When the block
+    exits cleanly the temporary file is renamed over FILENAME, so
+    readers see either the old contents or the new, never a partial
+    write. If the block raises, the temporary file is removed and
+    FILENAME is left untouched.
+
+    If FSYNC is truthy, flush the data to disk before the rename, and
+    the directory entry after it.
+
+    Inside an fsync_batch() block the rename is deferred until the
+    batch ends.
+
+    Arguments:
+    - `filename`: str or Path
+    - `mode`: str
+    - `buffer_size`: int
+    - `fsync`: bool
+
+    Return: file
+    Exceptions: ValueError
+    """
+    if mode not in ('w', 'wb'):
+        raise ValueError("Atomic writes replace the whole file - mode must be w or wb Larry... ")
+    filename = os.path.abspath(str(filename))
+    fd, tmpname = _mktemp(filename)
+    try:
+        with os.fdopen(fd, mode, buffer_size) as fh:
+            yield fh
+            fh.flush()
+            if fsync:
+                os.fsync(fh.fileno())
+    except:
+        os.unlink(tmpname)
+        raise
+
+    batch = getattr(_batches, 'current', None)
+    if batch is not None:
+        batch.append((tmpname, filename, fsync))
+        return
+    _replace(tmpname, filename)
+    if fsync:
+        _fsync_dir(os.path.dirname(filename))
+
+@contextlib.contextmanager
+def fsync_batch():
+    """
+    Contextmanager to group the atomic writes made by this thread.
+
+    Each atomic_open() within the block writes (and if asked, fsyncs) its
+    temporary file as usual, but the renames are held back until the
+    block exits. Then we rename them all into place and fsync each
+    directory involved once, rather than once per file.
+
+    If the block raises, none of the writes are published.
+
+    Nested batches join the outermost one.
+
+    Return: None
+    Exceptions: None
+    """
+    if getattr(_batches, 'current', None) is not None:
+        yield
+        return
+    batch = _batches.current = []
+    try:
+        yield
+    except:
+        _batches.current = None
+        _unlink(*[tmpname for tmpname, _, _ in batch])
+        raise
+    _batches.current = None
+
+    dirty = set()
+    for i, (tmpname, filename, fsync) in enumerate(batch):
+        try:
+            _replace(tmpname, filename)
+        except:
+            _unlink(*[tmpname for tmpname, _, _ in batch[i:]])
+            raise
+        if fsync:
+            dirty.add(os.path.dirname(filename))
+    for dirname in dirty:
+        _fsync_dir(dirname)
+
+
+class Appender(object):
+    """
+    A long-lived append session on the file-like object FH.
+
+    Writes are gathered in memory and handed to FH in batches of at
+    least BUFFER_SIZE characters, so that many small appends cost a
+    handful of writes rather than an open/write/close each.
+
+    If FLUSH_INTERVAL is given, a daemon thread also flushes every
+    FLUSH_INTERVAL seconds, bounding how stale the file can get while
+    writes trickle in.
+
+    Usable as a contextmanager, closing FH on exit. Writing is
+    thread-safe.
+    """
+    def __init__(self, fh, buffer_size=DEFAULT_BUFFER_SIZE, flush_interval=None):
+        self.fh = fh
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.closed = False
+        self._buf = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return
+
+    def __lshift__(self, contents):
+        """
+        Allow `appender << contents` as a synonym for write()
+        """
+        self.write(contents)
+        return self
+
+    def _flush_periodically(self):
+        """
+        Body of our background flushing thread.
+
+        Return: None
+        Exceptions: None
+        """
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _drain(self):
+        """
+        Hand everything we're holding to our file. Call with the lock held.
+
+        Return: None
+        Exceptions: None
+        """
+        if self._buf:
+            data = self._buf[0][:0].join(self._buf)
+            self._buf, self._size = [], 0
+            self.fh.write(data)
+
+    def write(self, contents):
+        """
+        Append CONTENTS to our file, at the latest when our buffer fills.
+
+        Arguments:
+        - `contents`: stringtype
+
+        Return: None
+        Exceptions: ValueError
+        """
+        with self._lock:
+            if self.closed:
+                raise ValueError("Can't write to a closed appender Larry... ")
+            self._buf.append(contents)
+            self._size += len(contents)
+            if self._size >= self.buffer_size:
+                self._drain()
+
+    def flush(self):
+        """
+        Write out anything we're holding, and flush our file.
+
+        Return: None
+        Exceptions: None
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self._drain()
+            self.fh.flush()
+
+    def close(self):
+        """
+        Flush, stop our flushing thread if we have one, and close our file.
+
+        Return: None
+        Exceptions: None
+        """
+        self._stop.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self._drain()
+            finally:
+                self.closed = True
+                self.fh.close()
+
+
+class ConcurrentAppender(Appender):
+    """
+    An append session on FILENAME that is safe to share between
+    processes: each record lands in the file whole, never interleaved
+    with records from other writers.
+
+    We open FILENAME with O_APPEND, so that every write() goes to the
+    current end of the file, and take an exclusive flock() while we
+    write out each batch of buffered records - in writes of whole
+    records, at most BUFFER_SIZE bytes unless a record is larger - so
+    that writers sharing the file can't land between our writes.
+
+    If FRAMING is given, it is added to records that don't already end
+    with it, so that every record is delimited. Text is encoded as UTF-8.
+    """
+    def __init__(self, filename, buffer_size=DEFAULT_BUFFER_SIZE,
+                 flush_interval=None, framing='\n'):
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        fd = os.open(str(filename), flags, 0o666)
+        self.framing = framing.encode('utf-8') if framing else b''
+        Appender.__init__(self, os.fdopen(fd, 'ab', 0), buffer_size=buffer_size,
+                          flush_interval=flush_interval)
+
+    def write(self, contents):
+        """
+        Append the record CONTENTS to our file, at the latest when our
+        buffer fills.
+
+        Arguments:
+        - `contents`: stringtype or bytes
+
+        Return: None
+        Exceptions: ValueError
+        """
+        if isinstance(contents, six.text_type):
+            contents = contents.encode('utf-8')
+        if self.framing and not contents.endswith(self.framing):
+            contents += self.framing
+        Appender.write(self, contents)
+
+    def _write(self, data):
+        """
+        Write all of DATA, continuing after any short write.
+
+        Arguments:
+        - `data`: bytes
+
+        Return: None
+        Exceptions: None
+        """
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fh.fileno(), view):]
+
+    def _drain(self):
+        """
+        Write out our buffered records in whole-record groups.
+        Call with the lock held.
+
+        Return: None
+        Exceptions: None
+        """
+        records, self._buf, self._size = self._buf, [], 0
+        if not records:
+            return
+        locked = fcntl is not None
+        if locked:
+            fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+        try:
+            group, size = [], 0
+            for record in records:
+                if group and size + len(record) > self.buffer_size:
+                    self._write(b''.join(group))
+                    group, size = [], 0
+                group.append(record)
+                size += len(record)
+            self._write(b''.join(group))
+        finally:
+            if locked:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
@@ -68,6 +68,45 @@ class TarFilesystemTestCase(unittest.TestCase):
         "Knows if this is a leaf or not"
         self.assertEqual(False, self.fs.is_leaf('wat/some.file'))
 
+    def test_exists_implied_dir(self):
+        "Directories implied by member names exist"
+        self.assertEqual(True, self.fs.exists('tmp'))
+
+    def test_stat_many(self):
+        "Stat many members from the index"
+        stats = self.fs.stat_many(['tmp/some.file', 'tmp', 'nope'])
+        self.assertIsInstance(stats[0], tarfile.TarInfo)
+        self.assertEqual([None, None], stats[1:])
+
+    def test_exists_many(self):
+        "Check many members at once"
+        self.assertEqual([True, True, False],
+                         self.fs.exists_many(['tmp/some.file', 'tmp/', 'nope']))
+
+    def test_classify_many(self):
+        "Classify many members at once"
+        self.assertEqual(['leaf', 'branch', None],
+                         self.fs.classify_many(['tmp/some.file', 'tmp', 'nope']))
+
+    def test_classify_links(self):
+        "Links are neither leaves nor branches"
+        fs = archive.TarFilesystem(FIXTURES/'links.tar')
+        self.assertEqual(['leaf', 'other'],
+                         fs.classify_many(['tmp/some.file', 'tmp/some.link']))
+        self.assertEqual(True, fs.is_leaf('tmp/some.file'))
+        self.assertEqual(False, fs.is_leaf('tmp/some.link'))
+        self.assertEqual(True, fs.exists('tmp/some.link'))
+
+    def test_many_reads_archive_once(self):
+        "The member index is built once"
+        members = self.fs.tarfile.getmembers()
+        with patch.object(self.fs.tarfile, 'getmembers') as pmembers:
+            pmembers.return_value = members
+            self.fs.exists_many(['tmp'])
+            self.fs.classify_many(['tmp'])
+            self.fs.stat_many(['tmp'])
+            self.assertEqual(1, pmembers.call_count)
+
     def test_ln_raises(self):
         "Should raise inappropriate"
         with self.assertRaises(exceptions.InappropriateError):
@@ -119,6 +158,11 @@ class ZipFilesystemTestCase(unittest.TestCase):
     def test_sep(self):
         self.assertEqual('/', self.fs.sep)
 
+    def test_classify_many(self):
+        "Classify members from the index"
+        self.assertEqual(['leaf', None], self.fs.classify_many(['some.file', 'nope']))
+        self.assertIsInstance(self.fs.stat_many(['some.file'])[0], zipfile.ZipInfo)
+
     def test_not_a_zipfile_raises(self):
         "Should raise"
         with Path.tempfile() as temp:
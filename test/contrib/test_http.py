@@ -59,6 +59,22 @@ class HttpFilesystemTestCase(unittest.TestCase):
             self.assertEqual(True, self.fs.exists('localhost'))
             phead.assert_called_with('http://localhost')
 
+    def test_exists_many(self):
+        "Check the existence of many resources at once"
+        with patch('requests.head') as phead:
+            def head(url):
+                return MagicMock(status_code=200 if url.endswith('yes') else 404)
+            phead.side_effect = head
+            self.assertEqual([True, False, True],
+                             self.fs.exists_many(['localhost/yes', 'localhost/no',
+                                                  'localhost/yes']))
+            self.assertEqual(3, phead.call_count)
+
+    def test_classify_many(self):
+        "Can't tell what things are"
+        with self.assertRaises(exceptions.InappropriateError):
+            self.fs.classify_many(['localhost'])
+
     def test_getwd(self):
         "Getwd"
         self.assertEqual('http://localhost', self.fs.getwd())
@@ -0,0 +1,182 @@
+"""
+Unittests for the ffs.aio module
+"""
+from __future__ import with_statement
+
+import gc
+import sys
+import tempfile
+import threading
+import unittest
+import weakref
+
+if sys.version_info <  (2, 7):
+    import unittest2 as unittest
+
+from ffs import aio, nix, Path
+
+if aio.ThreadPoolExecutor is not None:
+    class CountingExecutor(aio.ThreadPoolExecutor):
+        "Count trips to the executor"
+        def __init__(self, *args, **kwargs):
+            aio.ThreadPoolExecutor.__init__(self, *args, **kwargs)
+            self.submitted = 0
+
+        def submit(self, *args, **kwargs):
+            self.submitted += 1
+            return aio.ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+@unittest.skipIf(aio.asyncio is None, 'No asyncio')
+class AioTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.loop = aio.asyncio.new_event_loop()
+        aio.asyncio.set_event_loop(self.loop)
+        self.executor = CountingExecutor(4)
+        aio.configure(executor=self.executor)
+
+    def tearDown(self):
+        aio.configure()
+        self.executor.shutdown()
+        self.loop.close()
+        aio.asyncio.set_event_loop(None)
+        nix.rm_r(self.tdir)
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def collect(self, iterator):
+        "Drain an asynchronous iterator"
+        collected = []
+        while True:
+            try:
+                collected.append(self.wait(iterator.__anext__()))
+            except StopAsyncIteration:
+                return collected
+
+    def test_run(self):
+        "Run blocking calls in the executor"
+        self.assertEqual(3, self.wait(aio.run(len, 'abc')))
+        with self.assertRaises(ZeroDivisionError):
+            self.wait(aio.run(lambda: 1 // 0))
+        self.assertEqual(2, self.executor.submitted)
+
+    def test_batch(self):
+        "Group small calls into few trips to the executor"
+        futures = [aio.batch(str, i) for i in range(100)]
+        futures.append(aio.batch(lambda: 1 // 0))
+        results = self.wait(aio.asyncio.gather(*futures, return_exceptions=True))
+        self.assertEqual([str(i) for i in range(100)], results[:-1])
+        self.assertIsInstance(results[-1], ZeroDivisionError)
+        self.assertEqual(2, self.executor.submitted)
+
+    def test_single(self):
+        "A call with nothing to batch with goes on its own"
+        self.assertEqual('1', self.wait(aio.batch(str, 1)))
+        with self.assertRaises(ZeroDivisionError):
+            self.wait(aio.batch(lambda: 1 // 0))
+        self.assertEqual(2, self.executor.submitted)
+
+    def test_large_alone(self):
+        "Big reads and writes don't share a trip"
+        root = Path(self.tdir)
+        big = 'x' * (aio.BATCH_MAX_BYTES + 1)
+        docs = [root / 'doc{0}.txt'.format(i) for i in range(3)]
+        self.wait(aio.asyncio.gather(docs[0].awrite(big), docs[1].awrite('small'),
+                                     docs[2].awrite('small')))
+        self.assertEqual(2, self.executor.submitted)
+        contents = self.wait(aio.asyncio.gather(*[d.aread() for d in docs]))
+        self.assertEqual([big, 'small', 'small'], contents)
+        self.assertEqual(4, self.executor.submitted)
+        with self.assertRaises(TypeError):
+            self.wait(root.aread())
+
+    def test_context(self):
+        "Calls see the caller's logical working directory"
+        with nix.cd(self.tdir, logical=True):
+            self.assertEqual(self.tdir, self.wait(aio.run(nix.getwd)))
+            self.assertEqual(self.tdir, self.wait(aio.batch(nix.getwd)))
+
+    def test_path(self):
+        "Path's asynchronous methods"
+        root = Path(self.tdir)
+        docs = [root / 'doc{0}.txt'.format(i) for i in range(10)]
+        self.wait(aio.asyncio.gather(*[d.awrite('hello {0}\n'.format(i))
+                                       for i, d in enumerate(docs)]))
+        self.wait(docs[0].aappend('world\n'))
+        contents = self.wait(aio.asyncio.gather(*[d.aread() for d in docs]))
+        self.assertEqual('hello 0\nworld\n', contents[0])
+        self.assertEqual('hello 9\n', contents[9])
+        self.assertEqual(sorted(docs), sorted(self.wait(root.als())))
+        self.wait(docs[0].acp(root / 'copy.txt'))
+        self.assertEqual(docs[0].checksum, self.wait((root / 'copy.txt').achecksum()))
+
+    def test_lines(self):
+        "Iterate over lines a chunk at a time"
+        doc = Path(self.tdir) / 'doc.txt'
+        lines = ['line {0}\n'.format(i) for i in range(1000)]
+        doc << ''.join(lines)
+        submitted = self.executor.submitted
+        self.assertEqual(lines, self.collect(aio.lines(doc, chunksize=1024)))
+        self.assertTrue(self.executor.submitted - submitted < 20)
+        self.assertEqual([l.encode('utf-8') for l in lines], self.collect(doc.alines('rb')))
+
+    def test_lines_missing(self):
+        "Errors arrive through the iterator"
+        with self.assertRaises(IOError):
+            self.collect((Path(self.tdir) / 'nope').alines())
+
+    def test_lines_aclose(self):
+        "Stop early"
+        doc = Path(self.tdir) / 'doc.txt'
+        doc << 'one\ntwo\n'
+        iterator = doc.alines()
+        self.assertEqual('one\n', self.wait(iterator.__anext__()))
+        self.wait(iterator.aclose())
+        self.assertEqual([], self.collect(iterator))
+
+    def test_lines_aclose_waits(self):
+        "Closing waits for a read in flight"
+        events, started, release = [], threading.Event(), threading.Event()
+        class SlowFile(object):
+            def readlines(self, size):
+                started.set()
+                release.wait(5)
+                events.append('read')
+                return ['one\n']
+            def close(self):
+                events.append('close')
+        iterator = (Path(self.tdir) / 'doc.txt').alines()
+        iterator._fh = SlowFile()
+        pending = iterator.__anext__()
+        started.wait(5)
+        closing = iterator.aclose()
+        threading.Timer(0.05, release.set).start()
+        self.wait(aio.asyncio.gather(pending, closing))
+        self.assertEqual(['read', 'close'], events)
+        self.assertEqual([], self.wait(aio.run(iterator._read)))
+
+    def test_lines_abandoned(self):
+        "Close the file on leaving an async with block, or when collected"
+        doc = Path(self.tdir) / 'doc.txt'
+        doc << 'one\ntwo\n'
+        iterator = doc.alines()
+        self.assertIs(iterator, self.wait(iterator.__aenter__()))
+        self.assertEqual('one\n', self.wait(iterator.__anext__()))
+        fh = iterator._fh
+        self.wait(iterator.__aexit__(None, None, None))
+        self.assertTrue(fh.closed)
+        iterator = doc.alines()
+        self.wait(iterator.__anext__())
+        fh = iterator._fh
+        # A worker may still hold the bound _read until it goes idle.
+        self.executor.shutdown(wait=True)
+        ref = weakref.ref(iterator)
+        del iterator
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertTrue(fh.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,29 +62,85 @@ class BaseNTestCase(unittest.TestCase):
             based = ffs.basen(path, num=num)
             self.assertEqual(expected, based)
 
+    def test_basen_edges(self):
+        "Short paths, and no components"
+        self.assertEqual('/foo/bar', ffs.basen('/foo/bar', num=5))
+        self.assertEqual('bar', ffs.basen('bar', num=2))
+        self.assertEqual('', ffs.basen('/foo/bar', num=0))
 
-class LsmtimeTestCase(unittest.TestCase):
-
-    def test_lessthan(self):
-        "Files modified less than... "
-        mtimes = [456, 789, 123]
-        def mtimer(path):
-            return mtimes.pop()
-
-        def walker(self):
-            yield ['/foo/bar/', [], ['baz.txt', 'caz.txt', 'daz.txt']]
+    def test_basen_many(self):
+        "Many paths at once, in order"
+        paths = ['/foo/bar/car/goo.txt', 'goo.txt', '/goo.txt', 'foo/']
+        for num in range(4):
+            self.assertEqual([ffs.basen(p, num) for p in paths],
+                             ffs.basen_many(paths, num))
 
-        with patch.object(ffs.os, 'walk') as pwalk:
-            pwalk.side_effect = walker
 
-            with patch.object(ffs.os.path, 'getmtime') as ptime:
-                ptime.side_effect = mtimer
-
-                lessthan = ffs.lsmtime('/foo/bar', datetime.datetime(1970, 1, 1, 0, 3))
-
-                expected = ['/foo/bar/baz.txt']
+class LsmtimeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.index = os.path.join(tempfile.mkdtemp(), 'mtimes.json')
+        os.makedirs(os.path.join(self.tdir, 'sub', 'deeper'))
+        for name, mtime in [('old.txt', 60), ('new.txt', 600),
+                            ('sub/deeper/old.txt', 120)]:
+            fpath = os.path.join(self.tdir, name)
+            open(fpath, 'w').close()
+            os.utime(fpath, (mtime, mtime))
+        self.lessthan = datetime.datetime(1970, 1, 1, 0, 3)
+        self.expected = [os.path.join(self.tdir, 'old.txt'),
+                         os.path.join(self.tdir, 'sub', 'deeper', 'old.txt')]
+
+    def tearDown(self):
+        ffs.rm_r(self.tdir)
+        ffs.rm_r(os.path.dirname(self.index))
 
-                self.assertEqual(expected, lessthan)
+    def test_lessthan(self):
+        "Files modified less than... anywhere in the tree"
+        self.assertEqual(self.expected, ffs.lsmtime(self.tdir, self.lessthan))
+
+    def test_index(self):
+        "The index gives the same answers"
+        self.assertEqual(self.expected,
+                         ffs.lsmtime(self.tdir, self.lessthan, index=self.index))
+        self.assertTrue(os.path.exists(self.index))
+        self.assertEqual(self.expected,
+                         ffs.lsmtime(self.tdir, self.lessthan, index=self.index))
+
+    def test_index_unchanged_dirs(self):
+        "Directories that haven't changed aren't listed again"
+        ffs.lsmtime(self.tdir, self.lessthan, index=self.index)
+        with patch.object(ffs, 'scandir') as pscan:
+            self.assertEqual(self.expected,
+                             ffs.lsmtime(self.tdir, self.lessthan, index=self.index))
+            self.assertFalse(pscan.called)
+
+    def test_index_changed_dirs(self):
+        "Added and removed files are noticed"
+        ffs.lsmtime(self.tdir, self.lessthan, index=self.index)
+        os.remove(self.expected[1])
+        added = os.path.join(self.tdir, 'sub', 'added.txt')
+        open(added, 'w').close()
+        os.utime(added, (1, 1))
+        self.assertEqual([self.expected[0], added],
+                         ffs.lsmtime(self.tdir, self.lessthan, index=self.index))
+
+    def test_index_verify(self):
+        "Files edited in place are re-checked unless we trust the index"
+        os.utime(self.tdir, (1000, 1000))
+        ffs.lsmtime(self.tdir, self.lessthan, index=self.index)
+        with open(self.expected[0], 'w') as fh:
+            fh.write('edited')
+        os.utime(self.tdir, (1000, 1000))
+        self.assertEqual(self.expected,
+                         ffs.lsmtime(self.tdir, self.lessthan, index=self.index,
+                                     verify=False))
+        self.assertEqual(self.expected[1:],
+                         ffs.lsmtime(self.tdir, self.lessthan, index=self.index))
+
+    def test_nonexistant(self):
+        "Should raise"
+        with self.assertRaises(ffs.exceptions.DoesNotExistError):
+            ffs.lsmtime(os.path.join(self.tdir, 'nope'), self.lessthan)
 
 class RmTestCase(unittest.TestCase):
 
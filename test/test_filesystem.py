@@ -4,9 +4,13 @@ Unittests for the ffs.filesystem module
 from __future__ import with_statement
 
 import getpass
+import io
+import json
 import os
+import stat
 import sys
 import tempfile
+import time
 import unittest
 
 from mock import MagicMock, patch
@@ -54,6 +58,11 @@ class BaseFilesystemTestCase(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             self.fs.open(None)
 
+    def test_atomic_open(self):
+        "Atomic_open raises"
+        with self.assertRaises(NotImplementedError):
+            self.fs.atomic_open(None)
+
     def test_is_branch(self):
         "Is_branch raises"
         with self.assertRaises(NotImplementedError):
@@ -109,6 +118,30 @@ class BaseFilesystemTestCase(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             self.fs.stat(None)
 
+    def test_stat_many(self):
+        "Falls back to exists() and stat()"
+        with patch.object(self.fs, 'exists') as pexists:
+            with patch.object(self.fs, 'stat') as pstat:
+                pexists.side_effect = lambda r: r != 'nope'
+                pstat.side_effect = lambda r: 'stat ' + r
+                self.assertEqual(['stat a', None], self.fs.stat_many(['a', 'nope']))
+
+    def test_exists_many(self):
+        "Falls back to exists()"
+        with patch.object(self.fs, 'exists') as pexists:
+            pexists.side_effect = lambda r: r != 'nope'
+            self.assertEqual([True, False], self.fs.exists_many(['a', 'nope']))
+
+    def test_classify_many(self):
+        "Falls back to exists(), is_branch() and is_leaf()"
+        with patch.multiple(self.fs, exists=MagicMock(), is_branch=MagicMock(),
+                            is_leaf=MagicMock()):
+            self.fs.exists.side_effect = lambda r: r != 'nope'
+            self.fs.is_branch.side_effect = lambda r: r == 'dir'
+            self.fs.is_leaf.side_effect = lambda r: r == 'file'
+            self.assertEqual([filesystem.BRANCH, filesystem.LEAF, filesystem.OTHER, None],
+                             self.fs.classify_many(['dir', 'file', 'fifo', 'nope']))
+
     def test_touch(self):
         "Touch raises"
         with self.assertRaises(NotImplementedError):
@@ -134,6 +167,11 @@ class ReadOnlyFilesystemTestCase(unittest.TestCase):
         with self.assertRaises(exceptions.InappropriateError):
             self.fs.mkdir(None)
 
+    def test_atomic_open(self):
+        "Atomic_open raises"
+        with self.assertRaises(exceptions.InappropriateError):
+            self.fs.atomic_open(None)
+
     def test_cp(self):
         "Cp raises"
         with self.assertRaises(exceptions.InappropriateError):
@@ -192,6 +230,103 @@ class DiskFilesystemTestCase(unittest.TestCase):
         "Should be os.sep"
         self.assertEqual(os.sep, self.fs.sep)
 
+    def test_tempfile_mkstemp(self):
+        "Create the file as we name it"
+        with patch('tempfile.mktemp') as mktemp:
+            tfile = self.fs.tempfile()
+            self.assertFalse(mktemp.called)
+        self.assertTrue(os.path.isfile(tfile))
+        os.unlink(tfile)
+
+    def test_scratch(self):
+        "Anonymous files, which we can give a name"
+        with self.fs.scratch(self.tdir) as fh:
+            fh.write(b'scratch')
+            self.assertEqual([], os.listdir(self.tdir))
+            target = os.path.join(self.tdir, 'kept')
+            fh.materialize(target)
+            fh.write(b'pad')
+            self.assertEqual(target, fh.name)
+        with open(target, 'rb') as fh:
+            self.assertEqual(b'scratchpad', fh.read())
+        with self.fs.scratch(self.tdir, mode='w+') as fh:
+            fh.write(u'text')
+            fh.seek(0)
+            self.assertEqual(u'text', fh.read())
+        self.assertEqual(['kept'], os.listdir(self.tdir))
+
+    def test_scratch_fallback(self):
+        "Without O_TMPFILE we use, and clean up, a named temporary file"
+        with patch.object(filesystem, 'O_TMPFILE', None):
+            fh = self.fs.scratch(self.tdir)
+            self.assertEqual(1, len(os.listdir(self.tdir)))
+            fh.close()
+            self.assertEqual([], os.listdir(self.tdir))
+            with self.fs.scratch(self.tdir) as fh:
+                fh.write(b'named')
+                fh.materialize(os.path.join(self.tdir, 'kept'))
+                fh.materialize(os.path.join(self.tdir, 'again'))
+        self.assertEqual(['again', 'kept'], sorted(os.listdir(self.tdir)))
+
+    def test_scratch_no_clobber(self):
+        "Refuse to materialize over an existing file, with or without O_TMPFILE"
+        target = os.path.join(self.tdir, 'taken')
+        with open(target, 'w') as fh:
+            fh.write('original')
+        for tmpfile in [filesystem.O_TMPFILE, None]:
+            with patch.object(filesystem, 'O_TMPFILE', tmpfile):
+                with self.fs.scratch(self.tdir) as fh:
+                    fh.write(b'scratch')
+                    with self.assertRaises(exceptions.ExistsError):
+                        fh.materialize(target)
+        with open(target) as fh:
+            self.assertEqual('original', fh.read())
+        self.assertEqual(['taken'], os.listdir(self.tdir))
+
+    def test_borrow_tempdir(self):
+        "Lend out empty directories, recycling those handed back"
+        pool = filesystem.TempdirPool(size=1)
+        with patch.object(filesystem, '_tempdirs', pool):
+            first = self.fs.borrow_tempdir()
+            second = self.fs.borrow_tempdir()
+            with open(os.path.join(first, 'file'), 'w') as fh:
+                fh.write('hello')
+            os.mkdir(os.path.join(first, 'sub'))
+            self.fs.return_tempdir(first)
+            self.fs.return_tempdir(second)
+            self.assertFalse(os.path.exists(first))
+            pool.join()
+            self.assertEqual(1, len(pool._ready))
+            third = self.fs.borrow_tempdir()
+            self.assertNotIn(third, (first, second))
+            self.assertEqual([], os.listdir(third))
+            self.assertEqual(1, len(os.listdir(pool._root)))
+            self.fs.return_tempdir(self.tdir) # Not one of ours: removed outright
+            self.assertFalse(os.path.exists(self.tdir))
+            os.mkdir(self.tdir)
+            pool.close()
+            self.assertFalse(os.path.exists(third))
+
+    def test_logical_cwd(self):
+        "Resolve relative paths against the logical working directory"
+        startdir = os.getcwd()
+        with nix.cd(self.tdir, logical=True):
+            self.fs.mkdir('sub')
+            self.fs.touch('sub/file')
+            with self.fs.open('sub/file', 'w') as fh:
+                fh.write('hello')
+            self.assertEqual(True, self.fs.is_branch('sub'))
+            self.assertEqual(True, self.fs.is_leaf('sub/file'))
+            self.assertEqual(['file'], self.fs.ls('sub'))
+            self.assertEqual(5, self.fs.stat('sub/file').st_size)
+            self.assertEqual([True, False], self.fs.exists_many(['sub/file', 'sub/nope']))
+            self.assertEqual(os.path.join(self.tdir, 'sub'), self.fs.abspath('sub'))
+            self.fs.mv('sub/file', 'sub/moved')
+            self.fs.rm('sub/moved')
+            self.assertEqual(False, self.fs.exists('sub/moved'))
+        self.assertEqual(startdir, os.getcwd())
+        self.assertTrue(os.path.isdir(os.path.join(self.tdir, 'sub')))
+
     def test_getwd(self):
         "Should be the curdir"
         self.assertEqual(os.getcwd(), self.fs.getwd())
@@ -250,6 +385,11 @@ class DiskFilesystemTestCase(unittest.TestCase):
                 po.assert_called_with(self.tfile, 'wb')
                 pe.assert_called_with(self.tfile)
 
+    def test_atomic_open(self):
+        "Atomically replace it"
+        with patch('ffs.writers.atomic_open') as pao:
+            self.fs.atomic_open('foo', 'wb', fsync=True)
+            pao.assert_called_with('foo', 'wb', fsync=True)
 
     def test_expanduser(self):
         "Expand ~"
@@ -343,6 +483,51 @@ class DiskFilesystemTestCase(unittest.TestCase):
         self.fs.rm(self.tfile)
         self.assertFalse(os.path.exists(self.tfile))
 
+    def test_stat(self):
+        "Stat a file"
+        self.assertEqual(os.stat(self.tfile), self.fs.stat(self.tfile))
+
+    def test_stat_many(self):
+        "Stat many files, with one descriptor per directory"
+        names = [os.path.join(self.tdir, str(i)) for i in range(20)]
+        for name in names[:10]:
+            nix.touch(name)
+        stats = self.fs.stat_many(names + [self.tfile, self.tdir + os.sep])
+        self.assertEqual([os.stat(n) for n in names[:10]], stats[:10])
+        self.assertEqual([None] * 10, stats[10:20])
+        self.assertEqual([os.stat(self.tfile), os.stat(self.tdir)], stats[20:])
+
+    def test_classify_many(self):
+        "Classify many paths, in the same order"
+        names = [os.path.join(self.tdir, str(i)) for i in range(40)]
+        for name in names[:10]:
+            nix.touch(name)
+        os.mkdir(names[10])
+        os.symlink(names[0], names[11])
+        os.symlink(names[39], names[12])
+        os.mkfifo(names[13])
+        for scandir in True, False:
+            with patch.object(filesystem, 'SCANDIR_THRESHOLD', 1 if scandir else 1000):
+                kinds = self.fs.classify_many(names + [self.tfile, self.tdir])
+                self.assertEqual([filesystem.LEAF] * 10, kinds[:10])
+                self.assertEqual([filesystem.BRANCH, filesystem.LEAF, None, filesystem.OTHER],
+                                 kinds[10:14])
+                self.assertEqual([None] * 26, kinds[14:40])
+                self.assertEqual([filesystem.LEAF, filesystem.BRANCH], kinds[40:])
+
+    def test_classify_many_dots(self):
+        "Dot entries exist, though a directory listing never holds them"
+        names = [os.path.join(self.tdir, str(i)) for i in range(20)]
+        dots = [os.path.join(self.tdir, '.'), os.path.join(self.tdir, '..')]
+        with patch.object(filesystem, 'SCANDIR_THRESHOLD', 1):
+            self.assertEqual([filesystem.BRANCH] * 2, self.fs.classify_many(names + dots)[20:])
+        self.assertEqual([True], self.fs.exists_many(dots[:1]))
+
+    def test_exists_many(self):
+        "Check many paths at once"
+        self.assertEqual([True, False, True],
+                         self.fs.exists_many([self.tfile, tempfile.mktemp(), self.tdir]))
+
     # def test_ln(self):
     #     "Link it"
     #     with patch('ffs.nix.ln') as pln:
@@ -350,6 +535,705 @@ class DiskFilesystemTestCase(unittest.TestCase):
     #         pln.assert_called_with('foo', 'bar', symbolic=False)
 
 
+@unittest.skipUnless(filesystem.DIR_FD, 'No dir_fd support')
+class DirFDFilesystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.fs = filesystem.DirFDFilesystem(maxfds=2)
+        self.sub = os.path.join(self.tdir, 'sub')
+        os.mkdir(self.sub)
+
+    def tearDown(self):
+        self.fs.invalidate()
+        self.fs._fds()
+        nix.rm_r(self.tdir)
+
+    def test_reuses_directories(self):
+        "Open each directory once"
+        path = os.path.join(self.sub, 'file')
+        with patch('os.open', wraps=os.open) as pos:
+            self.fs.touch(path)
+            self.assertEqual(True, self.fs.exists(path))
+            self.assertEqual(True, self.fs.is_leaf(path))
+            self.assertEqual(False, self.fs.is_branch(path))
+            self.assertEqual(0, self.fs.stat(path).st_size)
+        self.assertEqual([self.sub, 'file'], [c[0][0] for c in pos.call_args_list])
+
+    def test_lru(self):
+        "Keep at most MAXFDS directories open"
+        for name in 'abc':
+            os.mkdir(os.path.join(self.tdir, name))
+            self.fs.touch(os.path.join(self.tdir, name, 'file'))
+        fds = self.fs._fds()
+        self.assertEqual([os.path.join(self.tdir, n) for n in 'bc'], list(fds))
+
+    def test_operations(self):
+        "Read, write, list and remove beneath a directory"
+        path = os.path.join(self.sub, 'file')
+        with self.fs.open(path, 'w') as fh:
+            fh.write('hello')
+        self.assertEqual(0, stat.S_IMODE(os.stat(path).st_mode) & 0o111)
+        with self.fs.open(path) as fh:
+            self.assertEqual('hello', fh.read())
+        self.fs.mkdir(os.path.join(self.sub, 'deeper'))
+        self.fs.touch(os.path.join(self.sub, '.hidden'))
+        self.assertEqual(['deeper', 'file'], sorted(self.fs.ls(self.sub)))
+        self.assertEqual(['.', '..', '.hidden', 'deeper', 'file'],
+                         sorted(self.fs.ls(self.sub, all=True)))
+        with self.assertRaises(OSError):
+            self.fs.mkdir(os.path.join(self.sub, 'deeper'))
+        with self.assertRaises(exceptions.BadParentingError):
+            self.fs.mkdir(os.path.join(self.sub, 'no', 'such'))
+        self.fs.rm(path)
+        self.assertEqual(False, os.path.exists(path))
+        with self.assertRaises(exceptions.DoesNotExistError):
+            self.fs.rm(path)
+
+    def test_mv_branch(self):
+        "Moving a directory through us forgets where it was"
+        self.fs.touch(os.path.join(self.sub, 'file'))
+        moved = os.path.join(self.tdir, 'moved')
+        self.fs.mv(self.sub, moved)
+        os.mkdir(self.sub)
+        self.assertEqual(False, self.fs.exists(os.path.join(self.sub, 'file')))
+        self.assertEqual(True, self.fs.exists(os.path.join(moved, 'file')))
+
+@unittest.skipUnless(hasattr(os, 'pread'), 'No os.pread')
+class FDCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.fs = filesystem.DiskFilesystem()
+        self.names = [os.path.join(self.tdir, 'file{0}'.format(i)) for i in range(3)]
+        for i, name in enumerate(self.names):
+            with open(name, 'w') as fh:
+                fh.write('line {0}\nsecond\n'.format(i))
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def is_open(self, fd):
+        try:
+            os.fstat(fd)
+        except OSError:
+            return False
+        return True
+
+    def test_reuses_descriptors(self):
+        "Open each file once, however often we read it"
+        with filesystem.fdcache() as cache:
+            with patch('os.open', wraps=os.open) as pos:
+                for _ in range(3):
+                    with self.fs.open(self.names[0]) as fh:
+                        self.assertEqual('line 0\n', fh.readline())
+                        self.assertEqual(['second\n'], list(fh))
+                    with self.fs.open(self.names[0], 'rb') as fh:
+                        self.assertEqual(b'line 0\nsecond\n', fh.read())
+                self.assertEqual(1, pos.call_count)
+            self.assertEqual((5, 1), (cache.hits, cache.misses))
+            self.assertIs(cache, filesystem._fdcache)
+        self.assertIs(None, filesystem._fdcache)
+
+    def test_bound(self):
+        "Close the least recently used, but not while it's in use"
+        with filesystem.fdcache(max=2) as cache:
+            first = self.fs.open(self.names[0], 'rb')
+            fd = first.fileno()
+            self.fs.open(self.names[1], 'rb').close()
+            self.fs.open(self.names[2], 'rb').close()
+            self.assertEqual(2, len(cache))
+            self.assertTrue(self.is_open(fd))
+            self.assertEqual(b'line 0\nsecond\n', first.read())
+            first.close()
+            self.assertFalse(self.is_open(fd))
+            with self.fs.open(self.names[2], 'rb') as fh:
+                fd = fh.fileno()
+        self.assertFalse(self.is_open(fd))
+
+    def test_invalidate(self):
+        "Renames, removals and atomic writes through ffs drop descriptors"
+        with filesystem.fdcache():
+            with self.fs.open(self.names[0]) as fh:
+                fh.read()
+            self.fs.mv(self.names[1], self.names[0])
+            with self.fs.open(self.names[0]) as fh:
+                self.assertEqual('line 1\n', fh.readline())
+            with self.fs.atomic_open(self.names[0]) as fh:
+                fh.write('replaced')
+            with self.fs.open(self.names[0]) as fh:
+                self.assertEqual('replaced', fh.read())
+            self.fs.rm(self.names[0])
+            with self.assertRaises(IOError):
+                self.fs.open(self.names[0])
+            with self.fs.open(self.names[2]) as fh:
+                fd = fh.fileno()
+            self.fs.rm(self.tdir, recursive=True)
+            self.assertFalse(self.is_open(fd))
+        os.mkdir(self.tdir)
+
+    def test_invalidated_while_opening(self):
+        "A descriptor opened across an invalidate() isn't kept"
+        with filesystem.fdcache() as cache:
+            real_open = os.open
+            def racing_open(path, *args):
+                fd = real_open(path, *args)
+                cache.invalidate(path)
+                return fd
+            with patch.object(filesystem.os, 'open', side_effect=racing_open):
+                with self.fs.open(self.names[0], 'rb') as fh:
+                    fd = fh.fileno()
+                    self.assertEqual(b'line 0\n', fh.readline())
+            self.assertEqual(0, len(cache))
+            self.assertFalse(self.is_open(fd))
+
+    def test_append_and_positional(self):
+        "Append through cached descriptors, and pread/pwrite at an offset"
+        with filesystem.fdcache() as cache:
+            for i in range(3):
+                with self.fs.open(self.names[0], 'a') as fh:
+                    fh.write('more {0}\n'.format(i))
+            self.assertEqual(1, cache.misses)
+            self.assertEqual(b'second', cache.pread(self.names[0], 6, 7))
+            self.assertEqual(4, cache.pwrite(self.names[0], b'LINE', 0))
+            with self.fs.open(self.names[0]) as fh:
+                self.assertEqual('LINE 0\nsecond\nmore 0\nmore 1\nmore 2\n', fh.read())
+            with self.assertRaises(exceptions.InappropriateError):
+                cache.open(self.names[0], 'w')
+            with self.fs.open(self.names[1], 'w') as fh: # Not cached
+                fh.write('truncated')
+            self.assertEqual(b'truncated', cache.pread(self.names[1], 100, 0))
+
+
+class CachingFilesystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.wrapped = MagicMock(name='wrapped')
+        self.wrapped.sep = '/'
+        self.wrapped.exists.side_effect = lambda r: not r.endswith('nope')
+        self.wrapped.stat.side_effect = OSError(2, 'No such file')
+        self.wrapped.ls.return_value = ['a', 'b']
+        self.wrapped.abspath.side_effect = str
+        self.fs = filesystem.CachingFilesystem(self.wrapped)
+
+    def test_relative_after_cd(self):
+        "Relative answers belong to the directory they were asked in"
+        memory = filesystem.MemoryFilesystem(shared=False)
+        memory.mkdir('/a/foo', parents=True)
+        memory.mkdir('/b')
+        self.fs = filesystem.CachingFilesystem(memory)
+        self.fs.cd('/a')
+        self.assertEqual(True, self.fs.exists('foo'))
+        self.fs.cd('/b')
+        self.assertEqual(False, self.fs.exists('foo'))
+        self.assertEqual(True, self.fs.exists('/a/foo'))
+
+    def test_caches(self):
+        "Ask the wrapped filesystem once"
+        for _ in range(3):
+            self.assertEqual(True, self.fs.exists('/foo/bar'))
+            self.assertEqual(['a', 'b'], self.fs.ls('/foo/', all=True))
+            self.fs.is_branch('/foo')
+            self.fs.is_leaf('/foo')
+        self.wrapped.exists.assert_called_once_with('/foo/bar')
+        self.wrapped.ls.assert_called_once_with('/foo/', all=True)
+        self.assertEqual(1, self.wrapped.is_branch.call_count)
+        self.assertEqual(1, self.wrapped.is_leaf.call_count)
+
+    def test_ls_returns_copies(self):
+        "Callers can't change our cached listings"
+        self.fs.ls('/foo').append('c')
+        self.assertEqual(['a', 'b'], self.fs.ls('/foo'))
+
+    def test_negative(self):
+        "Remember things that aren't there, and errors"
+        for _ in range(2):
+            self.assertEqual(False, self.fs.exists('/nope'))
+            with self.assertRaises(OSError):
+                self.fs.stat('/nope')
+        self.assertEqual(1, self.wrapped.exists.call_count)
+        self.assertEqual(1, self.wrapped.stat.call_count)
+
+    def test_no_negative(self):
+        "Optionally, don't"
+        self.fs = filesystem.CachingFilesystem(self.wrapped, negative=False)
+        for _ in range(2):
+            self.assertEqual(False, self.fs.exists('/nope'))
+            with self.assertRaises(OSError):
+                self.fs.stat('/nope')
+        self.assertEqual(2, self.wrapped.exists.call_count)
+        self.assertEqual(2, self.wrapped.stat.call_count)
+
+    def test_ttl(self):
+        "Forget answers after the TTL"
+        self.fs = filesystem.CachingFilesystem(self.wrapped, ttl=10)
+        with patch.object(filesystem.time, 'time') as ptime:
+            ptime.return_value = 100
+            self.fs.exists('/foo')
+            ptime.return_value = 109
+            self.fs.exists('/foo')
+            self.assertEqual(1, self.wrapped.exists.call_count)
+            ptime.return_value = 111
+            self.fs.exists('/foo')
+            self.assertEqual(2, self.wrapped.exists.call_count)
+
+    def test_lru(self):
+        "Drop the least recently used paths"
+        self.fs = filesystem.CachingFilesystem(self.wrapped, maxsize=2)
+        self.fs.exists('/one')
+        self.fs.exists('/two')
+        self.fs.exists('/one')
+        self.fs.exists('/three')
+        self.assertEqual(['/one', '/three'], list(self.fs._cache))
+
+    def test_mutations_invalidate(self):
+        "Mutating calls forget the paths they touch"
+        self.fs.exists('/foo/bar/baz')
+        self.fs.ls('/foo/bar')
+        self.fs.exists('/other')
+        self.fs.touch('/foo/bar/baz')
+        self.wrapped.touch.assert_called_once_with('/foo/bar/baz')
+        self.assertEqual(['/other'], list(self.fs._cache))
+
+        self.fs.exists('/foo/bar/baz')
+        self.fs.open('/foo/bar/baz')
+        self.assertIn('/foo/bar/baz', self.fs._cache)
+        self.fs.open('/foo/bar/baz', 'a')
+        self.assertNotIn('/foo/bar/baz', self.fs._cache)
+
+    def test_tree_invalidate(self):
+        "Calls that move trees forget everything below"
+        for path in ['/foo/bar/baz', '/foo/barry', '/foo', '/elsewhere/x']:
+            self.fs.exists(path)
+        self.fs.mv('/foo/bar', '/elsewhere/y')
+        self.assertEqual(['/foo/barry', '/elsewhere/x'], list(self.fs._cache))
+        self.fs.rm('/', recursive=True)
+        self.assertEqual([], list(self.fs._cache))
+
+    def test_delegates(self):
+        "Everything else goes straight through"
+        self.fs.cp('/a', '/b', recursive=True)
+        self.wrapped.cp.assert_called_once_with('/a', '/b', recursive=True)
+        self.assertEqual(self.wrapped.getwd.return_value, self.fs.getwd())
+        self.assertEqual('a', self.fs.abspath('a'))
+        self.assertEqual('/', self.fs.sep)
+
+class MemoryFilesystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fs = filesystem.MemoryFilesystem(shared=False)
+        self.fs.mkdir('/data/sub', parents=True)
+        with self.fs.open('/data/file.txt', 'w') as fh:
+            fh.write('hello\n')
+
+    def test_shared(self):
+        "Instances share one tree unless asked not to"
+        shared = filesystem.MemoryFilesystem()
+        shared.touch('/shared-marker')
+        try:
+            self.assertTrue(filesystem.MemoryFilesystem().exists('/shared-marker'))
+            self.assertFalse(self.fs.exists('/shared-marker'))
+        finally:
+            shared.rm('/shared-marker')
+
+    def test_predicates(self):
+        "Exists, branches and leaves"
+        self.assertEqual(True, self.fs.exists('/data/file.txt'))
+        self.assertEqual(False, self.fs.exists('/data/nope'))
+        self.assertEqual(False, self.fs.exists('/data/file.txt/nope'))
+        self.assertEqual(True, self.fs.is_branch('/data/sub'))
+        self.assertEqual(False, self.fs.is_branch('/data/file.txt'))
+        self.assertEqual(True, self.fs.is_leaf('/data/file.txt'))
+        self.assertEqual(False, self.fs.is_leaf('/data/sub'))
+
+    def test_ls(self):
+        "List a branch"
+        self.fs.touch('/data/.hidden')
+        self.assertEqual(['file.txt', 'sub'], sorted(self.fs.ls('/data')))
+        self.assertEqual(['.', '..', '.hidden', 'file.txt', 'sub'],
+                         sorted(self.fs.ls('/data', all=True)))
+        with self.assertRaises(OSError):
+            self.fs.ls('/data/file.txt')
+
+    def test_cd(self):
+        "Relative paths follow the working directory"
+        self.assertEqual('/', self.fs.getwd())
+        with self.fs.cd('/data'):
+            self.assertEqual('/data', self.fs.getwd())
+            self.assertEqual(True, self.fs.is_leaf('file.txt'))
+            self.assertEqual('/data/sub', self.fs.abspath('sub/../sub'))
+        self.assertEqual('/', self.fs.getwd())
+        self.fs.cd('data/sub')
+        self.assertEqual('/data/sub', self.fs.getwd())
+        with self.assertRaises(OSError):
+            self.fs.cd('/data/file.txt')
+
+    def test_open_modes(self):
+        "Read, write, append, text and bytes"
+        with self.fs.open('/data/file.txt', 'a') as fh:
+            fh.write('again\n')
+        with self.fs.open('/data/file.txt') as fh:
+            self.assertEqual('hello\nagain\n', fh.read())
+        with self.fs.open('/data/file.txt', 'wb') as fh:
+            fh.write(b'\x00bytes')
+        with self.fs.open('/data/file.txt', 'rb') as fh:
+            self.assertEqual(b'\x00bytes', fh.read())
+            with self.assertRaises(io.UnsupportedOperation):
+                fh.write(b'nope')
+        with self.assertRaises(OSError):
+            self.fs.open('/data/nope')
+        with self.assertRaises(OSError):
+            self.fs.open('/nope/file', 'w')
+        with self.assertRaises(OSError):
+            self.fs.open('/data/sub', 'w')
+
+    def test_concurrent_appends(self):
+        "Appends from several open handles all land"
+        first = self.fs.open('/data/file.txt', 'ab')
+        second = self.fs.open('/data/file.txt', 'ab')
+        first.write(b'A')
+        first.flush()
+        second.write(b'B')
+        second.close()
+        first.write(b'C')
+        first.close()
+        self.assertEqual('hello\nABC', self.fs.open('/data/file.txt').read())
+
+    def test_atomic_open(self):
+        "Contents only change when the block succeeds"
+        with self.assertRaises(ValueError):
+            with self.fs.atomic_open('/data/file.txt') as fh:
+                fh.write('partial')
+                raise ValueError()
+        self.assertEqual('hello\n', self.fs.open('/data/file.txt').read())
+        with self.fs.atomic_open('/data/file.txt') as fh:
+            fh.write('replaced')
+        self.assertEqual('replaced', self.fs.open('/data/file.txt').read())
+
+    def test_mkdir(self):
+        "Make branches"
+        with self.assertRaises(exceptions.BadParentingError):
+            self.fs.mkdir('/a/b')
+        with self.assertRaises(OSError):
+            self.fs.mkdir('/data')
+        self.fs.mkdir('/data', parents=True)
+        self.fs.mkdir('/a/b', parents=True)
+        self.assertEqual(True, self.fs.is_branch('/a/b'))
+
+    def test_cp(self):
+        "Copies are independent"
+        self.fs.cp('/data', '/copy', recursive=True)
+        with self.fs.open('/copy/file.txt', 'w') as fh:
+            fh.write('changed')
+        self.assertEqual('hello\n', self.fs.open('/data/file.txt').read())
+        self.assertEqual(True, self.fs.is_branch('/copy/sub'))
+        self.fs.cp('/data', '/noop')
+        self.assertEqual(False, self.fs.exists('/noop'))
+        with self.assertRaises(exceptions.ExistsError):
+            self.fs.cp('/data/file.txt', '/copy/file.txt')
+        with self.assertRaises(exceptions.DoesNotExistError):
+            self.fs.cp('/nope', '/copy/nope')
+
+    def test_ln(self):
+        "Hard links share contents"
+        self.fs.ln('/data/file.txt', '/data/linked')
+        with self.fs.open('/data/linked', 'a') as fh:
+            fh.write('linked\n')
+        self.assertEqual('hello\nlinked\n', self.fs.open('/data/file.txt').read())
+        with self.assertRaises(exceptions.NotSupportedError):
+            self.fs.ln('/data/file.txt', '/data/symlink', symbolic=True)
+
+    def test_mv(self):
+        "Rename, or move into a branch"
+        self.fs.mv('/data/file.txt', '/data/renamed.txt')
+        self.fs.mv('/data/renamed.txt', '/data/sub')
+        self.assertEqual(['renamed.txt'], self.fs.ls('/data/sub'))
+        self.assertEqual(['sub'], self.fs.ls('/data'))
+        with self.assertRaises(OSError):
+            self.fs.mv('/data/nope', '/data/sub')
+        with self.assertRaises(OSError):
+            self.fs.mv('/data', '/data/sub/data')
+        self.assertEqual(True, self.fs.is_branch('/data/sub'))
+
+    def test_touch_stat(self):
+        "Touch creates, stat reports"
+        self.fs.touch('/data/new')
+        st = self.fs.stat('/data/file.txt')
+        self.assertEqual(6, st.st_size)
+        self.assertTrue(stat.S_ISREG(st.st_mode))
+        self.assertTrue(stat.S_ISDIR(self.fs.stat('/data').st_mode))
+        with self.assertRaises(OSError):
+            self.fs.stat('/nope')
+
+    def test_temp(self):
+        "Temporary files and directories live in our /tmp"
+        tfile, tdir = self.fs.tempfile(), self.fs.tempdir()
+        self.assertTrue(tfile.startswith('/tmp/'))
+        self.assertEqual(True, self.fs.is_leaf(tfile))
+        self.assertEqual(True, self.fs.is_branch(tdir))
+
+    def test_rm(self):
+        "Remove leaves, and with recursive, branches"
+        self.fs.rm('/data/file.txt')
+        self.assertEqual(False, self.fs.exists('/data/file.txt'))
+        with self.assertRaises(exceptions.DoesNotExistError):
+            self.fs.rm('/data/file.txt')
+        with self.assertRaises(OSError):
+            self.fs.rm('/data')
+        self.fs.rm('/data', recursive=True)
+        self.assertEqual([], self.fs.ls('/'))
+
+    def test_dump_to(self):
+        "Materialize the tree on disk"
+        tdir = tempfile.mkdtemp()
+        try:
+            self.fs.dump_to(tdir, '/data')
+            self.assertTrue(os.path.isdir(os.path.join(tdir, 'sub')))
+            with open(os.path.join(tdir, 'file.txt')) as fh:
+                self.assertEqual('hello\n', fh.read())
+        finally:
+            nix.rm_r(tdir)
+
+class OverlayFilesystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.lower = filesystem.DiskFilesystem()
+        self.upper = filesystem.MemoryFilesystem(shared=False)
+        self.fs = filesystem.OverlayFilesystem(self.lower, self.upper)
+        os.makedirs(os.path.join(self.tdir, 'release', 'docs'))
+        for name, contents in [('release/app.py', 'app\n'),
+                               ('release/docs/index.txt', 'index\n')]:
+            with open(os.path.join(self.tdir, name), 'w') as fh:
+                fh.write(contents)
+        self.release = os.path.join(self.tdir, 'release')
+        self.app = os.path.join(self.release, 'app.py')
+        self.docs = os.path.join(self.release, 'docs')
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def read(self, path):
+        with open(path) as fh:
+            return fh.read()
+
+    def test_reads_fall_through(self):
+        "Reading copies nothing up"
+        self.assertEqual(True, self.fs.is_leaf(self.app))
+        self.assertEqual(['app.py', 'docs'], sorted(self.fs.ls(self.release)))
+        with self.fs.open(self.app) as fh:
+            self.assertEqual('app\n', fh.read())
+        self.assertEqual(os.stat(self.app).st_size, self.fs.stat(self.app).st_size)
+        self.assertEqual(False, self.upper.exists(self.tdir))
+
+    def test_copy_up(self):
+        "Writes copy up just the file they touch"
+        with self.fs.open(self.app, 'a') as fh:
+            fh.write('more\n')
+        with self.fs.open(self.app) as fh:
+            self.assertEqual('app\nmore\n', fh.read())
+        self.assertEqual('app\n', self.read(self.app))
+        self.assertEqual(['app.py'], self.upper.ls(self.release))
+        self.assertEqual(['app.py', 'docs'], sorted(self.fs.ls(self.release)))
+        self.assertEqual(False, self.upper.exists(self.docs))
+
+    def test_whiteout(self):
+        "Removals hide paths without touching the lower filesystem"
+        self.fs.rm(self.docs, recursive=True)
+        self.assertEqual(False, self.fs.exists(self.docs))
+        self.assertEqual(False, self.fs.exists(os.path.join(self.docs, 'index.txt')))
+        self.assertEqual(['app.py'], self.fs.ls(self.release))
+        self.assertTrue(os.path.isdir(self.docs))
+        with self.assertRaises(OSError):
+            self.fs.stat(self.docs)
+        with self.assertRaises(exceptions.DoesNotExistError):
+            self.fs.rm(self.docs)
+
+    def test_remade(self):
+        "A branch made again after removal starts empty"
+        self.fs.rm(self.docs, recursive=True)
+        self.fs.mkdir(self.docs)
+        self.assertEqual([], self.fs.ls(self.docs))
+        self.fs.touch(os.path.join(self.docs, 'new.txt'))
+        self.assertEqual(['new.txt'], self.fs.ls(self.docs))
+
+    def test_mkdir(self):
+        "Make branches in the upper filesystem"
+        with self.assertRaises(exceptions.BadParentingError):
+            self.fs.mkdir(os.path.join(self.release, 'a', 'b'))
+        self.fs.mkdir(os.path.join(self.release, 'a', 'b'), parents=True)
+        self.assertEqual(True, self.fs.is_branch(os.path.join(self.release, 'a', 'b')))
+        with self.assertRaises(OSError):
+            self.fs.mkdir(self.docs)
+        self.assertFalse(os.path.exists(os.path.join(self.release, 'a')))
+
+    def test_cp_mv(self):
+        "Copies and moves stay in the overlay"
+        copied = os.path.join(self.release, 'copied')
+        self.fs.cp(self.docs, copied, recursive=True)
+        self.fs.mv(self.app, self.docs)
+        self.assertEqual(['copied', 'docs'], sorted(self.fs.ls(self.release)))
+        self.assertEqual(['app.py', 'index.txt'], sorted(self.fs.ls(self.docs)))
+        self.assertEqual(['index.txt'], self.fs.ls(copied))
+        moved = os.path.join(self.release, 'moved')
+        self.fs.mv(copied, moved)
+        self.assertEqual(['index.txt'], self.fs.ls(moved))
+        self.assertEqual(['app.py', 'docs'], sorted(os.listdir(self.release)))
+
+    def test_commit(self):
+        "Apply only the changes"
+        with self.fs.open(self.app, 'w') as fh:
+            fh.write('new app\n')
+        self.fs.rm(os.path.join(self.docs, 'index.txt'))
+        self.fs.mkdir(os.path.join(self.release, 'bin'))
+        self.fs.touch(os.path.join(self.release, 'bin', 'run'))
+        untouched = os.stat(self.docs).st_ino
+        changes = self.fs.changes()
+        self.assertEqual([os.path.join(self.docs, 'index.txt')], changes.removed)
+        self.assertIn(self.app, changes.written)
+        self.assertNotIn(self.docs, changes.written)
+        self.fs.commit()
+        self.assertEqual('new app\n', self.read(self.app))
+        self.assertEqual([], os.listdir(self.docs))
+        self.assertTrue(os.path.isfile(os.path.join(self.release, 'bin', 'run')))
+        self.assertEqual(untouched, os.stat(self.docs).st_ino)
+        self.assertEqual(([], []), self.fs.changes())
+        self.assertEqual(False, self.upper.exists(self.tdir))
+
+    def test_commit_replaced(self):
+        "A branch replaced by a leaf"
+        self.fs.rm(self.docs, recursive=True)
+        with self.fs.open(self.docs, 'w') as fh:
+            fh.write('flat\n')
+        self.fs.commit()
+        self.assertEqual('flat\n', self.read(self.docs))
+
+    def test_discard(self):
+        "Throw the changes away"
+        with self.fs.open(self.app, 'w') as fh:
+            fh.write('new app\n')
+        self.fs.rm(self.docs, recursive=True)
+        self.fs.discard()
+        self.assertEqual(True, self.fs.exists(self.docs))
+        with self.fs.open(self.app) as fh:
+            self.assertEqual('app\n', fh.read())
+        self.assertEqual('app\n', self.read(self.app))
+
+    def test_disk_upper(self):
+        "Stage on disk below UPPER_ROOT"
+        staging = os.path.join(self.tdir, 'staging')
+        os.mkdir(staging)
+        self.fs = filesystem.OverlayFilesystem(self.lower, filesystem.DiskFilesystem(),
+                                               upper_root=staging)
+        with self.fs.atomic_open(self.app) as fh:
+            fh.write('staged\n')
+        self.assertEqual('staged\n', self.read(staging + self.app))
+        self.assertEqual('app\n', self.read(self.app))
+        self.fs.commit()
+        self.assertEqual('staged\n', self.read(self.app))
+        self.assertEqual([], os.listdir(staging))
+
+    def test_disk_upper_symlinks(self):
+        "Commit symlinks as symlinks, dangling or not"
+        staging = os.path.join(self.tdir, 'staging')
+        os.mkdir(staging)
+        self.fs = filesystem.OverlayFilesystem(self.lower, filesystem.DiskFilesystem(),
+                                               upper_root=staging)
+        link = os.path.join(self.release, 'link')
+        dangling = os.path.join(self.release, 'dangling')
+        self.fs.ln('app.py', link, symbolic=True)
+        self.fs.ln('missing', dangling, symbolic=True)
+        self.fs.commit()
+        self.assertEqual('app.py', os.readlink(link))
+        self.assertEqual('missing', os.readlink(dangling))
+        self.assertEqual('app\n', self.read(link))
+        self.assertEqual([], os.listdir(staging))
+
+    def test_disk_upper_needs_root(self):
+        "Refuse a disk UPPER that would be LOWER itself"
+        with self.assertRaises(ValueError):
+            filesystem.OverlayFilesystem(self.lower, filesystem.DiskFilesystem())
+        self.assertEqual('app\n', self.read(self.app))
+
+class InstrumentedFilesystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stats = filesystem.FilesystemStats()
+        self.wrapped = filesystem.MemoryFilesystem(shared=False)
+        self.fs = filesystem.InstrumentedFilesystem(self.wrapped, stats=self.stats)
+
+    def test_bucket(self):
+        "Log-linear buckets"
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6, 7, 8, 8, 10, 12, 12, 1792],
+                         [filesystem._bucket(v) for v in
+                          (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 12, 13, 1800)])
+
+    def test_counts(self):
+        "Count calls and their latencies per flavour and method"
+        self.fs.mkdir('/data')
+        for _ in range(3):
+            self.assertEqual(True, self.fs.exists('/data'))
+        ops = self.stats.snapshot()['MemoryFilesystem']
+        self.assertEqual(['exists', 'mkdir'], sorted(ops))
+        self.assertEqual(3, ops['exists']['count'])
+        self.assertEqual(0, ops['exists']['errors'])
+        self.assertEqual(3, sum(ops['exists']['histogram'].values()))
+        self.assertEqual(ops['exists']['total_ns'] >= 0, True)
+
+    def test_errors(self):
+        "Count errors and let them through"
+        with self.assertRaises(OSError):
+            self.fs.stat('/nope')
+        op = self.stats.snapshot()['MemoryFilesystem']['stat']
+        self.assertEqual((1, 1), (op['count'], op['errors']))
+
+    def test_bytes(self):
+        "Count data through the files we open"
+        with self.fs.open('/file', 'wb') as fh:
+            fh.write(b'hello')
+        with self.fs.open('/file', 'rb') as fh:
+            self.assertEqual(b'hel', fh.read(3))
+            self.assertEqual([b'lo'], list(fh))
+        with self.fs.atomic_open('/atomic', 'wb') as fh:
+            fh.write(b'abc')
+        self.assertEqual(b'abc', self.wrapped.open('/atomic', 'rb').read())
+        ops = self.stats.snapshot()['MemoryFilesystem']
+        self.assertEqual((5, 5), (ops['open']['bytes_read'], ops['open']['bytes_written']))
+        self.assertEqual(3, ops['atomic_open']['bytes_written'])
+        self.assertEqual(1, ops['atomic_open']['count'])
+
+    def test_disabled(self):
+        "Record nothing while disabled"
+        self.stats.enabled = False
+        self.fs.touch('/file')
+        with self.fs.open('/file') as fh:
+            fh.read()
+        self.assertEqual({}, self.stats.snapshot())
+        self.assertEqual(True, self.wrapped.exists('/file'))
+
+    def test_snapshot_is_a_copy(self):
+        "Snapshots don't change under us"
+        self.fs.exists('/')
+        snapshot = self.stats.snapshot()
+        self.fs.exists('/')
+        self.assertEqual(1, snapshot['MemoryFilesystem']['exists']['count'])
+        self.stats.reset()
+        self.assertEqual({}, self.stats.snapshot())
+
+    def test_dump(self):
+        "Append snapshots as JSON Lines"
+        tdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tdir, 'stats.jsonl')
+            self.fs.exists('/')
+            self.stats.dump(path)
+            self.stats.dump(path)
+            with open(path) as fh:
+                lines = [json.loads(line) for line in fh]
+            self.assertEqual(2, len(lines))
+            self.assertEqual(1, lines[1]['stats']['MemoryFilesystem']['exists']['count'])
+            self.stats.start_dumping(path, interval=0.01)
+            time.sleep(0.1)
+            self.stats.stop_dumping()
+            with open(path) as fh:
+                self.assertTrue(len(fh.readlines()) > 2)
+        finally:
+            nix.rm_r(tdir)
+
 if __name__ == '__main__':
     unittest.main()
 
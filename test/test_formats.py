@@ -3,6 +3,7 @@ Unittests for the ffs.formats module
 """
 import collections
 import csv
+import json
 import sys
 import tempfile
 import unittest
@@ -231,5 +232,147 @@ class CSVTestCase(unittest.TestCase):
             self.assertEqual('a', row.frist_thing)
             self.assertEqual('b', row.last_one)
 
+
+class IterJsonlTestCase(unittest.TestCase):
+
+    def test_records(self):
+        "One record per line"
+        fh = StringIO('{"a": 1}\n[2]\n"three"\n')
+        self.assertEqual([{'a': 1}, [2], 'three'], list(formats.iter_jsonl(fh)))
+
+    def test_batches(self):
+        "Batch boundaries don't affect the output"
+        fh = StringIO(''.join('{0}\n'.format(i) for i in range(10)))
+        self.assertEqual(list(range(10)), list(formats.iter_jsonl(fh, batch_size=3)))
+
+    def test_blank_lines(self):
+        "Skip blank lines"
+        fh = StringIO('1\n\n  \n2\n')
+        self.assertEqual([1, 2], list(formats.iter_jsonl(fh)))
+
+    def test_bad_line_raises(self):
+        "Raise for a malformed line"
+        fh = StringIO('1\n{"a":\n2\n')
+        with self.assertRaises(ValueError):
+            list(formats.iter_jsonl(fh))
+
+    def test_lines_that_only_decode_together(self):
+        "Don't accept lines that are only valid when batched"
+        fh = StringIO('1,2\n3\n')
+        with self.assertRaises(ValueError):
+            list(formats.iter_jsonl(fh))
+        fh = StringIO('1,2\n[3\n4]\n')
+        with self.assertRaises(ValueError):
+            list(formats.iter_jsonl(fh))
+        fh = StringIO('0\n\n[[1\n2]],[[3\n4]]\n')
+        with self.assertRaises(ValueError):
+            list(formats.iter_jsonl(fh))
+
+    def test_error_line_number(self):
+        "Say which line of the file was bad"
+        fh = StringIO('1\n\n2\n{"a":\n')
+        with self.assertRaises(ValueError) as raised:
+            list(formats.iter_jsonl(fh, batch_size=2))
+        self.assertTrue(str(raised.exception).startswith('Line 4: '))
+
+
+class JsonItemsTestCase(unittest.TestCase):
+
+    def items(self, doc, prefix='item', chunksize=4):
+        return list(formats.json_items(StringIO(doc), prefix=prefix,
+                                       chunksize=chunksize))
+
+    def test_top_level_array(self):
+        "Stream the items of a top-level array"
+        doc = '[1, {"b": [2, 3]}, "four", 123456789, null]'
+        expected = [1, {'b': [2, 3]}, 'four', 123456789, None]
+        self.assertEqual(expected, self.items(doc))
+
+    def test_empty_array(self):
+        "Nothing to yield"
+        self.assertEqual([], self.items('  [ ] '))
+
+    def test_nested_prefix(self):
+        "Stream an array found under object keys"
+        doc = '{"meta": {"skip": [1, 2]}, "data": {"rows": [{"x": 1}, {"x": 2}]}}'
+        self.assertEqual([{'x': 1}, {'x': 2}], self.items(doc, 'data.rows.item'))
+
+    def test_missing_key(self):
+        "Nothing to yield if the prefix isn't there"
+        self.assertEqual([], self.items('{"a": [1]}', 'b.item'))
+
+    def test_whole_document(self):
+        "An empty prefix yields the document"
+        self.assertEqual([{'a': 1}], self.items('{"a": 1}', ''))
+
+    def test_not_an_array(self):
+        "Raise if the prefix doesn't name an array"
+        with self.assertRaises(ValueError):
+            self.items('{"a": 1}')
+        with self.assertRaises(ValueError):
+            self.items('[1]', 'a')
+
+    def test_truncated(self):
+        "Raise on truncated documents"
+        with self.assertRaises(ValueError):
+            self.items('[1, 2, {"a"')
+
+    def test_split_values(self):
+        "Values split across reads"
+        doc = '[true, null, 1.5e10, "a\\u00e9b", -0.25]'
+        for chunksize in range(1, len(doc)):
+            self.assertEqual([True, None, 1.5e10, u'a\u00e9b', -0.25],
+                             self.items(doc, chunksize=chunksize))
+
+    def test_syntax_error(self):
+        "Raise without reading the rest, saying where"
+        fh = StringIO('[1, oops' + ' ' * 1000 + ']')
+        with self.assertRaises(ValueError) as raised:
+            list(formats.json_items(fh, chunksize=16))
+        self.assertIn('offset 4', str(raised.exception))
+        self.assertTrue(fh.tell() < 100)
+
+
+class JsonDumpTestCase(unittest.TestCase):
+
+    def dump(self, obj, **kw):
+        fh = StringIO()
+        formats.json_dump(obj, fh, **kw)
+        return fh.getvalue()
+
+    def test_dump(self):
+        "Serialize like json.dumps"
+        for obj in [{'a': [1, 2]}, [1, 'two', None], 'hai', 3, []]:
+            self.assertEqual(json.dumps(obj), self.dump(obj))
+
+    def test_dump_generator(self):
+        "Stream generators as arrays"
+        self.assertEqual('[0, 1, 2]', self.dump(i for i in range(3)))
+
+    def test_small_buffer(self):
+        "Flush in several writes"
+        fh = MagicMock()
+        formats.json_dump(list(range(100)), fh, buffer_size=10)
+        self.assertTrue(fh.write.call_count > 1)
+        written = ''.join(c[0][0] for c in fh.write.call_args_list)
+        self.assertEqual(list(range(100)), json.loads(written))
+
+    def test_only_streams_sequences(self):
+        "Other iterables are encoded as json.dump would"
+        self.assertEqual(json.dumps('abc'), self.dump('abc'))
+        with self.assertRaises(TypeError):
+            self.dump(set([1]))
+        with self.assertRaises(TypeError):
+            self.dump(iter([1]))
+
+    def test_encoder_kwargs(self):
+        "Pass through encoder arguments"
+        self.assertEqual('[1,2]', self.dump([1, 2], separators=(',', ':')))
+
+    def test_indent(self):
+        "Indent streamed arrays like json.dumps"
+        for obj in [[{'a': 1}, {'b': [2, 'c\nd']}], [], [1]]:
+            self.assertEqual(json.dumps(obj, indent=2), self.dump(obj, indent=2))
+
 if __name__ == '__main__':
     unittest.main()
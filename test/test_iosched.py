@@ -0,0 +1,250 @@
+"""
+Unittests for the ffs.iosched module
+"""
+from __future__ import with_statement
+
+import hashlib
+import io
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+if sys.version_info <  (2, 7):
+    import unittest2 as unittest
+
+from mock import Mock, patch
+
+from ffs import filesystem, iosched, nix, Path
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.slept = []
+        clock = patch.object(iosched, '_clock', lambda: self.now)
+        sleep = patch.object(iosched, '_sleep', self.slept.append)
+        clock.start(); sleep.start()
+        self.addCleanup(clock.stop)
+        self.addCleanup(sleep.stop)
+
+    def test_take(self):
+        "Take what we have for free, then go into debt"
+        bucket = iosched.TokenBucket(10)
+        self.assertEqual(0, bucket.take(10))
+        self.assertEqual(0.5, bucket.take(5))
+        self.assertEqual(1.0, bucket.take(5))
+        self.assertEqual([0.5, 1.0], self.slept)
+
+    def test_refill(self):
+        "Tokens accrue at the rate, up to the capacity"
+        bucket = iosched.TokenBucket(10, capacity=20)
+        bucket.take(20)
+        self.now += 1
+        self.assertEqual(0, bucket.take(10))
+        self.now += 60
+        self.assertEqual(0, bucket.take(20))
+        self.assertEqual(0.1, bucket.take(1))
+
+    def test_bad_rate(self):
+        with self.assertRaises(ValueError):
+            iosched.TokenBucket(0)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        iosched.disable()
+        nix.rm_r(self.tdir)
+
+    def test_priority(self):
+        "Set the priority class for a block"
+        self.assertEqual(iosched.NORMAL, iosched.get_priority())
+        with iosched.priority(iosched.BACKGROUND):
+            self.assertEqual(iosched.BACKGROUND, iosched.get_priority())
+            self.assertEqual(iosched.FOREGROUND, iosched.get_priority(iosched.FOREGROUND))
+        self.assertEqual(iosched.NORMAL, iosched.get_priority())
+        with self.assertRaises(ValueError):
+            with iosched.priority(7):
+                pass
+
+    def test_slots_by_priority(self):
+        "The most urgent waiter gets the next free slot"
+        scheduler = iosched.Scheduler(max_concurrent=1)
+        order = []
+
+        def work(level):
+            with scheduler.stream(level):
+                order.append(level)
+
+        with scheduler.stream():
+            threads = []
+            for level in (iosched.BACKGROUND, iosched.NORMAL, iosched.FOREGROUND):
+                threads.append(threading.Thread(target=work, args=(level,)))
+                threads[-1].start()
+            while len(scheduler.slots._waiting) < 3:
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([iosched.FOREGROUND, iosched.NORMAL, iosched.BACKGROUND], order)
+        self.assertEqual(1, scheduler.slots.free)
+
+    def test_routes_nix(self):
+        "nix.cp(), cp_r() and rm() go through the scheduler once enabled"
+        src = os.path.join(self.tdir, 'src')
+        os.makedirs(os.path.join(src, 'sub'))
+        for name in ('one', 'two', os.path.join('sub', 'three')):
+            with open(os.path.join(src, name), 'wb') as fh:
+                fh.write(b'x' * 1000)
+        scheduler = iosched.enable(bytes_per_sec=1 << 30, ops_per_sec=1 << 20, max_concurrent=1)
+        with patch.object(scheduler.ops, 'take') as ops:
+            with patch.object(scheduler.bytes, 'take') as transferred:
+                nix.cp(src, os.path.join(self.tdir, 'dst'), recursive=True)
+                self.assertEqual(5, ops.call_count) # 2 directories, 3 files
+                self.assertEqual(6000, sum(c[0][0] for c in transferred.call_args_list))
+                nix.cp(os.path.join(src, 'one'), os.path.join(self.tdir, 'copy'))
+                nix.rm(os.path.join(self.tdir, 'copy'))
+                nix.rm(src, recursive=True)
+                self.assertEqual(5 + 2 + 5, ops.call_count)
+        self.assertFalse(os.path.exists(src))
+        self.assertTrue(nix.cmp_tree(os.path.join(self.tdir, 'dst'),
+                                     os.path.join(self.tdir, 'dst')))
+        with open(os.path.join(self.tdir, 'dst', 'sub', 'three'), 'rb') as fh:
+            self.assertEqual(b'x' * 1000, fh.read())
+        self.assertEqual(1, scheduler.slots.free)
+
+    def test_rmtree_symlink(self):
+        "Refuse to remove through a symlink to a directory, like shutil"
+        real = os.path.join(self.tdir, 'real')
+        link = os.path.join(self.tdir, 'link')
+        os.mkdir(real)
+        with open(os.path.join(real, 'keep'), 'wb') as fh:
+            fh.write(b'x')
+        os.symlink(real, link)
+        iosched.enable()
+        with self.assertRaises(OSError):
+            nix.rm_r(link)
+        self.assertEqual(['keep'], os.listdir(real))
+
+    def test_foreground_unthrottled(self):
+        "FOREGROUND streams take a slot but no tokens"
+        doc = os.path.join(self.tdir, 'doc')
+        with open(doc, 'wb') as fh:
+            fh.write(b'x' * 1000)
+        scheduler = iosched.enable(bytes_per_sec=1, ops_per_sec=1)
+        with patch.object(iosched, '_sleep') as sleep:
+            with iosched.priority(iosched.FOREGROUND):
+                nix.cp(doc, doc + '.copy')
+            self.assertFalse(sleep.called)
+            nix.rm(doc + '.copy', doc)
+            self.assertTrue(sleep.called)
+
+    def test_checksum(self):
+        "Path.checksum reads through the scheduler"
+        doc = Path(self.tdir) / 'doc'
+        doc << 'hello' * 1000
+        expected = hashlib.md5(b'hello' * 1000).hexdigest()
+        self.assertEqual(expected, doc.checksum)
+        scheduler = iosched.enable(bytes_per_sec=1 << 30)
+        with patch.object(scheduler.bytes, 'take') as transferred:
+            self.assertEqual(expected, doc.checksum)
+            transferred.assert_called_once_with(5000)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise'), 'No posix_fadvise')
+    def test_background_dontneed(self):
+        "BACKGROUND reads drop their pages from the cache"
+        doc = os.path.join(self.tdir, 'doc')
+        with open(doc, 'wb') as fh:
+            fh.write(b'x' * 3000)
+        scheduler = iosched.enable()
+        with patch.object(iosched.os, 'posix_fadvise') as fadvise:
+            with open(doc, 'rb') as fh:
+                self.assertEqual(3, len(list(scheduler.blocks(fh, 1000))))
+            self.assertFalse(fadvise.called)
+            with iosched.priority(iosched.BACKGROUND):
+                with open(doc, 'rb') as fh:
+                    list(scheduler.blocks(fh, 1000))
+            self.assertEqual([0, 1000, 2000], [c[0][1] for c in fadvise.call_args_list])
+
+class AccessTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.doc = os.path.join(self.tdir, 'doc')
+        with open(self.doc, 'wb') as fh:
+            fh.write(b'line\n' * 2000)
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def test_get_access(self):
+        self.assertEqual(None, iosched.get_access())
+        self.assertEqual('once', iosched.get_access('once'))
+        with patch.object(iosched, 'DEFAULT_ACCESS', 'random'):
+            self.assertEqual('random', iosched.get_access())
+        with self.assertRaises(ValueError):
+            iosched.get_access('twice')
+
+    def test_not_on_disk(self):
+        "Files without a descriptor come back untouched"
+        fh = io.BytesIO(b'hi')
+        self.assertIs(fh, iosched.advise(fh, 'once'))
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise'), 'No posix_fadvise')
+    def test_advise(self):
+        "Pass sequential and random on to the kernel"
+        with patch.object(iosched.os, 'posix_fadvise') as fadvise:
+            with open(self.doc, 'rb') as fh:
+                self.assertIs(fh, iosched.advise(fh))
+                self.assertFalse(fadvise.called)
+                self.assertIs(fh, iosched.advise(fh, 'sequential'))
+                fadvise.assert_called_with(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                self.assertIs(fh, iosched.advise(fh, 'random'))
+                fadvise.assert_called_with(fh.fileno(), 0, 0, os.POSIX_FADV_RANDOM)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise'), 'No posix_fadvise')
+    def test_once(self):
+        "Drop pages behind the reader, and the lot on close"
+        with patch.object(iosched, 'DROP_BEHIND', 4000):
+            with patch.object(iosched.os, 'posix_fadvise') as fadvise:
+                with iosched.advise(open(self.doc, 'rb', 0), 'once') as fh:
+                    fd = fh.fileno()
+                    self.assertEqual(b'line\n' * 500, fh.read(2500))
+                    self.assertEqual(1, fadvise.call_count)
+                    fh.read(2500)
+                    fadvise.assert_called_with(fd, 0, 5000, os.POSIX_FADV_DONTNEED)
+                    self.assertEqual(1000, len(list(fh)))
+                self.assertTrue(fh.closed)
+                self.assertEqual([(fd, 1000, 9000, os.POSIX_FADV_DONTNEED), (fd, 0, 0, os.POSIX_FADV_DONTNEED)],
+                             [c[0] for c in fadvise.call_args_list[-2:]])
+
+    @unittest.skipUnless(hasattr(os, 'posix_fadvise') and hasattr(os, 'pread'),
+                         'No posix_fadvise or pread')
+    def test_once_fdcache(self):
+        "Drop behind files over cached descriptors, which never move"
+        with filesystem.fdcache():
+            with patch.object(iosched, 'DROP_BEHIND', 4000):
+                with patch.object(iosched.os, 'posix_fadvise') as fadvise:
+                    with Path(self.doc).open('rb', access='once') as fh:
+                        fh.read(5000)
+                        self.assertTrue(fadvise.called)
+                    fadvise.reset_mock()
+                    with Path(self.doc).open('r', access='once') as fh:
+                        fh.read()
+                        self.assertTrue(fadvise.called)
+
+    @unittest.skipUnless(hasattr(mmap, 'MADV_SEQUENTIAL'), 'No madvise')
+    def test_madvise(self):
+        mapped = Mock()
+        iosched.madvise(mapped)
+        self.assertFalse(mapped.madvise.called)
+        iosched.madvise(mapped, 'random')
+        mapped.madvise.assert_called_with(mmap.MADV_RANDOM)
+        iosched.madvise(mapped, 'once')
+        mapped.madvise.assert_called_with(mmap.MADV_SEQUENTIAL)
+
+if __name__ == '__main__':
+    unittest.main()
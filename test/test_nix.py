@@ -3,16 +3,18 @@ Unittests for the ffs.nix module
 """
 from __future__ import with_statement
 
+import datetime
 import filecmp
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import unittest
 
 if sys.version_info <  (2, 7):
     import unittest2 as unittest
-if sys.version.startswith('3.1'):
+if sys.version_info[:2] == (3, 1):
     from ffs import _unittest31 as unittest
 
 from mock import patch
@@ -63,6 +65,97 @@ class CDTestCase(unittest.TestCase):
         self.assertEqual('/tmp', cwd)
 
 
+class LogicalCDTestCase(unittest.TestCase):
+    def setUp(self):
+        self.startdir = os.getcwd()
+        self.tdir = os.path.realpath(tempfile.mkdtemp())
+        os.mkdir(os.path.join(self.tdir, 'sub'))
+
+    def tearDown(self):
+        nix._cwd.set(None)
+        os.chdir(self.startdir)
+        shutil.rmtree(self.tdir)
+
+    def test_leaves_process_alone(self):
+        "Change the logical working directory, not the process's"
+        with nix.cd(self.tdir, logical=True) as path:
+            self.assertIsInstance(path, Path)
+            self.assertEqual(self.tdir, path)
+            self.assertEqual(self.tdir, nix.getwd())
+            self.assertEqual(self.startdir, os.getcwd())
+            with nix.cd('sub', logical=True):
+                self.assertEqual(os.path.join(self.tdir, 'sub'), nix.getwd())
+            self.assertEqual(self.tdir, nix.getwd())
+        self.assertEqual(self.startdir, nix.getwd())
+
+    def test_physical_inside_logical(self):
+        "A real cd() replaces the logical working directory"
+        with nix.cd(self.tdir, logical=True):
+            with nix.cd('sub', logical=False):
+                sub = os.path.realpath(os.path.join(self.tdir, 'sub'))
+                self.assertEqual(sub, os.path.realpath(nix.getwd()))
+                self.assertEqual('foo', nix.resolve('foo'))
+            self.assertEqual(self.tdir, nix.getwd())
+        self.assertEqual(self.startdir, os.getcwd())
+
+    def test_size(self):
+        "Path.size looks relative to the logical working directory"
+        with open(os.path.join(self.tdir, 'doc'), 'w') as fh:
+            fh.write('hello')
+        with nix.cd(self.tdir, logical=True):
+            self.assertEqual(5, Path('doc').size)
+
+    def test_default(self):
+        "LOGICAL_CD makes cd() logical"
+        with patch.object(nix, 'LOGICAL_CD', True):
+            nix.cd(self.tdir)
+        self.assertEqual(self.tdir, nix.getwd())
+        self.assertEqual(self.startdir, os.getcwd())
+
+    def test_not_a_directory(self):
+        "Only change to directories"
+        with self.assertRaises(OSError):
+            nix.cd(os.path.join(self.tdir, 'nope'), logical=True)
+        open(os.path.join(self.tdir, 'file'), 'w').close()
+        with self.assertRaises(OSError):
+            nix.cd(os.path.join(self.tdir, 'file'), logical=True)
+        self.assertEqual(self.startdir, nix.getwd())
+
+    def test_resolve(self):
+        "Resolve relative paths against the logical working directory"
+        self.assertEqual('foo', nix.resolve('foo'))
+        with nix.cd(self.tdir, logical=True):
+            self.assertEqual(os.path.join(self.tdir, 'foo'), nix.resolve('foo'))
+            self.assertEqual('/etc/foo', nix.resolve('/etc/foo'))
+            self.assertEqual('~/foo', nix.resolve('~/foo'))
+
+    def test_threads(self):
+        "Each thread has its own"
+        seen = {}
+        def worker(name):
+            nix.cd(os.path.join(self.tdir, 'sub') if name == 'sub' else self.tdir,
+                   logical=True)
+            barrier.wait()
+            seen[name] = nix.getwd()
+        barrier = threading.Barrier(2)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in ('sub', 'top')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({'sub': os.path.join(self.tdir, 'sub'), 'top': self.tdir}, seen)
+        self.assertEqual(self.startdir, nix.getwd())
+
+    @unittest.skipIf(nix.contextvars is None, 'No contextvars')
+    def test_contexts(self):
+        "Each context - so each asyncio task - has its own"
+        sub = os.path.join(self.tdir, 'sub')
+        context = nix.contextvars.copy_context()
+        context.run(nix.cd, sub, logical=True)
+        self.assertEqual(sub, context.run(nix.getwd))
+        self.assertEqual(self.startdir, nix.getwd())
+
+
 class ChmodTestCase(unittest.TestCase):
     def setUp(self):
         with tempfile.NamedTemporaryFile(delete=False) as tf:
@@ -144,6 +237,82 @@ class ChownTestCase(unittest.TestCase):
             nix.chown('/hai', uid = 100)
             pchown.assert_called_once_with('/hai', 100, -1)
 
+class CmpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        if os.path.exists(self.tdir):
+            shutil.rmtree(self.tdir)
+
+    def test_cmp(self):
+        "Compare contents, across block boundaries"
+        f1, f2 = self.tdir / 'one', self.tdir / 'two'
+        f1 << 'x' * 100
+        f2 << 'x' * 100
+        self.assertTrue(nix.cmp(f1, f2, blocksize=7))
+        f2.write('x' * 99 + 'y')
+        self.assertFalse(nix.cmp(f1, f2, blocksize=7))
+
+    def test_cmp_size(self):
+        "Different sizes differ without reading"
+        f1, f2 = self.tdir / 'one', self.tdir / 'two'
+        f1 << 'short'
+        f2 << 'longer'
+        with patch('ffs.nix.open', create=True) as popen:
+            self.assertFalse(nix.cmp(f1, f2))
+            self.assertFalse(popen.called)
+
+    def test_cmp_not_shallow(self):
+        "Same size and mtime is only enough when asked"
+        f1, f2 = self.tdir / 'one', self.tdir / 'two'
+        f1 << 'this'
+        f2 << 'that'
+        os.utime(f2, (os.stat(f1).st_atime, os.stat(f1).st_mtime))
+        self.assertFalse(nix.cmp(f1, f2))
+        self.assertTrue(nix.cmp(f1, f2, shallow=True))
+
+    def test_cmp_digest(self):
+        "Digests are cached"
+        f1, f2 = self.tdir / 'one', self.tdir / 'two'
+        f1 << 'same'
+        f2 << 'same'
+        self.assertTrue(nix.cmp(f1, f2, digest='sha1'))
+        with patch('ffs.nix.open', create=True) as popen:
+            self.assertTrue(nix.cmp(f1, f2, digest='sha1'))
+            self.assertFalse(popen.called)
+
+    def test_cmp_nonexistant(self):
+        "Should raise"
+        self.tdir.touch('one')
+        with self.assertRaises(exceptions.DoesNotExistError):
+            nix.cmp(self.tdir / 'one', self.tdir / 'nope')
+
+    def test_cmp_tree(self):
+        "Report what was added, removed and changed"
+        left, right = self.tdir / 'left', self.tdir / 'right'
+        for root in left, right:
+            root.mkdir('sub/deeper')
+            (root / 'same') << 'same'
+            (root / 'sub/deeper/same') << 'same'
+        (left / 'gone') << 'gone'
+        left.mkdir('gonedir')
+        (right / 'new') << 'new'
+        (left / 'sub/deeper/edited') << 'before'
+        (right / 'sub/deeper/edited') << 'after!'
+        (left / 'sub/kind') << 'file'
+        right.mkdir('sub/kind')
+        report = nix.cmp_tree(left, right, workers=2)
+        self.assertEqual(['new'], report.added)
+        self.assertEqual(['gone', 'gonedir'], report.removed)
+        self.assertEqual([os.path.join('sub', 'deeper', 'edited'),
+                          os.path.join('sub', 'kind')], report.changed)
+
+    def test_cmp_tree_nonexistant(self):
+        "Should raise"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            nix.cmp_tree(self.tdir, self.tdir / 'nope')
+
 class CPTestCase(unittest.TestCase):
     def setUp(self):
         self.tdir = Path(tempfile.mkdtemp())
@@ -196,6 +365,116 @@ class CPTestCase(unittest.TestCase):
             nix.cp(self.tdir + 'whatever', self.tdir + 'whateverer')
 
 
+class DuTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = Path(tempfile.mkdtemp())
+        self.tdir.mkdir('a/deeper', 'b')
+        (self.tdir / 'top') << 'x' * 10
+        (self.tdir / 'a/deeper/one') << 'x' * 100
+        (self.tdir / 'b/two') << 'x' * 1000
+        os.link(self.tdir / 'b/two', self.tdir / 'b/linked')
+        os.symlink(self.tdir / 'top', self.tdir / 'a/symlink')
+        self.dirsize = sum(os.lstat(self.tdir / d).st_size
+                           for d in ['', 'a', 'a/deeper', 'b'])
+        self.linksize = os.lstat(self.tdir / 'a/symlink').st_size
+
+    def tearDown(self):
+        if os.path.exists(self.tdir):
+            shutil.rmtree(self.tdir)
+
+    def test_du(self):
+        "Hard links count once, symlinks aren't followed"
+        usage = nix.du(self.tdir)
+        self.assertEqual(4, usage.files)
+        self.assertEqual(1110 + self.linksize + self.dirsize, usage.size)
+        self.assertTrue(usage.disk > 0)
+
+    def test_du_breakdown(self):
+        "Usage per subdirectory, scanned on threads"
+        total, byname = nix.du(self.tdir, breakdown=True, workers=2)
+        self.assertEqual(nix.du(self.tdir), total)
+        self.assertEqual(set([self.tdir / 'a', self.tdir / 'b']), set(byname))
+        self.assertEqual(2, byname[self.tdir / 'a'].files)
+        self.assertEqual(1, byname[self.tdir / 'b'].files)
+        self.assertEqual(total.size, sum(u.size for u in byname.values()) + 10
+                         + os.lstat(self.tdir).st_size)
+
+    def test_du_file(self):
+        "A file is its own total"
+        usage = nix.du(self.tdir / 'top')
+        self.assertEqual((10, 1), (usage.size, usage.files))
+
+    def test_du_nonexistant(self):
+        "Should raise"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            nix.du(self.tdir / 'nope')
+
+class FindTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = Path(tempfile.mkdtemp())
+        self.tdir.mkdir('a/deeper', 'b')
+        (self.tdir / 'small.txt') << 'x'
+        (self.tdir / 'a/big.txt') << 'x' * 1000
+        (self.tdir / 'a/deeper/old.log') << 'x' * 10
+        os.utime(self.tdir / 'a/deeper/old.log', (1000000000, 1000000000))
+        os.symlink(self.tdir / 'a', self.tdir / 'b/link')
+
+    def tearDown(self):
+        if os.path.exists(self.tdir):
+            shutil.rmtree(self.tdir)
+
+    def find(self, **kw):
+        return [os.path.relpath(p, self.tdir) for p in nix.find(self.tdir, **kw)]
+
+    def test_find_all(self):
+        "Everything below root, without following symlinks"
+        self.assertEqual(['a', 'a/big.txt', 'a/deeper', 'a/deeper/old.log',
+                          'b', 'b/link', 'small.txt'], self.find())
+
+    def test_find_name_type(self):
+        "Names and types"
+        self.assertEqual(['a/big.txt', 'small.txt'], self.find(name='*.txt'))
+        self.assertEqual(['a', 'a/deeper', 'b'], self.find(type='d'))
+        self.assertEqual(['b/link'], self.find(type='l'))
+        with self.assertRaises(ValueError):
+            self.find(type='q')
+
+    def test_find_no_stat(self):
+        "Names and types don't need a stat"
+        found = nix.find(self.tdir, name='*.log', type='f')
+        with patch.object(nix.os, 'lstat') as plstat:
+            with patch.object(nix.os, 'stat') as pstat:
+                found = list(found)
+                self.assertFalse(plstat.called)
+                self.assertFalse(pstat.called)
+        self.assertEqual([str(self.tdir / 'a/deeper/old.log')], found)
+
+    def test_find_stat(self):
+        "Sizes, mtimes and owners"
+        self.assertEqual(['a/big.txt'], self.find(size_gt=100, type='f'))
+        self.assertEqual(['a/deeper/old.log', 'small.txt'],
+                         self.find(size_lt=100, type='f'))
+        self.assertEqual(['a/deeper/old.log'],
+                         self.find(older=datetime.datetime(2010, 1, 1), type='f'))
+        self.assertEqual(['a/big.txt', 'small.txt'],
+                         self.find(newer=self.tdir / 'a/deeper/old.log', type='f'))
+        self.assertEqual(['a/big.txt'], self.find(name='big*', user=os.getuid()))
+        self.assertEqual([], self.find(group=os.getgid() + 1))
+
+    def test_find_maxdepth(self):
+        "Don't go too deep"
+        self.assertEqual(['a', 'b', 'small.txt'], self.find(maxdepth=1))
+
+    def test_find_lazy(self):
+        "Yield as we go"
+        found = nix.find(self.tdir)
+        self.assertEqual(str(self.tdir / 'a'), next(found))
+
+    def test_find_nonexistant(self):
+        "Should raise"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            nix.find(self.tdir / 'nope')
+
 class HeadTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -501,6 +780,112 @@ class RmTestCase(unittest.TestCase):
         with self.assertRaises(exceptions.DoesNotExistError):
             nix.rm(nofile)
 
+class TailTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.tname = os.path.join(self.tdir, 'app.log')
+        with open(self.tname, 'w') as fh:
+            fh.write("\n".join([str(x) for x in range(100)]) + "\n")
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def append(self, contents, name=None):
+        with open(name or self.tname, 'a') as fh:
+            fh.write(contents)
+
+    def test_get_lines(self):
+        "Get the last lines of a file"
+        expected = "\n".join([str(x) for x in range(90, 100)]) + "\n"
+        expected5 = "\n".join([str(x) for x in range(95, 100)]) + "\n"
+        self.assertEqual(expected, nix.tail(self.tname))
+        self.assertEqual(expected5, nix.tail(Path(self.tname), lines=5))
+
+    def test_get_lines_small_blocks(self):
+        "Read backwards across several blocks"
+        from ffs.nix import _lastlines
+        with open(self.tname, 'rb') as fh:
+            lines = _lastlines(fh, 20, blocksize=7)
+        expected = "\n".join([str(x) for x in range(80, 100)]) + "\n"
+        self.assertEqual(expected.encode('utf-8'), lines)
+
+    def test_no_trailing_newline(self):
+        "The last, unterminated line counts"
+        self.append('partial')
+        self.assertEqual('99\npartial', nix.tail(self.tname, lines=2))
+
+    def test_nonexistant(self):
+        "Raise if the file does not exist"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            nix.tail(os.path.join(self.tdir, 'nothere.log'))
+
+    def test_follow_backlog(self):
+        "The frist batch is the last LINES lines"
+        follower = nix.tail(self.tname, lines=3, follow=True)
+        try:
+            self.assertEqual(['97\n', '98\n', '99\n'], next(follower))
+        finally:
+            follower.close()
+
+    def test_follow_batches_new_lines(self):
+        "New lines arrive as a single batch"
+        follower = nix.tail(self.tname, lines=1, follow=True)
+        try:
+            next(follower)
+            self.append('a\nb\nc\n')
+            self.assertEqual(['a\n', 'b\n', 'c\n'], next(follower))
+        finally:
+            follower.close()
+
+    def test_follow_partial_lines(self):
+        "Don't emit a line until it has been terminated"
+        follower = nix.tail(self.tname, lines=1, follow=True, max_interval=0.05)
+        try:
+            next(follower)
+            self.append('hello ')
+            self.append('world\n')
+            self.assertEqual(['hello world\n'], next(follower))
+        finally:
+            follower.close()
+
+    def test_follow_truncation(self):
+        "Start from the top after truncation"
+        follower = nix.tail(self.tname, lines=1, follow=True, max_interval=0.05)
+        try:
+            next(follower)
+            with open(self.tname, 'w') as fh:
+                fh.write('fresh\n')
+            self.assertEqual(['fresh\n'], next(follower))
+        finally:
+            follower.close()
+
+    def test_follow_rotation(self):
+        "Drain the old file, then reopen the new one"
+        follower = nix.tail(self.tname, lines=1, follow=True, max_interval=0.05)
+        try:
+            next(follower)
+            self.append('last words\n')
+            os.rename(self.tname, self.tname + '.1')
+            self.append('new file\n')
+            self.assertEqual(['last words\n'], next(follower))
+            self.assertEqual(['new file\n'], next(follower))
+        finally:
+            follower.close()
+
+    def test_follow_polling(self):
+        "Fall back to polling without inotify"
+        with patch.object(nix._inotify, 'Watcher') as pwatch:
+            pwatch.side_effect = exceptions.NotSupportedError('!')
+            follower = nix.tail(self.tname, lines=1, follow=True,
+                                max_interval=0.05)
+            try:
+                next(follower)
+                self.append('polled\n')
+                self.assertEqual(['polled\n'], next(follower))
+            finally:
+                follower.close()
+
 class TouchTestCase(unittest.TestCase):
     def setUp(self):
         self.tdir = tempfile.mkdtemp()
@@ -0,0 +1,202 @@
+"""
+Unittests for the ffs.parallel module
+"""
+from __future__ import with_statement
+
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+if sys.version_info <  (2, 7):
+    import unittest2 as unittest
+
+from mock import patch
+
+from ffs import exceptions, nix, parallel
+
+def count_lines(lines):
+    "Module level so that we can pickle it"
+    return sum(1 for _ in lines)
+
+class ShardsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.tname = os.path.join(self.tdir, 'data.csv')
+        self.lines = ['{0},{1}\n'.format(i, 'x' * (i % 17)) for i in range(1000)]
+        with open(self.tname, 'w') as fh:
+            fh.write(''.join(self.lines))
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def check(self, shards):
+        "Shards are contiguous, aligned and cover the file"
+        self.assertEqual(0, shards[0].start)
+        self.assertEqual(os.path.getsize(self.tname), shards[-1].end)
+        for before, after in zip(shards, shards[1:]):
+            self.assertEqual(before.end, after.start)
+        content = b''.join(s.read() for s in shards)
+        self.assertEqual(''.join(self.lines).encode('utf-8'), content)
+        lines = [l for s in shards for l in s.lines()]
+        self.assertEqual(self.lines, lines)
+
+    def test_n(self):
+        "Split into N shards"
+        shards = parallel.shards(self.tname, n=7)
+        self.assertEqual(7, len(shards))
+        self.check(shards)
+
+    def test_size(self):
+        "Split into SIZE byte shards"
+        shards = parallel.shards(self.tname, size=1000)
+        self.assertTrue(all(s.read().endswith(b'\n') for s in shards))
+        self.assertTrue(all(abs(s.size - 1000) < 30 for s in shards[:-1]))
+        self.check(shards)
+
+    def test_long_lines(self):
+        "Shards smaller than lines collapse together"
+        with open(self.tname, 'w') as fh:
+            fh.write('a' * 100 + '\n' + 'b' * 100 + '\n')
+        self.lines = ['a' * 100 + '\n', 'b' * 100 + '\n']
+        shards = parallel.shards(self.tname, size=10)
+        self.assertEqual(2, len(shards))
+        self.check(shards)
+
+    def test_no_newlines(self):
+        "Scan for line ends a chunk at a time"
+        with open(self.tname, 'w') as fh:
+            fh.write('a' * 1000 + '\n' + 'b' * 5000)
+        self.lines = ['a' * 1000 + '\n', 'b' * 5000]
+        with patch.object(parallel, 'SCAN_CHUNK', 64):
+            shards = parallel.shards(self.tname, size=100)
+        self.assertEqual(2, len(shards))
+        self.check(shards)
+
+    def test_one_shard(self):
+        "A single shard is the whole file"
+        self.check(parallel.shards(self.tname, n=1))
+
+    def test_raises(self):
+        "Bad arguments and missing files"
+        with self.assertRaises(ValueError):
+            parallel.shards(self.tname, n=2, size=2)
+        with self.assertRaises(exceptions.DoesNotExistError):
+            parallel.shards(os.path.join(self.tdir, 'nothere'))
+
+    def test_pmap_process(self):
+        "Map over shards in processes"
+        results = parallel.pmap(self.tname, count_lines, workers=3)
+        self.assertEqual(3, len(results))
+        self.assertEqual(1000, sum(results))
+
+    def test_pmap_thread(self):
+        "Map over shards in threads"
+        results = parallel.pmap(self.tname, lambda lines: list(lines),
+                                workers=2, mode='thread', n=5)
+        self.assertEqual(self.lines, [l for r in results for l in r])
+
+    def test_pmap_encoding(self):
+        "Decode with another encoding, or not at all"
+        with open(self.tname, 'wb') as fh:
+            fh.write(b'caf\xe9\nna\xefve\n')
+        results = parallel.pmap(self.tname, lambda lines: list(lines),
+                                workers=2, mode='thread', encoding='latin-1')
+        self.assertEqual([u'caf\xe9\n', u'na\xefve\n'], [l for r in results for l in r])
+        results = parallel.pmap(self.tname, lambda lines: list(lines),
+                                workers=2, mode='thread', encoding=None)
+        self.assertEqual([b'caf\xe9\n', b'na\xefve\n'], [l for r in results for l in r])
+
+    def test_pmap_mode(self):
+        "Raise for unknown modes"
+        with self.assertRaises(ValueError):
+            parallel.pmap(self.tname, count_lines, mode='fibre')
+
+class GrepTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tdir, 'sub'))
+        self.files = {
+            'a.log': 'ok\nERROR 1 disk\nok\nERROR 22 net\n',
+            'b.log': 'nothing to see\n',
+            os.path.join('sub', 'c.log'): 'ERROR 3 last line, no newline',
+            }
+        for name, content in self.files.items():
+            with open(os.path.join(self.tdir, name), 'w') as fh:
+                fh.write(content)
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def grep(self, pattern, **kw):
+        kw.setdefault('workers', 2)
+        kw.setdefault('mode', 'thread')
+        return [(os.path.relpath(p, self.tdir), n, l)
+                for p, n, l in parallel.grep(self.tdir, pattern, **kw)]
+
+    def test_literal_prefix(self):
+        "Only claim literals every match must start with"
+        self.assertEqual(b'ERROR ', parallel._literal_prefix(b'ERROR \\d+'))
+        self.assertEqual(b'a.b', parallel._literal_prefix(b'a\\.bc?'))
+        self.assertEqual(b'fo', parallel._literal_prefix(b'fo+'))
+        self.assertEqual(b'a', parallel._literal_prefix(b'a.c'))
+        self.assertEqual(b'f', parallel._literal_prefix(b'fo*'))
+        self.assertEqual(b'f', parallel._literal_prefix(b'fo{2}'))
+        self.assertEqual(b'', parallel._literal_prefix(b'foo|bar'))
+        self.assertEqual(b'', parallel._literal_prefix(b'^foo'))
+        self.assertEqual(b'', parallel._literal_prefix(b'foo', re.I))
+
+    def test_grep(self):
+        "Find matching lines with their numbers"
+        self.assertEqual([('a.log', 2, 'ERROR 1 disk'),
+                          ('a.log', 4, 'ERROR 22 net'),
+                          (os.path.join('sub', 'c.log'), 1, 'ERROR 3 last line, no newline')],
+                         self.grep(r'ERROR \d+'))
+
+    def test_no_literal(self):
+        "Patterns without a literal prefix search the regex directly"
+        self.assertEqual([('a.log', 4, 'ERROR 22 net')], self.grep(r'\d\d'))
+        self.assertEqual([('a.log', 1, 'ok'), ('a.log', 3, 'ok')], self.grep(r'^ok$'))
+
+    def test_not_recursive(self):
+        "Only search the top directory"
+        self.assertEqual(['a.log', 'a.log'],
+                         [p for p, _, _ in self.grep('ERROR', recursive=False)])
+
+    def test_bytes_small_chunks(self):
+        "Bytes patterns give bytes lines, whatever the chunk size"
+        self.assertEqual([('a.log', 2, b'ERROR 1 disk'), ('a.log', 4, b'ERROR 22 net')],
+                         self.grep(b'ERROR [0-9]+ [dn]', chunksize=3))
+
+    def test_long_lines(self):
+        "Lines much longer than a chunk"
+        with open(os.path.join(self.tdir, 'long.log'), 'wb') as fh:
+            fh.write(b'x' * 10000 + b'ERROR 9 deep\n' + b'y' * 10000 + b'\nERROR 10 next\n')
+        found = [(n, l.lstrip(b'x')) for p, n, l in self.grep(b'ERROR [0-9]+ [dn]', chunksize=16)
+                 if p == 'long.log']
+        self.assertEqual([(1, b'ERROR 9 deep'), (3, b'ERROR 10 next')], found)
+
+    def test_processes(self):
+        "Search files in worker processes, one file at a time"
+        self.assertEqual(3, len(self.grep('ERROR', mode='process')))
+        self.assertEqual(3, len(self.grep('ERROR', workers=1)))
+
+    def test_one_file_in_process(self):
+        "Don't start a pool for a single file"
+        with patch.object(parallel, '_pool', wraps=parallel._pool) as ppool:
+            found = list(parallel.grep(os.path.join(self.tdir, 'a.log'), 'ERROR'))
+            self.assertEqual(2, len(found))
+            self.assertEqual(0, ppool.call_count)
+            list(parallel.grep(os.path.join(self.tdir, 'sub'), 'ERROR'))
+            self.assertEqual(0, ppool.call_count)
+            self.assertEqual(3, len(self.grep('ERROR')))
+            self.assertEqual(1, ppool.call_count)
+
+    def test_raises(self):
+        "Raise for nonexistant roots"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            list(parallel.grep(os.path.join(self.tdir, 'nope'), 'x'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,18 +13,20 @@ except ImportError:
 import os
 import sys
 import tempfile
+import threading
 import unittest
 
 if sys.version_info <  (2, 7):
     import unittest2 as unittest
-if sys.version.startswith('3.1'):
+if sys.version_info[:2] == (3, 1):
     from ffs import _unittest31 as unittest
 
 import six
+from mock import patch
 
-from ffs import exceptions, path, _path_blacklists
+from ffs import exceptions, filesystem, nix, path, _path_blacklists
 from ffs.contrib import http
-from ffs.path import Path, Pset
+from ffs.path import CachedPath, DirFDPath, MemoryPath, Path, Pset
 from ffs.nix import touch, rm, rm_r, rmdir
 from ffs._py3k import FileKlass
 
@@ -47,6 +49,18 @@ class PsetTestCase(unittest.TestCase):
         for bname in ['bar.py', 'buzz.txt']:
             self.assertIn(bname, pset.basenames)
 
+    def test_basen(self):
+        "Return the last n components for a collection of paths."
+        pset = Pset([Path('/foo/bar/baz.py'), Path('fizz/buzz.txt')])
+        self.assertEqual(Pset(['bar/baz.py', 'fizz/buzz.txt']), pset.basen(2))
+        self.assertTrue(all(isinstance(p, Path) for p in pset.basen(2)))
+
+    def test_parents(self):
+        "Return the distinct parents of a collection of paths."
+        pset = Pset([Path('/foo/bar.py'), Path('/foo/baz.py'), Path('/fizz.txt')])
+        self.assertEqual(Pset(['/foo', '/']), pset.parents)
+        self.assertTrue(all(isinstance(p, Path) for p in pset.parents))
+
 
 class BasePathTestCase(unittest.TestCase):
     def setUp(self):
@@ -335,6 +349,85 @@ class MagicMethodsTestCase(PathTestCase):
         contents = open(self.tmpath).read()
         self.assertEqual("Hello Beautiful", contents)
 
+    def test_lshift_appender(self):
+        "Route through an open appender session"
+        p = Path(self.tmpath)
+        with p.appender() as appender:
+            with patch.object(p.fs, 'open') as popen:
+                for i in range(3):
+                    p << str(i)
+                Path(self.tmpath) << '3'
+                self.assertEqual(0, popen.call_count)
+            self.assertEqual('', open(self.tmpath).read())
+        self.assertEqual('0123', open(self.tmpath).read())
+        self.assertEqual({}, path._appenders.get())
+        p << '4'
+        self.assertEqual('01234', open(self.tmpath).read())
+
+    def test_appender_mkpath(self):
+        "Create missing parents"
+        p = Path(self.tdir) + 'some/nested/file.log'
+        with p.appender() as appender:
+            appender << 'hai'
+        self.assertEqual('hai', p.read())
+
+    def test_appender_concurrent(self):
+        "Route << through a concurrent session"
+        p = Path(self.tmpath)
+        with p.appender(concurrent=True) as appender:
+            p << 'one'
+            p << 'two'
+        self.assertEqual('one\ntwo\n', open(self.tmpath).read())
+
+    def test_appender_concurrent_cached(self):
+        "Creating the file invalidates a cache"
+        p = CachedPath(self.tdir) + 'created.log'
+        self.assertEqual(False, p.is_file)
+        with p.appender(concurrent=True) as appender:
+            self.assertEqual(True, p.is_file)
+            p << 'one'
+        self.assertEqual('one\n', p.read())
+
+    def test_appender_keyed_on_location(self):
+        "Sessions belong to one file, not to a path string"
+        first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+        try:
+            with nix.cd(first, logical=True):
+                with Path('log').appender():
+                    with nix.cd(second, logical=True):
+                        Path('log') << 'second'
+                    Path('log') << 'first'
+            self.assertEqual('first', open(os.path.join(first, 'log')).read())
+            self.assertEqual('second', open(os.path.join(second, 'log')).read())
+        finally:
+            rm_r(first)
+            rm_r(second)
+        doc = Path(self.tmpath)
+        with doc.appender():
+            MemoryPath(self.tmpath) << 'memory'
+        self.assertFalse(doc.read())
+        self.assertEqual('memory', MemoryPath(self.tmpath).read())
+        filesystem.MemoryFilesystem().reset()
+
+    def test_appender_per_thread(self):
+        "Other threads don't write through our session"
+        p = Path(self.tmpath)
+        def append():
+            Path(self.tmpath) << 'other'
+        with p.appender():
+            p << 'ours'
+            worker = threading.Thread(target=append)
+            worker.start()
+            worker.join()
+            self.assertEqual('other', open(self.tmpath).read())
+        self.assertEqual('otherours', open(self.tmpath).read())
+
+    def test_appender_dir(self):
+        "Can't append to a directory"
+        with self.assertRaises(TypeError):
+            with Path(self.tdir).appender():
+                pass
+
     def test_dict_key(self):
         "Should be able to dict(Path()=5)"
         mydict = {Path('/foo'): 1}
@@ -518,6 +611,45 @@ class FileLikeTestCase(PathTestCase):
         p.truncate()
         self.assertEqual(0, p.size)
 
+    def test_truncate_size(self):
+        "Should truncate or extend a file to a size"
+        p = Path(tempfile.mkdtemp()) + 'testfile.txt'
+        p << "Contentz"
+        p.truncate(4)
+        self.assertEqual('Cont', p.read())
+        p.truncate(6)
+        self.assertEqual(b'Cont\0\0', open(str(p), 'rb').read())
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_preallocate(self):
+        "Should reserve space for a file"
+        p = Path(tempfile.mkdtemp()) + 'testfile.txt'
+        self.assertTrue(p.preallocate(100000))
+        self.assertEqual(100000, p.size)
+        with self.assertRaises(TypeError):
+            Path(self.tdir).preallocate(100)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_expected_size(self):
+        "Preallocate, then truncate to what we wrote"
+        p = Path(tempfile.mkdtemp()) + 'testfile.txt'
+        with p.open('w', expected_size=100000) as fh:
+            fh.write('Contentz')
+            self.assertEqual(100000, p.size)
+        self.assertEqual('Contentz', p.read())
+        with p.atomic_open('wb', expected_size=100000) as fh:
+            fh.write(b'New')
+        self.assertEqual('New', p.read())
+        with p.open('wb', expected_size=1 << 20) as fh:
+            fh.write(b'\0' * 8)
+            fh.write(b'x' * 1000)
+            fh.seek(0)
+            fh.write(b'12345678')
+        self.assertEqual(1008, p.size)
+        with self.assertRaises(ValueError):
+            with p.open('a', expected_size=100):
+                pass
+
     def test_truncate_inappropriate(self):
         "Should raise"
         cases = [Path(self.tdir), Path(tempfile.mktemp())]
@@ -525,12 +657,72 @@ class FileLikeTestCase(PathTestCase):
             with self.assertRaises(TypeError):
                 case.truncate()
 
+    def test_write(self):
+        "Replace the contents of the file"
+        p = Path(self.tmpath)
+        p << 'old'
+        p.write('new')
+        self.assertEqual('new', p.read())
+        p.write(b'bytes', fsync=True)
+        self.assertEqual('bytes', p.read())
+
+    def test_write_mkpath(self):
+        "Create missing parents"
+        p = Path(self.tdir) + 'some/nested/file.txt'
+        p.write('hai')
+        self.assertEqual('hai', p.read())
+
+    def test_write_inappropriate(self):
+        "Raise for directories and non-strings"
+        with self.assertRaises(TypeError):
+            Path(self.tdir).write('hai')
+        with self.assertRaises(TypeError):
+            Path(self.tmpath).write(123)
+
     def test_read_dir(self):
         "Reading a directory should raise"
         p = Path(self.tdir)
         with self.assertRaises(TypeError):
             p.read()
 
+    @unittest.skipUnless(hasattr(os, 'pread'), 'No os.pread')
+    def test_fdcache(self):
+        "Read, append and rewrite through cached descriptors"
+        p = Path(self.tdir) + 'cached.txt'
+        p << 'one\n'
+        with filesystem.fdcache() as cache:
+            p << 'two\n'
+            self.assertEqual('one\ntwo\n', p.read())
+            self.assertEqual(['one\n', 'two\n'], list(p))
+            p.write('three\n')
+            self.assertEqual('three\n', p.read())
+            self.assertTrue(cache.hits > 0)
+
+    def test_access_hints(self):
+        "Read with access hints"
+        p = Path(self.tdir) + 'hinted.txt'
+        p << 'one\ntwo\n'
+        for access in ('sequential', 'random', 'once'):
+            self.assertEqual('one\ntwo\n', p.read(access=access))
+            self.assertEqual(['one\n', 'two\n'], list(p.lines(access=access)))
+            with p.mmap(access=access) as mapped:
+                self.assertEqual(b'one\n', mapped[:4])
+        with patch('ffs.iosched.DEFAULT_ACCESS', 'once'):
+            self.assertEqual(['one\n', 'two\n'], list(p))
+        with self.assertRaises(ValueError):
+            p.read(access='twice')
+        with self.assertRaises(TypeError):
+            with Path(self.tdir).mmap():
+                pass
+
+    def test_mmap_empty(self):
+        "Empty files can't be mapped, so give us empty bytes"
+        p = Path(self.tdir) + 'empty.txt'
+        p.touch()
+        with p.mmap() as mapped:
+            self.assertEqual(b'', mapped[:])
+            self.assertEqual(0, len(mapped))
+
 
 class NixMethodsTestCase(PathTestCase):
     "Unittesting nix operations added as methods"
@@ -715,6 +907,26 @@ class TemporaryTestCase(unittest.TestCase):
             self.assertTrue(os.path.exists(str(p + 'my.txt')))
         self.assertFalse(os.path.exists(val))
 
+    def test_temp_recycled(self):
+        "Directories are emptied and lent out again"
+        with Path.temp() as p:
+            first = str(p)
+            touch(p + 'my.txt')
+        filesystem._tempdirs.join()
+        with Path.temp() as p:
+            self.assertNotEqual(first, str(p))
+            self.assertEqual([], list(p))
+
+    def test_scratch(self):
+        "Anonymous scratch files"
+        tdir = tempfile.mkdtemp()
+        with Path.scratch(Path(tdir)) as fh:
+            fh.write(b'scratch')
+            self.assertEqual([], list(Path(tdir)))
+            fh.materialize(Path(tdir) + 'kept.txt')
+        self.assertEqual('scratch', (Path(tdir) + 'kept.txt').read())
+        rm_r(tdir)
+
     def test_tmp_function(self):
         "Should leave the tempdir"
         p = Path.newdir()
@@ -762,6 +974,64 @@ class JsonishTestCase(unittest.TestCase):
             with self.assertRaises(TypeError):
                 case.json_load()
 
+    def test_iter_jsonl(self):
+        "Lazily load JSON Lines"
+        p = Path(self.tmpath)
+        p << '{"foo": 1}\n{"foo": 2}\n'
+        records = p.iter_jsonl()
+        self.assertEqual(dict(foo=1), next(records))
+        self.assertEqual([dict(foo=2)], list(records))
+
+    def test_json_items(self):
+        "Stream the items of an array"
+        p = Path(self.tmpath)
+        p << json.dumps(dict(rows=[1, 2, 3]))
+        self.assertEqual([1, 2, 3], list(p.json_items('rows.item')))
+
+    def test_json_dump(self):
+        "Dump then load"
+        p = Path(self.tdir) + 'nested/out.json'
+        p.json_dump(dict(foo=[1, 2]))
+        self.assertEqual(dict(foo=[1, 2]), p.json_load())
+        p.json_dump(x for x in range(3))
+        self.assertEqual([0, 1, 2], p.json_load())
+
+    def test_streaming_inappropriate(self):
+        "Raise for directories and nonexistant files"
+        cases = [Path(self.tdir), Path(tempfile.mktemp())]
+        for case in cases:
+            with self.assertRaises(TypeError):
+                case.iter_jsonl()
+            with self.assertRaises(TypeError):
+                case.json_items()
+        with self.assertRaises(TypeError):
+            Path(self.tdir).json_dump([])
+
+    def test_json_dump_atomic(self):
+        "Leave the old contents if serialization fails"
+        p = Path(self.tmpath)
+        p.json_dump([1])
+        with self.assertRaises(TypeError):
+            p.json_dump([2, object()])
+        self.assertEqual([1], p.json_load())
+
+
+class PickleTestCase(PathTestCase):
+
+    def test_dump_load(self):
+        "Round trip through pickle"
+        p = Path(self.tdir) + 'nested/out.pickle'
+        p.pickle_dump(dict(foo=[1, 2]))
+        self.assertEqual(dict(foo=[1, 2]), p.pickle_load())
+
+    def test_inappropriate(self):
+        "Raise for directories and nonexistant files"
+        with self.assertRaises(TypeError):
+            Path(self.tdir).pickle_dump(1)
+        for case in [Path(self.tdir), Path(tempfile.mktemp())]:
+            with self.assertRaises(TypeError):
+                case.pickle_load()
+
 class CsvIshTestCase(PathTestCase):
 
     def test_as_csv(self):
@@ -785,6 +1055,198 @@ class CsvIshTestCase(PathTestCase):
             self.assertEqual('3', row.c)
             self.assertEqual('4', row.d)
 
+class ShardTestCase(PathTestCase):
+
+    def test_shards(self):
+        "Newline aligned shards"
+        p = Path(self.tmpath)
+        p.write(''.join('{0}\n'.format(i) for i in range(100)))
+        shards = p.shards(4)
+        self.assertEqual(4, len(shards))
+        self.assertEqual([str(i) for i in range(100)],
+                         [l.strip() for s in shards for l in s.lines()])
+
+    def test_pmap(self):
+        "Map over shards"
+        p = Path(self.tmpath)
+        p.write(''.join('{0}\n'.format(i) for i in range(100)))
+        results = p.pmap(lambda lines: sum(int(l) for l in lines),
+                         workers=2, mode='thread')
+        self.assertEqual(sum(range(100)), sum(results))
+
+    def test_pmap_encoding(self):
+        "Pass the encoding through"
+        p = Path(self.tmpath)
+        with open(self.tmpath, 'wb') as fh:
+            fh.write(b'caf\xe9\n')
+        self.assertEqual([[b'caf\xe9\n']], p.pmap(list, workers=1, mode='thread', encoding=None))
+        self.assertEqual([[u'caf\xe9\n']], p.pmap(list, workers=1, mode='thread',
+                                                   encoding='latin-1'))
+
+    def test_inappropriate(self):
+        "Raise for directories and nonexistant files"
+        with self.assertRaises(exceptions.InappropriateError):
+            Path(self.tdir).shards()
+        with self.assertRaises(exceptions.DoesNotExistError):
+            Path(tempfile.mktemp()).pmap(len)
+
+    def test_grep(self):
+        "Grep a file or directory"
+        p = Path(self.tdir) / 'numbers'
+        p.write('one\ntwo\nthree\n')
+        self.assertEqual([(p, 2, 'two'), (p, 3, 'three')],
+                         list(p.grep('t', workers=1)))
+        matches = list(Path(self.tdir).grep('^thr', mode='thread'))
+        self.assertEqual([(p, 3, 'three')], matches)
+        self.assertIsInstance(matches[0][0], Path)
+
+class DuTestCase(PathTestCase):
+
+    def test_du(self):
+        "Disk usage of a tree"
+        p = Path(self.tdir)
+        (p / 'sub/file').write('x' * 100)
+        total, byname = p.du(breakdown=True)
+        self.assertEqual(1, total.files)
+        self.assertEqual([p / 'sub'], list(byname))
+        self.assertIsInstance(list(byname)[0], Path)
+        self.assertEqual(total.files, p.du().files)
+
+    def test_du_nonexistant(self):
+        "Raise for nonexistant paths"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            Path(tempfile.mktemp()).du()
+
+class CachedPathTestCase(PathTestCase):
+
+    def test_shared_cache(self):
+        "CachedPaths share one caching filesystem"
+        p = CachedPath(self.tdir)
+        self.assertIs(p.fs, CachedPath(self.tmpath).fs)
+        self.assertIsInstance(p.fs, filesystem.CachingFilesystem)
+        self.assertIsInstance(p / 'child', CachedPath)
+
+    def test_sees_own_changes(self):
+        "Changes made through CachedPaths invalidate the cache"
+        child = CachedPath(self.tdir) / 'child'
+        self.assertFalse(child)
+        child.touch()
+        self.assertTrue(child)
+        self.assertTrue(child.is_file)
+        child.rm()
+        self.assertFalse(child)
+
+class LogicalCwdTestCase(PathTestCase):
+
+    def test_enter_directory(self):
+        "With LOGICAL_CD, entering a directory leaves the process alone"
+        startdir = os.getcwd()
+        with patch('ffs.nix.LOGICAL_CD', True):
+            with Path(self.tdir):
+                self.assertEqual(startdir, os.getcwd())
+                self.assertEqual(self.tdir, Path())
+                here = Path('here.txt')
+                here << 'hello'
+                self.assertEqual('hello', here.contents)
+                self.assertEqual(os.path.join(self.tdir, 'here.txt'), here.abspath)
+        self.assertEqual(startdir, Path())
+        self.assertTrue(os.path.isfile(os.path.join(self.tdir, 'here.txt')))
+
+class DirFDPathTestCase(PathTestCase):
+
+    def test_opendir(self):
+        "Open a directory and work beneath it"
+        sub = Path(self.tdir) / 'sub'
+        sub.mkdir()
+        opened = sub.opendir()
+        self.assertIsInstance(opened, DirFDPath)
+        self.assertIsInstance(opened.fs, filesystem.DirFDFilesystem)
+        doc = opened / 'doc.txt'
+        self.assertIsInstance(doc, DirFDPath)
+        doc << 'hello\n'
+        self.assertEqual('hello\n', doc.contents)
+        self.assertTrue(doc.is_file)
+        self.assertEqual([str(doc)], [str(p) for p in opened.ls()])
+        doc.rm()
+        self.assertFalse(doc)
+        self.assertTrue(os.path.isdir(str(sub)))
+
+    def test_opendir_errors(self):
+        "Only directories can be opened"
+        with self.assertRaises(exceptions.DoesNotExistError):
+            (Path(self.tdir) / 'nope').opendir()
+        with self.assertRaises(exceptions.InappropriateError):
+            Path(self.tmpath).opendir()
+
+class MemoryPathTestCase(unittest.TestCase):
+
+    def test_temp(self):
+        "Temporary trees live in memory"
+        with MemoryPath.temp() as tmp:
+            self.assertIsInstance(tmp, MemoryPath)
+            self.assertTrue(tmp.is_dir)
+            doc = tmp / 'sub' / 'doc.txt'
+            doc << 'hello\n'
+            doc << 'world\n'
+            self.assertFalse(os.path.exists(str(doc)))
+            self.assertEqual('hello\nworld\n', doc.contents)
+            self.assertEqual(12, doc.size)
+            self.assertEqual([tmp / 'sub'], list(tmp.ls()))
+            self.assertIsInstance(doc.parent, MemoryPath)
+        self.assertFalse(tmp)
+
+    def test_disk_helpers(self):
+        "Helpers that only work on disk raise rather than reading it"
+        with MemoryPath.temp() as tmp:
+            doc = tmp / 'doc.txt'
+            doc << 'hello\n'
+            for call in (tmp.du, lambda: tmp.grep('hello'), doc.shards,
+                         lambda: doc.pmap(len), tmp.opendir, MemoryPath.scratch):
+                with self.assertRaises(exceptions.InappropriateError):
+                    call()
+            with self.assertRaises(exceptions.InappropriateError):
+                with doc.mmap():
+                    pass
+            with self.assertRaises(exceptions.InappropriateError):
+                with doc.appender(concurrent=True):
+                    pass
+            with doc.appender() as log:
+                log.write('world\n')
+            self.assertEqual('hello\nworld\n', doc.contents)
+        with self.assertRaises(exceptions.InappropriateError):
+            MemoryPath('/etc').du()
+
+    def test_preallocate(self):
+        "Grow the file with zeros, as on disk"
+        with MemoryPath.temp() as tmp:
+            doc = tmp / 'doc.bin'
+            doc << 'abc'
+            self.assertEqual(False, doc.preallocate(6))
+            self.assertEqual('abc\0\0\0', doc.read())
+            doc.preallocate(2)
+            self.assertEqual(6, doc.size)
+            (tmp / 'new.bin').preallocate(4)
+            self.assertEqual(4, (tmp / 'new.bin').size)
+
+    def test_json_roundtrip(self):
+        "Formats work through the memory filesystem"
+        with MemoryPath.temp() as tmp:
+            (tmp / 'data.json').json_dump({'a': [1, 2]})
+            self.assertEqual({'a': [1, 2]}, (tmp / 'data.json').json_load())
+
+    def test_dump_to(self):
+        "Materialize on disk"
+        tdir = tempfile.mkdtemp()
+        try:
+            with MemoryPath.temp() as tmp:
+                (tmp / 'a' / 'b.txt') << 'b'
+                tmp.dump_to(tdir)
+            self.assertEqual('b', Path(tdir + '/a/b.txt').contents)
+            with self.assertRaises(exceptions.DoesNotExistError):
+                MemoryPath('/nope').dump_to(tdir)
+        finally:
+            rm(tdir, recursive=True)
+
 class MimetypeTestCase(PathTestCase):
     def test_mimetype(self):
         p = Path(self.tdir)/'wat.csv'
@@ -0,0 +1,364 @@
+"""
+Unittests for the ffs.writers module
+"""
+from __future__ import with_statement
+
+import errno
+import io
+import multiprocessing
+import os
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+if sys.version_info <  (2, 7):
+    import unittest2 as unittest
+
+from mock import MagicMock, patch
+
+from ffs import nix, writers
+
+def _append_records(target, worker, count):
+    "Append COUNT records of varying size to TARGET from a child process"
+    with writers.ConcurrentAppender(target, buffer_size=8192) as appender:
+        for i in range(count):
+            appender.write('{0}:{1}:{2}'.format(worker, i, 'z' * (i * 97 % 9000)))
+
+class AtomicOpenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tdir, 'target.txt')
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def test_write(self):
+        "Write a new file"
+        with writers.atomic_open(self.target) as fh:
+            fh.write('Hello Beautiful')
+        self.assertEqual('Hello Beautiful', open(self.target).read())
+        self.assertEqual(['target.txt'], os.listdir(self.tdir))
+
+    def test_not_visible_until_done(self):
+        "Readers see the old contents until we're done"
+        with open(self.target, 'w') as fh:
+            fh.write('old')
+        with writers.atomic_open(self.target) as fh:
+            fh.write('new')
+            fh.flush()
+            self.assertEqual('old', open(self.target).read())
+        self.assertEqual('new', open(self.target).read())
+
+    def test_raises(self):
+        "Leave the target alone and clean up if the block raises"
+        with open(self.target, 'w') as fh:
+            fh.write('old')
+        with self.assertRaises(RuntimeError):
+            with writers.atomic_open(self.target) as fh:
+                fh.write('new')
+                raise RuntimeError('!')
+        self.assertEqual('old', open(self.target).read())
+        self.assertEqual(['target.txt'], os.listdir(self.tdir))
+
+    def test_keeps_mode(self):
+        "Replacing a file keeps its permissions"
+        with open(self.target, 'w') as fh:
+            fh.write('old')
+        os.chmod(self.target, 0o640)
+        with writers.atomic_open(self.target) as fh:
+            fh.write('new')
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(self.target).st_mode))
+
+    def test_binary(self):
+        "Write bytes"
+        with writers.atomic_open(self.target, 'wb') as fh:
+            fh.write(b'\x00\x01')
+        self.assertEqual(b'\x00\x01', open(self.target, 'rb').read())
+
+    def test_chmod_fails(self):
+        "Clean up the temporary file if we can't set its mode"
+        with open(self.target, 'w') as fh:
+            fh.write('old')
+        with patch.object(writers.os, 'chmod', side_effect=OSError(errno.EPERM, 'nope')):
+            with self.assertRaises(OSError):
+                with writers.atomic_open(self.target) as fh:
+                    fh.write('new')
+        self.assertEqual(['target.txt'], os.listdir(self.tdir))
+
+    def test_bad_mode(self):
+        "Only whole-file modes make sense"
+        with self.assertRaises(ValueError):
+            with writers.atomic_open(self.target, 'a'):
+                pass
+
+    def test_fsync(self):
+        "Fsync the file and its directory"
+        with patch.object(writers.os, 'fsync') as pfsync:
+            with writers.atomic_open(self.target, fsync=True) as fh:
+                fh.write('durable')
+            self.assertEqual(2, pfsync.call_count)
+
+
+class FsyncBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.targets = [os.path.join(self.tdir, str(i)) for i in range(5)]
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def test_batch(self):
+        "Publish all the writes on exit"
+        with writers.fsync_batch():
+            for target in self.targets:
+                with writers.atomic_open(target) as fh:
+                    fh.write(target)
+                self.assertFalse(os.path.exists(target))
+        for target in self.targets:
+            self.assertEqual(target, open(target).read())
+
+    def test_one_directory_fsync(self):
+        "Fsync each file but the directory only once"
+        with patch.object(writers, '_fsync_dir') as pdir:
+            with writers.fsync_batch():
+                for target in self.targets:
+                    with writers.atomic_open(target, fsync=True) as fh:
+                        fh.write(target)
+            pdir.assert_called_once_with(self.tdir)
+
+    def test_raises(self):
+        "Publish nothing if the block raises"
+        with self.assertRaises(RuntimeError):
+            with writers.fsync_batch():
+                for target in self.targets:
+                    with writers.atomic_open(target) as fh:
+                        fh.write(target)
+                raise RuntimeError('!')
+        self.assertEqual([], os.listdir(self.tdir))
+
+    def test_rename_fails(self):
+        "Clean up the writes we couldn't publish"
+        with self.assertRaises(OSError):
+            with writers.fsync_batch():
+                for target in self.targets:
+                    with writers.atomic_open(target) as fh:
+                        fh.write(target)
+                os.mkdir(self.targets[2])
+        self.assertEqual(['0', '1', '2'], sorted(os.listdir(self.tdir)))
+        self.assertTrue(os.path.isdir(self.targets[2]))
+
+    def test_nested(self):
+        "Nested batches join the outer one"
+        with writers.fsync_batch():
+            with writers.fsync_batch():
+                with writers.atomic_open(self.targets[0]) as fh:
+                    fh.write('x')
+            self.assertFalse(os.path.exists(self.targets[0]))
+        self.assertTrue(os.path.exists(self.targets[0]))
+
+class AppenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tdir, 'target.log')
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def test_append(self):
+        "Append everything we're given"
+        with open(self.target, 'w') as fh:
+            fh.write('frist\n')
+        with writers.Appender(open(self.target, 'a')) as appender:
+            for i in range(100):
+                appender.write('{0}\n'.format(i))
+            appender << 'last\n'
+        expected = 'frist\n' + ''.join('{0}\n'.format(i) for i in range(100)) + 'last\n'
+        self.assertEqual(expected, open(self.target).read())
+
+    def test_batches(self):
+        "Write in BUFFER_SIZE batches"
+        fh = MagicMock()
+        appender = writers.Appender(fh, buffer_size=10)
+        for i in range(10):
+            appender.write('abcd')
+        self.assertEqual(['abcdabcdabcd'] * 3,
+                         [c[0][0] for c in fh.write.call_args_list])
+        appender.close()
+        self.assertEqual('abcd', fh.write.call_args[0][0])
+        fh.close.assert_called_once_with()
+
+    def test_bytes(self):
+        "Join bytes as bytes"
+        fh = MagicMock()
+        with writers.Appender(fh) as appender:
+            appender.write(b'a')
+            appender.write(b'b')
+        fh.write.assert_called_once_with(b'ab')
+
+    def test_closed_raises(self):
+        "Can't write once closed"
+        appender = writers.Appender(MagicMock())
+        appender.close()
+        with self.assertRaises(ValueError):
+            appender.write('hai')
+
+    def test_flush_interval(self):
+        "Flush in the background"
+        with writers.Appender(open(self.target, 'a'), flush_interval=0.01) as appender:
+            appender.write('hai')
+            for _ in range(200):
+                if open(self.target).read():
+                    break
+                time.sleep(0.01)
+            self.assertEqual('hai', open(self.target).read())
+        self.assertFalse(appender._flusher.is_alive())
+
+class ConcurrentAppenderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tdir, 'target.log')
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    def writes(self, records, **kw):
+        "Return the sizes of the writes made to append RECORDS"
+        sizes = []
+        real_write = os.write
+        def write(fd, data):
+            sizes.append(len(data))
+            return real_write(fd, data)
+        with patch.object(writers.os, 'write', side_effect=write):
+            with writers.ConcurrentAppender(self.target, **kw) as appender:
+                for record in records:
+                    appender.write(record)
+        return sizes
+
+    def test_framing(self):
+        "Frame each record, once"
+        with writers.ConcurrentAppender(self.target) as appender:
+            appender.write('one')
+            appender.write('two\n')
+            appender << b'three'
+        self.assertEqual('one\ntwo\nthree\n', open(self.target).read())
+
+    def test_no_framing(self):
+        "Leave records alone without framing"
+        with writers.ConcurrentAppender(self.target, framing=None) as appender:
+            appender.write('one')
+            appender.write('two')
+        self.assertEqual('onetwo', open(self.target).read())
+
+    def test_groups_whole_records(self):
+        "Group whole records into writes no larger than the buffer"
+        record = 'x' * 99
+        sizes = self.writes([record] * 1000, buffer_size=8192)
+        self.assertTrue(all(s <= 8192 for s in sizes))
+        self.assertTrue(all(s % 100 == 0 for s in sizes))
+        self.assertEqual(100000, os.path.getsize(self.target))
+
+    def test_small_records_lock(self):
+        "Small records take the lock too, else it would exclude nobody"
+        with patch.object(writers.fcntl, 'flock') as pflock:
+            with writers.ConcurrentAppender(self.target) as appender:
+                appender.write('small')
+            self.assertEqual([writers.fcntl.LOCK_EX, writers.fcntl.LOCK_UN],
+                             [c[0][1] for c in pflock.call_args_list])
+        self.assertEqual('small\n', open(self.target).read())
+
+    def test_large_records_lock(self):
+        "Take the lock once for a batch with large records"
+        big = 'y' * 20000
+        with patch.object(writers.fcntl, 'flock') as pflock:
+            with writers.ConcurrentAppender(self.target) as appender:
+                for _ in range(10):
+                    appender.write(big)
+                    appender.write('small')
+            self.assertEqual(2, pflock.call_count)
+        expected = (big + '\nsmall\n') * 10
+        self.assertEqual(expected, open(self.target).read())
+
+    def test_short_writes(self):
+        "Carry on after short writes"
+        real_write = os.write
+        def write(fd, data):
+            return real_write(fd, data[:3])
+        with patch.object(writers.os, 'write', side_effect=write):
+            with writers.ConcurrentAppender(self.target) as appender:
+                appender.write('Hello Beautiful')
+        self.assertEqual('Hello Beautiful\n', open(self.target).read())
+
+    def test_processes(self):
+        "Records from several processes are never torn"
+        workers = [multiprocessing.Process(target=_append_records,
+                                           args=(self.target, w, 200))
+                   for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seen = set()
+        with open(self.target) as fh:
+            for line in fh:
+                worker, i, payload = line.rstrip('\n').split(':')
+                self.assertEqual('z' * (int(i) * 97 % 9000), payload)
+                seen.add((worker, i))
+        self.assertEqual(800, len(seen))
+
+class PreallocateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tdir, 'target.txt')
+
+    def tearDown(self):
+        nix.rm_r(self.tdir)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_preallocate(self):
+        with open(self.target, 'wb') as fh:
+            self.assertTrue(writers.preallocate(fh, 100000))
+            self.assertFalse(writers.preallocate(fh, 0))
+        self.assertEqual(100000, os.path.getsize(self.target))
+
+    def test_not_on_disk(self):
+        "Files without a descriptor are left alone"
+        self.assertFalse(writers.preallocate(io.BytesIO(), 100))
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_unsupported(self):
+        "Filesystems that can't preallocate are left alone"
+        err = OSError(errno.EOPNOTSUPP, 'Not supported')
+        with patch.object(writers.os, 'posix_fallocate', side_effect=err):
+            with open(self.target, 'wb') as fh:
+                self.assertFalse(writers.preallocate(fh, 100))
+        err = OSError(errno.ENOSPC, 'No space left on device')
+        with patch.object(writers.os, 'posix_fallocate', side_effect=err):
+            with open(self.target, 'wb') as fh:
+                with self.assertRaises(OSError):
+                    writers.preallocate(fh, 100)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_sized(self):
+        "Truncate to what we wrote on the way out"
+        with open(self.target, 'w') as fh:
+            with writers.sized(fh, 100000) as sized:
+                sized.write('hai')
+                self.assertEqual(100000, os.path.getsize(self.target))
+        self.assertEqual('hai', open(self.target).read())
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'No posix_fallocate')
+    def test_sized_seek_back(self):
+        "Keep what we wrote before seeking back to fill in a header"
+        with open(self.target, 'wb') as fh:
+            with writers.sized(fh, 100000) as sized:
+                sized.write(b'\0' * 8)
+                sized.write(b'body' * 250)
+                sized.seek(0)
+                sized.write(b'HEADER!!')
+        with open(self.target, 'rb') as fh:
+            self.assertEqual(b'HEADER!!' + b'body' * 250, fh.read())
+
+if __name__ == '__main__':
+    unittest.main()